@@ -1,15 +1,18 @@
-import os, io, gzip, types, re
-import boto3, botocore
+import os, io, gzip, types, re, math, hashlib
+from statistics import NormalDist
 from collections import OrderedDict
 from io import TextIOWrapper
 from gzip import GzipFile
 from datetime import datetime
+from . import cf_metrics as MT
 
 
 __DATE_COL = 0
 __TIME_COL = 1
 __REQID_COL = 14
 
+_REGEX_META = set('.^$*+?{}[]|()')
+
 
 def __version(fd):
     line = next(iter(fd))
@@ -80,17 +83,205 @@ class AccessLogQuery():
             print(' | '.join(r))
 
 
+class Estimate():
+    '''Scaled estimate of an aggregate with a confidence interval
+
+    '''
+
+    def __init__(self, value : float, stderr : float, confidence : float):
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.value = value
+        self.stderr = stderr
+        self.confidence = confidence
+        self.low = value - z * stderr
+        self.high = value + z * stderr
+
+    def __repr__(self):
+        return '{:.6g} [{:.6g}, {:.6g}] @{:g}'.format(self.value, self.low,
+                                                    self.high, self.confidence)
+
+
+class SampledAccessLogQuery(AccessLogQuery):
+    '''Query results computed over a stratified random sample
+
+    `rows` holds the matching sampled rows only. Totals over the full
+    data are estimated with `count` and `sum`
+
+    '''
+
+    def __init__(self, rows, headers):
+        super().__init__(rows, headers)
+        # List of [population size, sample size, matching row count]
+        self.strata = []
+
+    def add_stratum(self, population : int, sample : int, rows : list):
+        '''Append results of one sampled stratum
+
+        @param {int} population number of rows in the stratum
+        @param {int} sample number of rows sampled from the stratum
+        @param {list} rows sampled rows matching the query
+        @return {SampledAccessLogQuery} self
+        '''
+        self.strata.append([population, sample, len(rows)])
+        self.rows += rows
+        return self
+
+    def concatenate(self, other):
+        self.rows += other.rows
+        self.strata += other.strata
+        return self
+
+    def _estimate(self, values, confidence):
+        # Stratified estimator of a population total where `values`
+        # holds the sampled values of the matching rows per stratum
+        total = 0.0
+        variance = 0.0
+        for (N, n, m), ys in zip(self.strata, values):
+            if n == 0:
+                continue
+            s = sum(ys)
+            mean = s / n
+            total += N * mean
+            if n > 1:
+                # Non-matching sampled rows contribute zeros
+                ss = sum((y - mean) ** 2 for y in ys) + (n - m) * mean ** 2
+                variance += N * N * (1 - n / N) * ss / (n - 1) / n
+        return Estimate(total, math.sqrt(variance), confidence)
+
+    def _stratum_rows(self):
+        start = 0
+        for N, n, m in self.strata:
+            yield self.rows[start:start + m]
+            start += m
+
+    def count(self, confidence : float = 0.95):
+        '''Return the estimated number of matching rows
+
+        @param {float} confidence confidence level of the interval
+        @return {Estimate} scaled count
+        '''
+        values = [[1] * len(rows) for rows in self._stratum_rows()]
+        return self._estimate(values, confidence)
+
+    def sum(self, column : str, confidence : float = 0.95):
+        '''Return the estimated sum of a numeric column over matching rows
+
+        The column must be one of the selected columns. Non-numeric
+        values, e.g. '-', count as 0
+
+        @param {str} column column name, e.g. 'sc-bytes'
+        @param {float} confidence confidence level of the interval
+        @return {Estimate} scaled sum
+        '''
+        index = self.headers.index(column)
+        values = [[float(r[index]) if r[index].replace('.', '', 1).isdigit() else 0.0
+                   for r in rows]
+                  for rows in self._stratum_rows()]
+        return self._estimate(values, confidence)
+
+
+class Equals():
+    '''Condition matching values equal to `value`
+
+    Can be used in place of a regex in `where` conditions
+
+    '''
+
+    def __init__(self, value : str):
+        self.value = str(value)
+
+    def search(self, value : str):
+        return value == self.value
+
+    def __repr__(self):
+        return 'Equals({!r})'.format(self.value)
+
+
+class Between():
+    '''Condition matching values in the closed range [low, high]
+
+    If the bounds are numbers, values are compared numerically and
+    non-numeric values never match. Otherwise, values are compared
+    as strings. Either bound may be None for an open range
+
+    '''
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.numeric = isinstance(low, (int, float)) or isinstance(high, (int, float))
+
+    def search(self, value : str):
+        if self.numeric:
+            try:
+                value = float(value)
+            except ValueError:
+                return False
+        if self.low is not None and value < self.low:
+            return False
+        if self.high is not None and value > self.high:
+            return False
+        return True
+
+    def __repr__(self):
+        return 'Between({!r}, {!r})'.format(self.low, self.high)
+
+
+def regex_literal(expr : str):
+    '''Return the literal matched by an anchored regex, if any
+
+    @param {str} expr regex, e.g. `^200$` or `^/img/`
+    @return {tuple} (literal, exact) where exact is False for a prefix
+            match, or None if expr is not an anchored literal
+    '''
+    if not expr.startswith('^'):
+        return None
+    exact = expr.endswith('$') and not expr.endswith('\\$')
+    body = expr[1:-1] if exact else expr[1:]
+    literal = []
+    escaped = False
+    for ch in body:
+        if escaped:
+            if ch.isalnum():
+                return None
+            literal.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in _REGEX_META:
+            return None
+        else:
+            literal.append(ch)
+    if escaped:
+        return None
+    return ''.join(literal), exact
+
+
+def compile_condition(expr):
+    '''Return a matcher for a `where` condition value
+
+    @param {str|Equals|Between} expr regex string or condition object
+    @return {object} object whose `search(value)` is truthy on match
+    '''
+    if isinstance(expr, str):
+        return re.compile(expr)
+    return expr
+
+
 def query_match(row, conditions):
     '''Determine if condtions in row are satisified
 
     @param {list} row list of column values
     @param {dict} conditions key-value map, where key is the row
                   index, and value is the corresponding regex search
-                  value
+                  value, or a compiled condition
 
     '''
     for index, expr in conditions.items():
-        if re.search(expr, row[index]) is None:
+        if isinstance(expr, str):
+            if re.search(expr, row[index]) is None:
+                return False
+        elif not expr.search(row[index]):
             return False
     return True
 
@@ -127,7 +318,7 @@ class AccessLog():
         return ret
 
     @staticmethod
-    def load(fd):
+    def load(fd, workers : int = 1, chunk_bytes : int = None, pool = None):
         '''Load contents of a accesslog file
 
         Input function must support getting lines line by line, e.g.
@@ -136,21 +327,67 @@ class AccessLog():
           - text file object,
           - array of content
 
+        With `workers` > 1, binary streams are decompressed in chunks of
+        whole lines, which are parsed in as many worker processes
+
+        @sa cf_parallel.load
         @param {iterator-liek} file object-like descriptor
+        @param {int} workers number of parsing processes
+        @param {int} chunk_bytes decompressed bytes parsed per worker
+               task, `cf_parallel.CHUNK_BYTES` by default
+        @param {ProcessPoolExecutor} pool pool of `workers` processes
+               to reuse, one is started per call by default
         @return {AccessLog} sorted data as a new AcessLog object
         '''
 
         nfd = fd
+        binary = fd
         if ((isinstance(fd, gzip.GzipFile)) or (isinstance(fd, io.BytesIO))):
             nfd = TextIOWrapper(fd)
-        elif isinstance(fd, botocore.response.StreamingBody):
-            gzipped = GzipFile(None, 'rb', fileobj=fd)
-            nfd = TextIOWrapper(gzipped)
+        elif hasattr(fd, 'read') and not isinstance(fd, io.TextIOBase):
+            # Other binary streams, e.g. a botocore StreamingBody, are
+            # gzipped objects. Duck-typed so that botocore is not imported
+            binary = GzipFile(None, 'rb', fileobj=fd)
+            nfd = TextIOWrapper(binary)
+        else:
+            binary = None
+
+        if workers > 1 and binary is not None:
+            from . import cf_parallel as PL
+            return PL.load(binary, workers, chunk_bytes, pool=pool)
 
         ver, head, rows_ = parse(nfd)
         ret = AccessLog(ver, head, rows_)
         return ret.sort()
 
+    @staticmethod
+    def loads(data : bytes, metrics : MT.Metrics = MT.NULL, workers : int = 1,
+              chunk_bytes : int = None, pool = None):
+        '''Load contents of an accesslog file from bytes
+
+        @sa load
+        @param {bytes} data file content, gzipped or not
+        @param {Metrics} metrics sink timing the decompress, parse and
+               sort stages
+        @param {int} workers number of parsing processes
+        @param {int} chunk_bytes decompressed bytes parsed per worker task
+        @param {ProcessPoolExecutor} pool pool of `workers` processes to
+               reuse, one is started per call by default
+        @return {AccessLog} sorted data as a new AcessLog object
+        '''
+        if workers > 1:
+            from . import cf_parallel as PL
+            return PL.loads(data, workers, chunk_bytes, metrics, pool)
+        if data[:2] == b'\x1f\x8b':
+            with metrics.timer('decompress'):
+                data = gzip.decompress(data)
+        metrics.inc('bytes_decompressed', len(data))
+        with metrics.timer('parse'):
+            ver, head, rows_ = parse(TextIOWrapper(io.BytesIO(data)))
+        metrics.inc('rows_parsed', len(rows_))
+        with metrics.timer('sort'):
+            return AccessLog(ver, head, rows_).sort()
+
     def sort(self):
         '''Sort the contents of the access log by date and time
 
@@ -181,6 +418,14 @@ class AccessLog():
         self.rows += other.rows
         return self
 
+    def record_key(self, row : list):
+        '''Return the identity of a record, as used to remove duplicates
+
+        @param {list} row access log record
+        @return {str} request ID, date and time of the record
+        '''
+        return row[self.reqid_col] + row[self.date_col] + row[self.time_col]
+
     def remove_duplicates(self):
         '''Remove duplicate keys
 
@@ -192,11 +437,7 @@ class AccessLog():
         '''
         od = OrderedDict()
         for row in self.rows:
-            # Use reqid, date and time for the key
-            key = row[self.reqid_col] \
-                + row[self.date_col] \
-                + row[self.time_col]
-            od[key] = row
+            od[self.record_key(row)] = row
 
         uniques = []
         for k, row in od.items():
@@ -263,13 +504,28 @@ class AccessLog():
         for row in self.rows:
             fd.write(bytearray('{}\n'.format('\t'.join(row)), 'utf-8'))
 
-    def select(self, columns, conditions):
+    def dumps(self, sort_data=True):
+        '''Return gzipped accesslog file data
+
+        @sa dump
+        @param {bool} sort_data if true, sorts data before dumping
+        @return {bytes} file content
+        '''
+        bytes_ = io.BytesIO()
+        with gzip.GzipFile(fileobj=bytes_, mode='wb') as fd:
+            self.dump(fd, sort_data)
+        return bytes_.getvalue()
+
+    def select(self, columns, conditions, limit : int = None,
+               reverse : bool = False):
         '''Return specified columns matching conditions
 
         @param {list} columns names to include in results. Use `*` to
                       include all
         @param {dict} conditions column-regex key-value pairs to serve
                       as WHERE clause
+        @param {int} limit stop after this many matching rows, if any
+        @param {bool} reverse scan rows from last to first
         @return {AccessLogQuery} results matching the query or None
 
         '''
@@ -289,10 +545,14 @@ class AccessLog():
         select_cols = [self.column_map[x] for x in columns]
         # Filter the results row by row
         _rows = []
-        for row in self.rows:
+        if limit is not None and limit <= 0:
+            return AccessLogQuery(_rows, columns)
+        for row in (reversed(self.rows) if reverse else self.rows):
             if not query_match(row, indexed_conditions):
                 continue
             _rows.append([row[x] for x in select_cols])
+            if limit is not None and len(_rows) >= limit:
+                break
         return AccessLogQuery(_rows, columns)
 
 
@@ -308,7 +568,7 @@ def group_by_date_generator(access_log: AccessLog):
     N = access_log.record_count()
 
     if N < 1:
-        raise StopIteration()
+        return
 
     T = access_log.rows[0][__DATE_COL]
     rec_buffer = []
@@ -328,6 +588,88 @@ def group_by_date_generator(access_log: AccessLog):
                         rec_buffer)
 
 
+def group_by_hour_generator(access_log: AccessLog):
+    '''Generator for outputting records from the same date and hour
+
+    Starts at the top of the log, and yields logs that have the same
+    date and hour till end of the log. Does not explicitely sort the
+    data
+
+    @param {AccessLog} access_log input accesslog
+    @return {Generator} new accesslog with records in the same hour
+    '''
+    N = access_log.record_count()
+
+    if N < 1:
+        return
+
+    hour = lambda row: (row[__DATE_COL], row[__TIME_COL][:2])
+    T = hour(access_log.rows[0])
+    rec_buffer = []
+    for i in range(N):
+        if (hour(access_log.rows[i]) == T):
+            rec_buffer.append(access_log.rows[i])
+        else:
+            yield AccessLog(access_log.version,
+                            access_log.headers,
+                            rec_buffer)
+            rec_buffer = [access_log.rows[i]]
+            T = hour(access_log.rows[i])
+
+    if len(rec_buffer) > 0:
+        yield AccessLog(access_log.version,
+                        access_log.headers,
+                        rec_buffer)
+
+
+def merge_log(log : AccessLog, metrics : MT.Metrics = MT.NULL):
+    '''Sort records and remove duplicates, e.g. after concatenation
+
+    @param {AccessLog} log access log, modified in place
+    @param {Metrics} metrics sink of the merge timing and dropped
+           duplicates
+    @return {AccessLog} log
+    '''
+    n = log.record_count()
+    with metrics.timer('merge'):
+        log.sort().remove_duplicates()
+    metrics.inc('duplicates_dropped', n - log.record_count())
+    return log
+
+
+def has_new_records(log : AccessLog, existing : AccessLog):
+    '''Return whether `log` has records missing from `existing`
+
+    Records are compared by request ID, date and time. Merging a log
+    without new records into a sorted, deduplicated one leaves the
+    latter unchanged, since `remove_duplicates` keeps the last copy
+
+    @param {AccessLog} log records to be merged
+    @param {AccessLog} existing stored records
+    @return {bool} true if merging would add records
+    '''
+    keys = set(map(existing.record_key, existing.rows))
+    return any(log.record_key(row) not in keys for row in log.rows)
+
+
+def content_digest(log : AccessLog):
+    '''Return a digest of the records of a sorted, deduplicated log
+
+    Used to detect overwrites with unchanged content. Rows are hashed
+    as written by `dump`, so that the digest does not depend on gzip
+
+    @param {AccessLog} log access log
+    @return {str} row count and hex digest
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    h.update('{}\n{}'.format(log.version, ' '.join(log.headers)).encode('utf-8'))
+    rows = log.rows
+    for i in range(0, len(rows), 4096):
+        block = '\n'.join(['\t'.join(r) for r in rows[i:i + 4096]])
+        h.update(b'\n' + block.encode('utf-8'))
+    return '{}-{}'.format(len(rows), h.hexdigest())
+
+
 def pop_first_differing_dates(log: AccessLog):
     '''Remove first set of records that have the same date different from
     others
@@ -1,4 +1,10 @@
-from .cf_accesslog import AccessLog
+import math, random
+from collections import deque
+from datetime import datetime, timedelta
+from .cf_accesslog import AccessLogQuery, SampledAccessLogQuery
+from .cf_rollup import RollupTable, RollupQuery
+from .cf_resultcache import plan_key
+from . import cf_sketch as SK
 
 
 
@@ -8,6 +14,12 @@ class AccessLogSelector():
         self.conditions = {}
         self.store = store
         self.drange = None
+        self.trange = None
+        self.sampling = None
+        self.descending = False
+        self.row_limit = None
+        self.result_cache = None
+        self.sink = None
 
     def where(self, conditions):
         '''Specify selection queries via a key-value store
@@ -34,23 +46,371 @@ class AccessLogSelector():
         self.drange = drange
         return self
 
+    def timerange(self, trange):
+        '''Specify a time range with second resolution
+
+        Times must be in `YYYY-mm-dd HH:MM:SS` format. The range is
+        half-open, i.e. [t0, t1). Also sets the date range to the
+        dates spanned by the times
+
+        Currently used by `rollup` only
+
+        @param {list} trange a 2-tuple containing times
+        @return {AccessLogSelector} self
+
+        '''
+        self.trange = trange
+        self.drange = [trange[0][:10], trange[1][:10]]
+        return self
+
+    def order_by(self, column : str, desc : bool = False):
+        '''Specify result ordering
+
+        Only ordering by record time is supported. Records are stored
+        sorted by time, so descending order walks keys newest-first and
+        each log from its end
+
+        @param {str} column must be 'time'
+        @param {bool} desc newest records first if true
+        @return {AccessLogSelector} self
+        '''
+        if column != 'time':
+            raise ValueError('Can only order by time, not {}'.format(column))
+        self.descending = desc
+        return self
+
+    def limit(self, n : int):
+        '''Return at most `n` records
+
+        Logs are read only until `n` matching records are collected
+
+        @param {int} n maximum number of records
+        @return {AccessLogSelector} self
+        '''
+        self.row_limit = n
+        return self
+
+    def cache(self, result_cache):
+        '''Reuse per-key results of identical queries
+
+        Results of each key are cached with the fingerprint of its data,
+        so that repeated executions recompute only keys whose data has
+        changed since
+
+        @param {QueryResultCache} result_cache cache to use, may be
+               shared between selectors
+        @return {AccessLogSelector} self
+        '''
+        self.result_cache = result_cache
+        return self
+
+    def metrics(self, sink):
+        '''Record the rows returned per key into `sink`
+
+        Reads and filtering are recorded by the store into its own
+        sink, which is also the default of the selector
+
+        @param {Metrics} sink metrics sink
+        @return {AccessLogSelector} self
+        '''
+        self.sink = sink
+        return self
+
+    def _metrics(self):
+        return self.store.metrics if self.sink is None else self.sink
+
+    def _select_key(self, key : str, limit : int):
+        if self.result_cache is None:
+            return self.store.select_key(key, self.columns, self.conditions,
+                                         limit=limit, reverse=self.descending)
+
+        fingerprint = self.store.fingerprint(key)
+        plan = plan_key(self.columns, self.conditions,
+                        limit=limit, reverse=self.descending)
+        if fingerprint is not None:
+            ret = self.result_cache.get(plan, key, fingerprint)
+            if ret is not None:
+                self._metrics().inc('result_cache_hits')
+                return ret
+
+        ret = self.store.select_key(key, self.columns, self.conditions,
+                                    limit=limit, reverse=self.descending)
+        if ret is not None and fingerprint is not None:
+            self.result_cache.put(plan, key, fingerprint, ret)
+        return ret
+
+    def keys(self):
+        '''Return the store keys covered by the date range, if any
+
+        @return {list} sorted list of keys
+        '''
+        if self.drange is None:
+            return self.store.list_keys()
+        return self.store.list_keys(date_range=self.drange)
+
+    def sample(self, fraction : float = None, rows : int = None, seed=None):
+        '''Run the query over a stratified random sample of the records
+
+        Each access log in the date range is a stratum. With
+        `fraction`, that fraction of every log is sampled; with `rows`,
+        the row budget is split evenly across the logs. `execute` then
+        returns a `SampledAccessLogQuery` whose `count`/`sum` are
+        scaled to the full data, with confidence intervals
+
+        @param {float} fraction fraction of rows to sample, in (0, 1]
+        @param {int} rows total number of rows to sample
+        @param {any} seed random seed, for reproducible samples
+        @return {AccessLogSelector} self
+        '''
+        if (fraction is None) == (rows is None):
+            raise ValueError('Exactly one of fraction or rows is required')
+        self.sampling = {'fraction': fraction, 'rows': rows, 'seed': seed}
+        return self
+
+    def _execute_sampled(self):
+        keys = self.keys()
+        rng = random.Random(self.sampling['seed'])
+        fraction = self.sampling['fraction']
+        if fraction is None:
+            per_key = math.ceil(self.sampling['rows'] / max(len(keys), 1))
+
+        def sampler(N):
+            if fraction is None:
+                n = min(per_key, N)
+            else:
+                n = min(N, int(round(fraction * N)))
+            return sorted(rng.sample(range(N), n))
+
+        ret = None
+        for k in keys:
+            # Stores decode only the sampled rows where they can
+            sampled = self.store.sample_key(k, self.columns, self.conditions, sampler)
+            if sampled is None:
+                continue
+            N, n, log_q = sampled
+            if ret is None:
+                ret = SampledAccessLogQuery([], log_q.headers)
+            ret.add_stratum(N, n, log_q.rows)
+        return ret
+
     def execute(self):
         '''Run the generated query and return the results
 
+        @sa sample
         @return {AccessLogQuery} results matching the query or None
         '''
+        if self.sampling is not None:
+            return self._execute_sampled()
 
-        if self.drange is None:
-            list_keys = self.store.list_keys()
-        else:
-            list_keys = self.store.list_keys(date_range=self.drange)
+        keys = self.keys()
+        if self.descending:
+            keys = keys[::-1]
+
+        ret = None
+        remaining = self.row_limit
+        metrics = self._metrics()
+        for k in keys:
+            log_q = self._select_key(k, remaining)
+            metrics.inc('keys_scanned')
+            if log_q is None:
+                continue
+            metrics.inc('rows_filtered', len(log_q.rows))
+            if ret is None:
+                ret = log_q
+            else:
+                ret = ret.concatenate(log_q)
+            if remaining is not None:
+                remaining -= len(log_q.rows)
+                if remaining <= 0:
+                    break
+        return ret
+
+    async def stream_async(self, window : int = None):
+        '''Async generator yielding the results of every key, in key order
+
+        Up to `window` keys are read and filtered concurrently, bounded
+        by the I/O limit of the store. Results are the same as those of
+        `execute`, split per key; keys after the row limit is reached
+        may be read but are not returned
+
+        @sa DataStoreBase.enable_async
+        @param {int} window keys selected ahead, the I/O concurrency of
+               the store by default
+        @return {AsyncGenerator} AccessLogQuery of every key with results
+        '''
+        import asyncio
+        keys = await self.store.run_io(self.keys)
+        if self.descending:
+            keys = keys[::-1]
+        keys = iter(keys)
+        window = window or self.store.io_concurrency
+
+        remaining = self.row_limit
+        metrics = self._metrics()
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < window:
+                    k = next(keys, None)
+                    if k is None:
+                        break
+                    pending.append(asyncio.ensure_future(
+                        self.store.run_io(self._select_key, k, remaining)))
+                if not pending:
+                    break
+                log_q = await pending.popleft()
+                metrics.inc('keys_scanned')
+                if log_q is None:
+                    continue
+                if remaining is not None:
+                    # Limits of keys selected ahead did not count the
+                    # rows of the keys before them
+                    if len(log_q.rows) > remaining:
+                        log_q = AccessLogQuery(log_q.rows[:remaining], log_q.headers)
+                    remaining -= len(log_q.rows)
+                metrics.inc('rows_filtered', len(log_q.rows))
+                yield log_q
+                if remaining is not None and remaining <= 0:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def execute_async(self):
+        '''Same as `execute`, without blocking the event loop
 
+        @sa stream_async
+        @return {AccessLogQuery} results matching the query or None
+        '''
+        if self.sampling is not None:
+            return await self.store.run_io(self._execute_sampled)
         ret = None
-        for k in list_keys:
-            log = self.store.access_log(k)
-            log_q = log.select(self.columns, self.conditions)
+        async for log_q in self.stream_async():
             if ret is None:
                 ret = log_q
             else:
                 ret = ret.concatenate(log_q)
         return ret
+
+    def sketch(self, column : str):
+        '''Return the merged sketch of `column` over the date range
+
+        Uses the per-key sketch sidecars maintained by the store when
+        there are no `where` conditions. With conditions, sketches are
+        computed from the matching rows of each access log instead
+
+        @sa DataStoreBase.enable_sketches
+        @param {str} column column name
+        @return {ColumnSketch} merged sketch, None if no data
+        '''
+        merged = {}
+        for k in self.keys():
+            if not self.conditions:
+                sketches = self.store.sketches(k, [column])
+            else:
+                log = self.store.access_log(k)
+                if log is None:
+                    continue
+                rows = log.select('*', self.conditions).rows
+                sketches = SK.build_sketches(log, [column], rows)
+            SK.merge_sketches(merged, sketches)
+        return merged.get(column)
+
+    def approx_distinct(self, column : str):
+        '''Return the approximate number of distinct values of `column`
+
+        @param {str} column column name, e.g. 'c-ip'
+        @return {int} estimated distinct count
+        '''
+        sketch = self.sketch(column)
+        if sketch is None:
+            return 0
+        return sketch.hll.count()
+
+    def top_k(self, column : str, k : int):
+        '''Return the approximate k most frequent values of `column`
+
+        Counts are over-estimates bounded by the count-min error
+
+        @param {str} column column name, e.g. 'cs-uri-stem'
+        @param {int} k number of values to return
+        @return {list} list of (value, count) tuples, most frequent first
+        '''
+        sketch = self.sketch(column)
+        if sketch is None:
+            return []
+        return sketch.cms.top_k(k)
+
+    def _hour_overlap(self, date : str, hour : str):
+        '''Classify an hour against the time range
+
+        @return {int} 1 if fully inside the range, 0 if partially
+                inside, -1 if outside
+        '''
+        if self.trange is None:
+            return 1
+        t0 = '{} {}:00:00'.format(date, hour)
+        t1 = datetime.strptime(t0, '%Y-%m-%d %H:%M:%S') + timedelta(hours=1)
+        t1 = t1.strftime('%Y-%m-%d %H:%M:%S')
+        if t0 >= self.trange[0] and t1 <= self.trange[1]:
+            return 1
+        if t1 <= self.trange[0] or t0 >= self.trange[1]:
+            return -1
+        return 0
+
+    def _in_range(self, log, row):
+        if self.trange is None:
+            return True
+        t = '{} {}'.format(row[log.date_col], row[log.time_col])
+        return self.trange[0] <= t < self.trange[1]
+
+    def rollup(self, group_by : list = ('date', 'hour')):
+        '''Return hourly aggregates over the date or time range
+
+        Whole hours are read from the rollup sidecars maintained by the
+        store. Raw access logs are scanned only for hours that are cut
+        by the time range, for keys without a rollup sidecar, or when
+        `where` conditions are specified
+
+        @sa DataStoreBase.enable_rollups
+        @param {list} group_by subset of 'date', 'hour', 'status' and
+                      'edge' to aggregate on
+        @return {RollupQuery} rows of dimension values followed by
+                requests, bytes, errors, hits, error-rate and hit-ratio
+        '''
+        table = RollupTable()
+        for k in self.keys():
+            if self.conditions:
+                log = self.store.access_log(k)
+                if log is None:
+                    continue
+                rows = [r for r in log.select('*', self.conditions).rows
+                        if self._in_range(log, r)]
+                table.merge(RollupTable.from_log(log, rows))
+                continue
+
+            whole = {}
+            partial = set()
+            overlaps = {}
+            for key, values in self.store.rollup(k).entries.items():
+                hour = (key[0], key[1])
+                if hour not in overlaps:
+                    overlaps[hour] = self._hour_overlap(*hour)
+                if overlaps[hour] == 1:
+                    whole[key] = values
+                elif overlaps[hour] == 0:
+                    partial.add(hour)
+            table.merge(RollupTable(whole))
+
+            if partial:
+                log = self.store.access_log(k)
+                if log is None:
+                    # Deleted or archived away since the rollup was read
+                    continue
+                rows = [r for r in log.rows
+                        if (r[log.date_col], r[log.time_col][:2]) in partial
+                        and self._in_range(log, r)]
+                table.merge(RollupTable.from_log(log, rows))
+
+        return RollupQuery(table.group(group_by), group_by)
+
@@ -1,10 +1,64 @@
 #!/usr/bin/python3
 
+import time
+from collections import deque
 from . import cf_accesslog as AL
+from . import cf_partition as PT
+from . import cf_lease as LL
+from . import cf_metrics as MT
 
 
 
-def archive(keys : list, InDataStore, OutDataStore, delete_from_instore : bool = False):
+def write_partitions(log, OutDataStore, distribution : str = None,
+                     merge : bool = False, metrics : MT.Metrics = None):
+    '''Split sorted records into the partitions of a store and write them
+
+    @param {AccessLog} log sorted access log
+    @param {DataStoreBase} OutDataStore output archive data store
+    @param {str} distribution distribution ID of the records
+    @param {bool} merge merge with existing data, overwrite otherwise
+    @param {Metrics} metrics sink, that of OutDataStore by default
+    @return None
+    '''
+    if metrics is None:
+        metrics = OutDataStore.metrics
+    for part in OutDataStore.grouper_generator()(log):
+        out_key = OutDataStore.item_key(part.rows[0], distribution)
+        if merge:
+            existing_rec = OutDataStore.access_log(out_key)
+            if existing_rec is not None:
+                if not AL.has_new_records(part, existing_rec):
+                    # Already archived, e.g. by a rerun
+                    metrics.inc('writes_skipped')
+                    continue
+                part.concatenate(existing_rec)
+        AL.merge_log(part, metrics)
+        OutDataStore.overwrite(out_key, part)
+        metrics.inc('rows_written', part.record_count())
+
+
+def distribution_groups(keys : list, OutDataStore):
+    '''Group keys by the distribution ID in their names, if needed
+
+    @param {list} keys list of CloudFront log keys
+    @param {DataStoreBase} OutDataStore output archive data store
+    @return {dict} distribution ID to list of keys map, in key order;
+            a single None entry unless OutDataStore partitions by
+            distribution
+    '''
+    if not OutDataStore.partitioning.by_distribution:
+        return {None: keys}
+    groups = {}
+    for key in keys:
+        distribution = PT.distribution_id(key)
+        if distribution is None:
+            raise ValueError('No distribution ID in key {}'.format(key))
+        groups.setdefault(distribution, []).append(key)
+    return groups
+
+
+def archive(keys : list, InDataStore, OutDataStore, delete_from_instore : bool = False,
+            metrics : MT.Metrics = None):
     '''Fetch accesslog data from bucket, parse, store
 
     It's highly recommended for object_list to be sorted in the order
@@ -12,11 +66,19 @@ def archive(keys : list, InDataStore, OutDataStore, delete_from_instore : bool =
     the OutDataStore is S3, it can result in unexpected behavior due
     to its eventual-consistency behavior.
 
+    If OutDataStore partitions by distribution, keys are processed per
+    distribution ID, taken from the CloudFront key names
+
+    Fetching, parsing and writing are recorded by the stores into their
+    own metrics sinks, see `DataStoreBase.enable_metrics`
+
     @param {list} keys list of keys to process
     @param {DataStoreBase} InDataStore input archive data store
     @param {DataStoreBase} OutDataStore output archive data store
     @param {bool} delete_from_instore specifies whether processed
                   files are removed from instore
+    @param {Metrics} metrics sink of the sort and merge stages, that
+                     of OutDataStore by default
     @return {list} list of keys that were processed
 
     '''
@@ -27,6 +89,32 @@ def archive(keys : list, InDataStore, OutDataStore, delete_from_instore : bool =
         print('Nothing to do')
         return delete_list
 
+    for distribution, group_keys in distribution_groups(keys, OutDataStore).items():
+        delete_list += archive_distribution(group_keys, InDataStore,
+                                            OutDataStore, distribution, metrics)
+
+    if delete_from_instore:
+        InDataStore.delete_list(keys=delete_list)
+
+    return delete_list
+
+
+def archive_distribution(keys : list, InDataStore, OutDataStore,
+                         distribution : str = None, metrics : MT.Metrics = None):
+    '''Fetch, parse and store accesslog data of a single distribution
+
+    @sa archive
+    @param {list} keys list of keys to process
+    @param {DataStoreBase} InDataStore input archive data store
+    @param {DataStoreBase} OutDataStore output archive data store
+    @param {str} distribution distribution ID of the keys, if
+                 partitioned by distribution
+    @param {Metrics} metrics sink, that of OutDataStore by default
+    @return {list} list of keys that were processed
+    '''
+    if metrics is None:
+        metrics = OutDataStore.metrics
+    processed = []
     log = None
     for i, key in enumerate(keys):
         print ('processing {}'.format(key))
@@ -41,26 +129,246 @@ def archive(keys : list, InDataStore, OutDataStore, delete_from_instore : bool =
         else:
             log = log.concatenate(access_log)
 
-        # Dump the first records belonging to the same date
+        # Dump the first records belonging to the same date. Merged
+        # with existing data, which earlier runs may have written
         dump_log = AL.pop_first_differing_dates(log)
         if dump_log is not None:
-            dump_log.sort().remove_duplicates()
-            out_key = OutDataStore.item_key(dump_log.rows[0])
-            OutDataStore.overwrite(out_key, dump_log)
+            with metrics.timer('sort'):
+                dump_log.sort()
+            write_partitions(dump_log, OutDataStore, distribution, True, metrics)
 
         # Mark the S3 object for deletion
-        delete_list.append(key)
+        processed.append(key)
 
     # Dump remainder data to file
-    if log.record_count() > 0:
-        out_key = OutDataStore.item_key(log.rows[0])
-        existing_rec = OutDataStore.access_log(out_key)
-        if existing_rec is not None:
-            log.concatenate(existing_rec)
-        log.sort().remove_duplicates()
-        OutDataStore.overwrite(out_key, log)
+    if log is not None and log.record_count() > 0:
+        with metrics.timer('sort'):
+            log.sort()
+        write_partitions(log, OutDataStore, distribution, True, metrics)
+
+    return processed
+
+
+def _sort(log, metrics : MT.Metrics):
+    with metrics.timer('sort'):
+        return log.sort()
+
+
+def _merge_partition(part, existing, metrics : MT.Metrics):
+    # Merge a partition with existing data, None if it adds no records
+    if existing is not None:
+        if not AL.has_new_records(part, existing):
+            return None
+        part.concatenate(existing)
+    return AL.merge_log(part, metrics)
+
+
+async def write_partitions_async(log, OutDataStore, distribution : str = None,
+                                 merge : bool = False, metrics : MT.Metrics = None):
+    '''Same as `write_partitions`, without blocking the event loop
+
+    Partitions are written concurrently
+
+    @sa write_partitions
+    @return None
+    '''
+    import asyncio
+    if metrics is None:
+        metrics = OutDataStore.metrics
+
+    async def write(part):
+        out_key = OutDataStore.item_key(part.rows[0], distribution)
+        existing = None
+        if merge:
+            existing = await OutDataStore.access_log_async(out_key)
+        part = await OutDataStore.run_cpu(_merge_partition, part, existing, metrics)
+        if part is None:
+            # Already archived, e.g. by a rerun
+            metrics.inc('writes_skipped')
+            return
+        await OutDataStore.overwrite_async(out_key, part)
+        metrics.inc('rows_written', part.record_count())
+
+    await asyncio.gather(*[write(part)
+                           for part in OutDataStore.grouper_generator()(log)])
+
+
+async def archive_async(keys : list, InDataStore, OutDataStore,
+                        delete_from_instore : bool = False,
+                        metrics : MT.Metrics = None, window : int = None):
+    '''Same as `archive`, without blocking the event loop
+
+    Up to `window` input keys are fetched and parsed ahead, bounded by
+    the I/O limit of InDataStore, while earlier records are merged and
+    written. Records are combined in key order, as by `archive`
+
+    @sa archive
+    @sa DataStoreBase.enable_async
+    @param {list} keys list of keys to process
+    @param {DataStoreBase} InDataStore input archive data store
+    @param {DataStoreBase} OutDataStore output archive data store
+    @param {bool} delete_from_instore specifies whether processed
+                  files are removed from instore
+    @param {Metrics} metrics sink of the sort and merge stages, that
+                     of OutDataStore by default
+    @param {int} window keys fetched ahead, the I/O concurrency of
+           InDataStore by default
+    @return {list} list of keys that were processed
+    '''
+    import asyncio
+    if metrics is None:
+        metrics = OutDataStore.metrics
+    window = window or InDataStore.io_concurrency
+    delete_list = []
+
+    if len(keys) == 0:
+        print('Nothing to do')
+        return delete_list
+
+    for distribution, group_keys in distribution_groups(keys, OutDataStore).items():
+        log = None
+        pending = deque()
+        group_keys = iter(group_keys)
+        try:
+            while True:
+                while len(pending) < window:
+                    key = next(group_keys, None)
+                    if key is None:
+                        break
+                    pending.append((key, asyncio.ensure_future(
+                        InDataStore.access_log_async(key))))
+                if not pending:
+                    break
+                key, future = pending.popleft()
+                print ('processing {}'.format(key))
+                access_log = await future
+                if access_log is None:
+                    continue
+
+                log = access_log if log is None else log.concatenate(access_log)
+                dump_log = AL.pop_first_differing_dates(log)
+                if dump_log is not None:
+                    await OutDataStore.run_cpu(_sort, dump_log, metrics)
+                    await write_partitions_async(dump_log, OutDataStore, distribution,
+                                                 True, metrics)
+                delete_list.append(key)
+        finally:
+            for key, future in pending:
+                future.cancel()
+
+        if log is not None and log.record_count() > 0:
+            await OutDataStore.run_cpu(_sort, log, metrics)
+            await write_partitions_async(log, OutDataStore, distribution, True, metrics)
 
     if delete_from_instore:
-        InDataStore.delete_list(keys=delete_list)
+        await InDataStore.run_io(InDataStore.delete_list, keys=delete_list)
 
     return delete_list
+
+
+def archive_shared(keys : list, InDataStore, OutDataStore,
+                   delete_from_instore : bool = False, owner : str = None,
+                   ttl : float = 300, poll : float = 1):
+    '''Archive keys in cooperation with other workers sharing the stores
+
+    Keys are sharded by distribution ID and delivery hour, taken from
+    the CloudFront key names. A worker processes only the shards whose
+    lease it acquires in OutDataStore, skipping shards claimed by
+    others. Each output partition is read, merged and written while
+    holding the lease of its key, so concurrent writers of the same
+    partition never lose each other's records
+
+    Shard leases are renewed between keys and partitions, so `ttl`
+    must only exceed the time needed to fetch a key or store a
+    partition; a worker that dies holding a lease blocks the shard or
+    partition until it expires. A worker whose shard lease was taken
+    over abandons the shard. Released shard leases record the keys
+    stored, which later workers skip; shards with keys delivered late,
+    or whose read failed, are processed again and merged without
+    duplicating records. Keys that could not be read are neither
+    deleted nor returned
+
+    @sa archive
+    @param {list} keys list of CloudFront log keys to process
+    @param {DataStoreBase} InDataStore input archive data store
+    @param {DataStoreBase} OutDataStore output archive data store,
+                           holding the leases
+    @param {bool} delete_from_instore remove processed keys from
+                  instore, once their shard is stored
+    @param {str} owner worker ID, unique to this process by default
+    @param {float} ttl lease duration in seconds
+    @param {float} poll seconds between attempts on a busy partition
+    @return {list} list of keys that were processed by this worker
+
+    '''
+    if owner is None:
+        owner = LL.default_owner()
+
+    shards = {}
+    for key in keys:
+        shard = LL.shard_of(key)
+        if shard is None:
+            raise ValueError('Not a CloudFront log key {}'.format(key))
+        shards.setdefault(shard, []).append(key)
+
+    processed = []
+    for shard, shard_keys in sorted(shards.items(), key=lambda x: x[0][-13:]):
+        lease = 'shard/' + shard
+        # Read before acquiring, which replaces the released lease
+        last = OutDataStore.read_lease(lease) or {}
+        done = set(last.get('done', []))
+        if done.issuperset(shard_keys):
+            print('skipping {}, already archived'.format(shard))
+            continue
+        if not OutDataStore.acquire_lease(lease, owner, ttl):
+            print('skipping {}, claimed by another worker'.format(shard))
+            continue
+
+        def renew():
+            if not OutDataStore.acquire_lease(lease, owner, ttl):
+                raise LL.LeaseLost(lease)
+
+        try:
+            distribution = None
+            if OutDataStore.partitioning.by_distribution:
+                distribution = PT.distribution_id(shard_keys[0])
+            log = None
+            # Keys whose log was read; the others stay pending for a retry
+            read = []
+            for key in shard_keys:
+                renew()
+                print ('processing {}'.format(key))
+                access_log = InDataStore.access_log(key)
+                if access_log is None:
+                    continue
+                read.append(key)
+                log = access_log if log is None else log.concatenate(access_log)
+
+            if log is not None and log.record_count() > 0:
+                with OutDataStore.metrics.timer('sort'):
+                    log.sort()
+                for part in OutDataStore.grouper_generator()(log):
+                    out_key = OutDataStore.item_key(part.rows[0], distribution)
+                    partition_lease = 'partition/' + out_key
+                    renew()
+                    while not OutDataStore.acquire_lease(partition_lease, owner, ttl):
+                        time.sleep(poll)
+                        renew()
+                    try:
+                        OutDataStore.store_partition(out_key, part, distribution)
+                    finally:
+                        OutDataStore.release_lease(partition_lease, owner)
+
+            renew()
+            if delete_from_instore and read:
+                InDataStore.delete_list(keys=read)
+            processed += read
+        except LL.LeaseLost:
+            print('abandoning {}, lease taken over'.format(shard))
+            continue
+        except BaseException:
+            OutDataStore.release_lease(lease, owner)
+            raise
+        OutDataStore.release_lease(lease, owner, sorted(done.union(read)))
+
+    return processed
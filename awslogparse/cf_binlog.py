@@ -0,0 +1,226 @@
+import os, sys, json, mmap, struct, bisect
+from array import array
+from .cf_accesslog import AccessLog, AccessLogQuery, compile_condition
+
+
+SIDECAR_SUFFIX = '.bin'
+
+MAGIC = b'CFBL'
+FORMAT_VERSION = 1
+# magic, format version, byte order, source mtime (ns), source size,
+# header length
+PREAMBLE = struct.Struct('<4sIBqqI')
+# per column: offsets position, arena position, arena length
+COLUMN_ENTRY = struct.Struct('<QQQ')
+
+# Rows decoded at a time by `BinaryLog.select`
+BLOCK_ROWS = 4096
+
+
+def dumps(log : AccessLog, fingerprint : tuple):
+    '''Serialize an access log into the binary column layout
+
+    The layout is a preamble, a json header, a column directory, and
+    per column a table of `nrows + 1` byte offsets followed by a byte
+    arena holding the tab-terminated utf-8 values. Rows are stored in
+    their current order, which is expected to be sorted
+
+    @param {AccessLog} log data to serialize
+    @param {tuple} fingerprint (mtime in ns, size) of the source file
+                   the data was written to
+    @return {bytes} serialized content
+    '''
+    header = json.dumps({'version': log.version,
+                         'headers': log.headers,
+                         'nrows': log.record_count()}).encode('utf-8')
+    # Keep offset tables 8-byte aligned
+    header += b' ' * (-(PREAMBLE.size + len(header)) % 8)
+    ncols = len(log.headers)
+    byteorder = 0 if sys.byteorder == 'little' else 1
+
+    parts = [PREAMBLE.pack(MAGIC, FORMAT_VERSION, byteorder,
+                           fingerprint[0], fingerprint[1], len(header)),
+             header]
+    pos = PREAMBLE.size + len(header) + ncols * COLUMN_ENTRY.size
+    directory = []
+    blobs = []
+    for c in range(ncols):
+        values = [row[c].encode('utf-8') + b'\t' if c < len(row) else b'\t'
+                  for row in log.rows]
+        offsets = array('Q', [0])
+        total = 0
+        for v in values:
+            total += len(v)
+            offsets.append(total)
+        offsets_bytes = offsets.tobytes()
+        arena = b''.join(values)
+        padding = b'\0' * (-len(arena) % 8)
+        directory.append(COLUMN_ENTRY.pack(pos, pos + len(offsets_bytes), len(arena)))
+        blobs += [offsets_bytes, arena, padding]
+        pos += len(offsets_bytes) + len(arena) + len(padding)
+
+    return b''.join(parts + directory + blobs)
+
+
+class BinaryLog():
+    '''Memory-mapped reader of the binary column layout
+
+    Values are decoded lazily, per column and per block of rows
+
+    '''
+
+    def __init__(self, fd, map_, mm, header : dict, columns : list):
+        self.fd = fd
+        self.map = map_
+        self.mm = mm
+        self.version = header['version']
+        self.headers = header['headers']
+        self.nrows = header['nrows']
+        self.column_map = {h: i for i, h in enumerate(self.headers)}
+        self.offsets = [mm[p:a].cast('Q') for p, a, n in columns]
+        self.arenas = [(a, n) for p, a, n in columns]
+
+    @staticmethod
+    def open(path : str, fingerprint : tuple):
+        '''Open a binary log file if it matches the source fingerprint
+
+        @param {str} path binary log file path
+        @param {tuple} fingerprint (mtime in ns, size) of the source,
+               None if the source does not exist
+        @return {BinaryLog} reader, None if missing, stale or unreadable
+        '''
+        if fingerprint is None:
+            # Left behind by a removed source
+            return None
+        try:
+            fd = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        map_ = None
+        mm = None
+        try:
+            map_ = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            mm = memoryview(map_)
+            magic, ver, byteorder, mtime, size, hlen = PREAMBLE.unpack_from(mm)
+            native = 0 if sys.byteorder == 'little' else 1
+            if (magic != MAGIC or ver != FORMAT_VERSION or byteorder != native
+                    or (mtime, size) != tuple(fingerprint)):
+                raise ValueError('Stale or incompatible binary log')
+            pos = PREAMBLE.size
+            header = json.loads(bytes(mm[pos:pos + hlen]).decode('utf-8'))
+            pos += hlen
+            columns = []
+            for c in range(len(header['headers'])):
+                columns.append(COLUMN_ENTRY.unpack_from(mm, pos))
+                pos += COLUMN_ENTRY.size
+            return BinaryLog(fd, map_, mm, header, columns)
+        except (ValueError, struct.error, OSError):
+            if mm is not None:
+                mm.release()
+            if map_ is not None:
+                map_.close()
+            fd.close()
+            return None
+
+    def close(self):
+        for offsets in self.offsets:
+            offsets.release()
+        self.offsets = []
+        self.mm.release()
+        self.map.close()
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def column(self, index : int, start : int = 0, stop : int = None):
+        '''Decode values of a column for rows [start, stop)
+
+        @param {int} index column index
+        @param {int} start first row
+        @param {int} stop end row, defaults to the number of rows
+        @return {list} list of strings
+        '''
+        if stop is None:
+            stop = self.nrows
+        if stop <= start:
+            return []
+        offsets = self.offsets[index]
+        pos = self.arenas[index][0]
+        raw = self.mm[pos + offsets[start]:pos + offsets[stop]]
+        return str(raw, 'utf-8').split('\t')[:-1]
+
+    def access_log(self):
+        '''Decode all rows into an AccessLog
+
+        @return {AccessLog} log with rows in stored order
+        '''
+        cols = [self.column(i) for i in range(len(self.headers))]
+        rows = [list(r) for r in zip(*cols)] if cols else []
+        return AccessLog(self.version, self.headers, rows)
+
+    def select(self, columns, conditions : dict, limit : int = None,
+               reverse : bool = False, indices : list = None):
+        '''Same as `AccessLog.select`, decoding only the needed columns
+
+        Rows are processed in blocks; condition columns are decoded
+        first, and selected columns only for blocks with matches
+
+        @param {list} columns names to include in results, or `*`
+        @param {dict} conditions column-regex key-value pairs
+        @param {int} limit stop after this many matching rows, if any
+        @param {bool} reverse scan rows from last to first
+        @param {list} indices sorted row indices to scan, all by
+               default; blocks without any are not decoded
+        @return {AccessLogQuery} results matching the query
+        '''
+        if (columns == '*') or (columns == '[*]'):
+            columns = self.headers
+
+        exprs = [(self.column_map[c], compile_condition(v))
+                 for c, v in conditions.items()]
+        select_cols = [self.column_map[x] for x in columns]
+
+        starts = range(0, self.nrows, BLOCK_ROWS)
+        if reverse:
+            starts = reversed(starts)
+
+        rows = []
+        if limit is not None and limit <= 0:
+            return AccessLogQuery(rows, columns)
+        for start in starts:
+            stop = min(start + BLOCK_ROWS, self.nrows)
+            decoded = {}
+            matches = range(stop - start)
+            if indices is not None:
+                # Decode only the span of the block holding sampled rows
+                sampled = indices[bisect.bisect_left(indices, start):
+                                  bisect.bisect_left(indices, stop)]
+                if not sampled:
+                    continue
+                start, stop = sampled[0], sampled[-1] + 1
+                matches = [i - start for i in sampled]
+            for index, expr in exprs:
+                if index not in decoded:
+                    decoded[index] = self.column(index, start, stop)
+                values = decoded[index]
+                matches = [i for i in matches if expr.search(values[i])]
+                if not matches:
+                    break
+            if not matches:
+                continue
+
+            for index in select_cols:
+                if index not in decoded:
+                    decoded[index] = self.column(index, start, stop)
+            if reverse:
+                matches = reversed(matches)
+            for i in matches:
+                rows.append([decoded[x][i] for x in select_cols])
+                if limit is not None and len(rows) >= limit:
+                    return AccessLogQuery(rows, columns)
+        return AccessLogQuery(rows, columns)
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from .cf_accesslog import AccessLog
+
+
+# Rough CPython object overheads used to estimate memory usage
+STR_OVERHEAD = 49
+LIST_OVERHEAD = 56
+POINTER_SIZE = 8
+
+
+def log_size(log : AccessLog):
+    '''Return an estimate of the memory used by the rows of a log, in bytes
+
+    @param {AccessLog} log
+    @return {int} estimated size in bytes
+    '''
+    size = LIST_OVERHEAD
+    for row in log.rows:
+        size += LIST_OVERHEAD + POINTER_SIZE * (len(row) + 1)
+        for cell in row:
+            size += STR_OVERHEAD + len(cell)
+    return size
+
+
+def copy_log(log : AccessLog):
+    '''Return a copy of `log` that can be modified without affecting it
+
+    AccessLog methods replace or reorder the row list, but never modify
+    rows in place, so the rows themselves are shared
+
+    @param {AccessLog} log
+    @return {AccessLog} copy
+    '''
+    return AccessLog(log.version, list(log.headers), list(log.rows))
+
+
+class AccessLogCache():
+    '''Size-bounded LRU cache of parsed access logs
+
+    Entries are stored with a fingerprint of the source object, e.g.
+    modification time or ETag, so that callers can detect stale
+    entries. Safe to use from multiple threads
+
+    '''
+
+    def __init__(self, max_bytes : int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key : str):
+        '''Return the cached entry of `key`, if any
+
+        @param {str} key store key
+        @return {tuple} (fingerprint, AccessLog) with a copy of the
+                cached log, or None
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            fingerprint, log, size = entry
+        return fingerprint, copy_log(log)
+
+    def get(self, key : str, fingerprint):
+        '''Return a copy of the cached log if its fingerprint matches
+
+        @param {str} key store key
+        @param {any} fingerprint current fingerprint of the source
+        @return {AccessLog} cached log, None if missing or stale
+        '''
+        entry = self.lookup(key)
+        if entry is None or entry[0] != fingerprint:
+            return None
+        return entry[1]
+
+    def put(self, key : str, fingerprint, log : AccessLog):
+        '''Insert or replace the entry of `key`
+
+        Least recently used entries are evicted to stay within the
+        size budget. Logs larger than the budget are not cached
+
+        @param {str} key store key
+        @param {any} fingerprint fingerprint of the source
+        @param {AccessLog} log parsed log, copied before caching
+        @return None
+        '''
+        size = log_size(log)
+        log = copy_log(log)
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (fingerprint, log, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                k, (_, _, s) = self.entries.popitem(last=False)
+                self.size -= s
+
+    def invalidate(self, key : str):
+        '''Drop the entry of `key`, if any
+
+        @param {str} key store key
+        @return None
+        '''
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
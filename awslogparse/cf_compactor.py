@@ -0,0 +1,189 @@
+import io, re, bz2, gzip, json, lzma, struct
+from datetime import datetime
+from .cf_accesslog import AccessLog
+
+
+# Extension of month archives, e.g. 2019/01/2019-01.cfa
+ARCHIVE_EXTENSION = '.cfa'
+
+MAGIC = b'CFMA'
+# index length, magic
+TRAILER = struct.Struct('<Q4s')
+# Bytes read from the end of an archive to locate its index; covers
+# the index of a full month in a single read
+TAIL_BYTES = 64 * 1024
+
+# codec name: (compress(data, level), decompress(data), default level)
+CODECS = {
+    'xz': (lambda data, level: lzma.compress(data, preset=level),
+           lzma.decompress, 9),
+    'bz2': (lambda data, level: bz2.compress(data, level),
+            bz2.decompress, 9),
+    'gz': (lambda data, level: gzip.compress(data, level),
+           gzip.decompress, 9),
+}
+
+_MEMBER_RE = re.compile(r'(\d{4}-\d{2}-\d{2}(?:-\d{2})?)(?!.*\d{4}-\d{2}-\d{2})')
+
+
+def key_member(key : str):
+    '''Return the archive member name of a key, i.e. its last
+    YYYY-mm-dd or, for hourly partitions, YYYY-mm-dd-HH substring
+
+    @param {str} key stored key, e.g. db/2019/01/2019-01-02.gz
+    @return {str} member name, None if not a day or hour key
+    '''
+    match = _MEMBER_RE.search(key)
+    return None if match is None else match.group(1)
+
+
+def month_archive_key(key : str, extension : str):
+    '''Return the key of the month archive that may hold day `key`
+
+    The archive sits next to the day files of the month, e.g.
+    db/2019/01/2019-01-02.gz -> db/2019/01/2019-01.cfa
+
+    @param {str} key day key
+    @param {str} extension extension of day keys
+    @return {str} archive key, None if `key` is not a day key
+    '''
+    match = re.search(r'(\d{4}-\d{2})-\d{2}(?:-\d{2})?' + re.escape(extension) + '$',
+                      key)
+    if match is None:
+        return None
+    return key[:match.start()] + match.group(1) + ARCHIVE_EXTENSION
+
+
+def member_key(archive_key : str, name : str, extension : str):
+    '''Return the key of an archive member, i.e. the inverse of
+    `key_member` and `month_archive_key`
+
+    @param {str} archive_key archive key, e.g. db/2019/01/2019-01.cfa
+    @param {str} name member name, e.g. 2019-01-02
+    @param {str} extension extension of day keys
+    @return {str} key of the member, e.g. db/2019/01/2019-01-02.gz
+    '''
+    return archive_key[:-len('YYYY-mm' + ARCHIVE_EXTENSION)] + name + extension
+
+
+def pack(members : dict, codec : str):
+    '''Assemble an archive from compressed per-day members
+
+    Members are concatenated in date order and followed by a json
+    index of their offsets and lengths, and the trailer
+
+    @param {dict} members member name to compressed member bytes map
+    @param {str} codec codec the members were compressed with
+    @return {bytes} archive content
+    '''
+    days = {}
+    parts = []
+    pos = 0
+    for date in sorted(members):
+        data = members[date]
+        days[date] = [pos, len(data)]
+        parts.append(data)
+        pos += len(data)
+    index = json.dumps({'codec': codec, 'days': days}).encode('utf-8')
+    return b''.join(parts) + index + TRAILER.pack(len(index), MAGIC)
+
+
+def dumps(logs : dict, codec : str = 'xz', level : int = None):
+    '''Serialize access logs of several days into a month archive
+
+    Each day is compressed separately, so a single day can be read
+    from the archive without decompressing the others
+
+    @param {dict} logs member name, e.g. date, to AccessLog map
+    @param {str} codec one of `CODECS`
+    @param {int} level compression level, codec maximum by default
+    @return {bytes} archive content
+    '''
+    compress, decompress, default_level = CODECS[codec]
+    if level is None:
+        level = default_level
+    members = {}
+    for date, log in logs.items():
+        fd = io.BytesIO()
+        log.dump(fd)
+        members[date] = compress(fd.getvalue(), level)
+    return pack(members, codec)
+
+
+def read_index(read):
+    '''Read the index of an archive
+
+    @param {function} read read(start, length) returning archive bytes;
+                      a negative start reads from the end
+    @return {dict} index with `codec` and `days` member name to
+            [offset, length] map, None if the archive does not exist
+    '''
+    tail = read(-TAIL_BYTES, None)
+    if tail is None:
+        return None
+    length, magic = TRAILER.unpack(tail[-TRAILER.size:])
+    if magic != MAGIC:
+        raise ValueError('Not a month archive')
+    if length + TRAILER.size > len(tail):
+        tail = read(-(length + TRAILER.size), None)
+    index = tail[-TRAILER.size - length:-TRAILER.size]
+    return json.loads(index.decode('utf-8'))
+
+
+def decode_member(codec : str, data : bytes):
+    '''Decompress and parse a single day of an archive
+
+    @param {str} codec codec recorded in the archive index
+    @param {bytes} data compressed member
+    @return {AccessLog} access log of the day
+    '''
+    return AccessLog.loads(CODECS[codec][1](data))
+
+
+def compact(store, before : str = None, codec : str = 'xz', level : int = None):
+    '''Roll day files of closed months into month archives
+
+    For every month before `before` that still has day files, all days
+    of the month, from either tier, are written into a single archive
+    at a higher compression level, after which the day files are
+    removed. Archived days remain accessible through the same keys
+
+    @param {DataStoreBase} store store with an archive tier, e.g.
+                           DataStoreLocal or DataStoreS3
+    @param {str} before first month to leave untouched, in YYYY-mm
+                 format. Defaults to the current (UTC) month
+    @param {str} codec one of `CODECS`
+    @param {int} level compression level, codec maximum by default
+    @return {list} keys of the archives that were written
+    '''
+    if before is None:
+        before = datetime.utcnow().strftime('%Y-%m')
+
+    months = {}
+    for key in store.list_day_keys():
+        name = key_member(key)
+        archive_key = store.archive_key(key)
+        if archive_key is None:
+            raise ValueError('Store has no archive tier')
+        if name[:7] < before:
+            months.setdefault(archive_key, []).append(key)
+
+    ret = []
+    for archive_key, keys in sorted(months.items()):
+        logs = {}
+        index = store.archive_index(archive_key) or {'days': {}}
+        for name in index['days']:
+            logs[name] = store.archived_log(member_key(archive_key, name,
+                                                       store.extension))
+        for key in keys:
+            log = store.access_log(key)
+            if log is not None and log.record_count() > 0:
+                logs[key_member(key)] = log
+
+        # The archive is complete before any day file is removed, so
+        # an interruption leaves the days readable from either tier
+        store.write_archive(archive_key, dumps(logs, codec, level))
+        for key in keys:
+            store.drop_day(key)
+        ret.append(archive_key)
+    return ret
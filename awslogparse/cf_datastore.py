@@ -1,8 +1,28 @@
-import os, itertools, abc
-import botocore, boto3
+import os, json, itertools, abc, functools, weakref, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from . import cf_accesslog as AL
+from . import cf_sketch as SK
+from .cf_rollup import RollupTable
+from . import cf_rollup as RU
 from .cf_accesslog import AccessLog
 from .cf_accesslogselector import AccessLogSelector
+from .cf_cache import AccessLogCache
+from . import cf_compactor as CP
+from . import cf_partition as PT
+from .cf_partition import PartitionScheme
+from . import cf_metrics as MT
+from . import cf_parallel as PL
+from .cf_rawlog import RawLog
+from . import cf_profile as PF
+
+
+# First line of sidecars checked against the fingerprint of their key
+SIDECAR_HEADER = b'#Fingerprint: '
+
+
+# Guards the lazy start of the parse worker pools
+_POOL_LOCK = threading.Lock()
 
 
 class DataStoreBase(abc.ABC):
@@ -10,6 +30,37 @@ class DataStoreBase(abc.ABC):
 
     '''
 
+    # Columns for which per-key sketches are maintained on overwrite
+    sketch_columns = ()
+    # Whether per-key hourly rollups are maintained on overwrite
+    rollups_enabled = False
+    # In-process cache of parsed access logs, if enabled
+    cache = None
+    # Whether overwritten logs are put into `cache`
+    cache_writes = False
+    # How records are split into keys, one key per day by default
+    partitioning = PartitionScheme()
+    # Sink of I/O counters and stage timings, discarded by default
+    metrics = MT.NULL
+    # Worker processes parsing chunks of a log, 1 to parse in-process
+    parse_workers = 1
+    # Decompressed bytes per worker task, if parsing in workers
+    parse_chunk_bytes = None
+    # Process pool of the parse workers, started on first use
+    parse_executor = None
+    # Whether overwrites with the stored content are skipped
+    skip_unchanged = False
+    # Whether `overwrite` writes the output of `encode_log` with
+    # `write_log`, so that async overwrites compress in the executor
+    encoded_writes = False
+    # Blocking I/O calls run concurrently by the async methods
+    io_concurrency = 8
+    # Executor of CPU-bound work of the async methods, that of the
+    # event loop by default
+    cpu_executor = None
+    # Semaphores bounding I/O calls, per event loop
+    io_semaphores = None
+
     def __init__(self):
         return
 
@@ -26,13 +77,16 @@ class DataStoreBase(abc.ABC):
         return None
 
     @abc.abstractmethod
-    def item_key(self, row : list):
+    def item_key(self, row : list, distribution : str = None):
         '''Return the key used or would-be-used for storage of a accesslog row
 
         Implement this function to specify how the records are
         stored. Default implementation uses the date as the record key
 
+        @sa partitioning
         @param {list} row Access log record as a list
+        @param {str} distribution distribution ID of the record, used
+                     by per-distribution partitions
         @return {str} item key used for storage of the row data
 
         '''
@@ -91,55 +145,828 @@ class DataStoreBase(abc.ABC):
         @return True if successful, false otherwise
 
         '''
-        for k in keys:
+        for k in kwargs['keys']:
             self.delete(k)
         return True
 
     def grouper_generator(self):
         '''Generator specifying how records are grouped in storage
 
-        Default implementation groups accesslog records by date
+        Default implementation groups accesslog records by the
+        partitions of `partitioning`, i.e. by date unless configured
 
-        @param TODO
-        @return TODO
+        @sa PartitionScheme
+        @return {function} generator taking an AccessLog and yielding
+                an AccessLog per partition
 
         '''
-        return AL.group_by_date_generator
+        return self.partitioning.grouper_generator()
 
-    def store(self, access_log : AccessLog):
+    def store(self, access_log : AccessLog, distribution : str = None,
+              workers : int = 1):
         '''Write accesslog data to file
 
-        Will merge with existing data, if any
+        Will merge with existing data, if any. Records of the same key
+        are merged before writing, so each key has a single writer
+
+        With `workers` > 1, the read, merge and write cycles of the
+        keys run in a thread pool, overlapping S3 round trips and gzip
+        work. Threads are used rather than processes since stores hold
+        clients and connections that can not be sent to other processes
 
         @param {AccessLog} access_log
+        @param {str} distribution distribution ID of the records,
+                     required by per-distribution partitions
+        @param {int} workers number of keys written concurrently
         @return None
 
         '''
         if (access_log.record_count() == 0):
             return
 
-        for log in self.grouper_generator(access_log):
+        partitions = OrderedDict()
+        for log in self.grouper_generator()(access_log):
             # Try block in case the log data is incomplete
             try:
-                location_key = self.item_key(log.rows[0])
+                location_key = self.item_key(log.rows[0], distribution)
             except:
                 continue
+            if location_key in partitions:
+                partitions[location_key].concatenate(log)
+            else:
+                partitions[location_key] = log
+
+        if workers <= 1 or len(partitions) <= 1:
+            for location_key, log in partitions.items():
+                self.store_partition(location_key, log, distribution)
+            return
 
-            # If encountered error while trying to open existing log,
-            # e.g. no file, bad content, etc, ignore existing data
-            try:
-                existing_log = self.access_log(location_key)
-                # TODO: better to rename mergesort to append and follow it with sort -> remove_dup
-                log.concatenate(existing_log)
-            except:
-                pass
-
-            log.sort().remove_duplicates()
-            # get new key -- should be as before if logs weren't
-            # manually modified
-            location_key = self.item_key(log.rows[0])
-            self.overwrite(location_key, log)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.store_partition, location_key, log,
+                                   distribution)
+                       for location_key, log in partitions.items()]
+            # Propagate errors of any of the writes
+            for future in futures:
+                future.result()
         return
 
+    def store_partition(self, location_key : str, log : AccessLog,
+                        distribution : str = None):
+        '''Merge the records of a single key with existing data and write
+
+        @sa store
+        @param {str} location_key key of the records
+        @param {AccessLog} log records belonging to `location_key`
+        @param {str} distribution distribution ID of the records
+        @return None
+        '''
+        # If encountered error while trying to open existing log,
+        # e.g. no file, bad content, etc, ignore existing data
+        try:
+            existing_log = self.access_log(location_key)
+        except:
+            existing_log = None
+        if existing_log is not None and not AL.has_new_records(log, existing_log):
+            # Nothing to merge, e.g. a rerun over the same source logs
+            self.metrics.inc('writes_skipped')
+            return
+        try:
+            # TODO: better to rename mergesort to append and follow it with sort -> remove_dup
+            log.concatenate(existing_log)
+        except:
+            pass
+
+        AL.merge_log(log, self.metrics)
+        # get new key -- should be as before if logs weren't
+        # manually modified
+        location_key = self.item_key(log.rows[0], distribution)
+        self.overwrite(location_key, log)
+        self.metrics.inc('rows_written', log.record_count())
+
     def select(self, columns):
         return AccessLogSelector(columns, self)
+
+    def read_log(self, key : str):
+        '''Return the stored content of key, if supported
+
+        Used by `select_key` to filter over bytes, decoding only the
+        returned fields. Logs are expected to be stored sorted
+
+        @param {str} key lookup key
+        @return {bytes} file content, gzipped or not, None if not
+                supported by the store or if no day file exists
+        '''
+        return None
+
+    def raw_log(self, key : str):
+        '''Return the undecoded log associated with key, if supported
+
+        @sa read_log
+        @sa cf_rawlog
+        @param {str} key lookup key
+        @return {RawLog} indexed log, None if `read_log` returns None
+        '''
+        data = self.read_log(key)
+        if data is None:
+            return None
+        return RawLog.loads(data, self.metrics)
+
+    def decode_log(self, data : bytes):
+        '''Parse the content returned by `read_log`
+
+        @param {bytes} data file content
+        @return {AccessLog} sorted log
+        '''
+        return AccessLog.loads(data, self.metrics, self.parse_workers,
+                               self.parse_chunk_bytes, self.parse_pool())
+
+    def encode_log(self, log : AccessLog):
+        '''Return the content `log` is stored as
+
+        @param {AccessLog} log log to write, sorted by this call
+        @return {bytes} gzipped file content
+        '''
+        with self.metrics.timer('compress'):
+            return log.dumps()
+
+    def write_log(self, key : str, data : bytes, log : AccessLog, digest : str = None):
+        '''Write the output of `encode_log` to key
+
+        Implemented by stores with `encoded_writes`, whose `overwrite`
+        is `unchanged`, `encode_log` and `write_log` in turn
+
+        @param {str} key key the log is written to
+        @param {bytes} data encoded content of `log`
+        @param {AccessLog} log written log, kept in caches and sidecars
+        @param {str} digest content digest to record, if any
+        @return None
+        '''
+        raise NotImplementedError('Store does not write encoded logs')
+
+    def enable_async(self, io_concurrency : int = 8, executor = None):
+        '''Configure the async methods
+
+        Async methods run blocking I/O calls of the store in the default
+        executor of the event loop, at most `io_concurrency` at a time,
+        and parsing and compression in `executor`. The store is shared
+        with the threads of both, as with `store(workers=...)`
+
+        @param {int} io_concurrency number of concurrent I/O calls
+        @param {Executor} executor thread pool of CPU-bound work, that
+               of the event loop by default. zlib releases the GIL, and
+               parsing can use processes with `enable_parallel_parsing`
+        @return {DataStoreBase} self
+        '''
+        self.io_concurrency = io_concurrency
+        self.cpu_executor = executor
+        self.io_semaphores = None
+        return self
+
+    def io_semaphore(self):
+        '''Return the semaphore bounding I/O calls in the running loop
+
+        @return {asyncio.BoundedSemaphore} semaphore
+        '''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.io_semaphores is None:
+            self.io_semaphores = weakref.WeakKeyDictionary()
+        semaphore = self.io_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.io_semaphores[loop] = asyncio.BoundedSemaphore(
+                self.io_concurrency)
+        return semaphore
+
+    async def run_io(self, fn, *args, **kwargs):
+        '''Run a blocking I/O call in the default executor
+
+        @param {function} fn function to call
+        @return {any} return value of fn
+        '''
+        import asyncio
+        async with self.io_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(fn, *args, **kwargs))
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        '''Run CPU-bound work in `cpu_executor`
+
+        @param {function} fn function to call
+        @return {any} return value of fn
+        '''
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(
+            self.cpu_executor, functools.partial(fn, *args, **kwargs))
+
+    async def access_log_async(self, key : str):
+        '''Same as `access_log`, without blocking the event loop
+
+        Without a parsed-log cache, the content from `read_log` is
+        parsed in the CPU executor, outside of the I/O limit. Other
+        reads run `access_log` as a whole
+
+        @sa enable_async
+        @param {str} key lookup key
+        @return {AccessLog} access log associated with the key, if any
+        '''
+        if self.cache is None:
+            data = await self.run_io(self.read_log, key)
+            if data is not None:
+                return await self.run_cpu(self.decode_log, data)
+        return await self.run_io(self.access_log, key)
+
+    async def overwrite_async(self, key : str, log : AccessLog):
+        '''Same as `overwrite`, without blocking the event loop
+
+        Stores with `encoded_writes` compress in the CPU executor,
+        outside of the I/O limit
+
+        @sa enable_async
+        @param {str} key key used to locate access log data
+        @param {AccessLog} log data to write
+        @return None
+        '''
+        if not self.encoded_writes:
+            return await self.run_io(self.overwrite, key, log)
+        digest, skip = await self.run_io(self.unchanged, key, log)
+        if skip:
+            return
+        data = await self.run_cpu(self.encode_log, log)
+        await self.run_io(self.write_log, key, data, log, digest)
+
+    def select_key(self, key : str, columns, conditions : dict,
+                   limit : int = None, reverse : bool = False):
+        '''Run a selection over the records associated with `key`
+
+        Default implementation selects over the bytes of the log from
+        `read_log` when no parsed-log cache is enabled, in worker
+        processes if enabled, and otherwise delegates to
+        `AccessLog.select`. Stores with faster access paths for
+        selections override this
+
+        @sa AccessLog.select
+        @param {str} key key used to locate the access log
+        @param {list} columns names to include in results, or `*`
+        @param {dict} conditions column-regex key-value pairs
+        @param {int} limit stop after this many matching rows, if any
+        @param {bool} reverse scan rows from last to first
+        @return {AccessLogQuery} results, None if no records exist
+        '''
+        if self.cache is None and self.parse_workers > 1:
+            data = self.read_log(key)
+            if data is not None:
+                return PL.selects(data, columns, conditions, self.parse_workers,
+                                  self.parse_chunk_bytes, limit, reverse, self.metrics,
+                                  self.parse_pool())
+        elif self.cache is None:
+            raw = self.raw_log(key)
+            if raw is not None:
+                with self.metrics.timer('filter'):
+                    return raw.select(columns, conditions, limit=limit, reverse=reverse)
+        log = self.access_log(key)
+        if log is None:
+            return None
+        with self.metrics.timer('filter'):
+            return log.select(columns, conditions, limit=limit, reverse=reverse)
+
+    def sample_key(self, key : str, columns, conditions : dict, sampler):
+        '''Run a selection over a random sample of the records of `key`
+
+        Default implementation samples the rows of the log from
+        `raw_log` when no parsed-log cache is enabled, decoding only
+        the fields of sampled rows, and otherwise of `access_log`
+
+        @sa AccessLogSelector.sample
+        @param {str} key key used to locate the access log
+        @param {list} columns names to include in results, or `*`
+        @param {dict} conditions column-regex key-value pairs
+        @param {callable} sampler function of the number of records
+               returning the sorted row indices to sample
+        @return {tuple} (records, sampled records, AccessLogQuery of
+                the matching sampled rows), None if no records exist
+        '''
+        if self.cache is None:
+            raw = self.raw_log(key)
+            if raw is not None:
+                N = raw.record_count()
+                indices = sampler(N)
+                with self.metrics.timer('filter'):
+                    return N, len(indices), raw.select(columns, conditions,
+                                                       indices=indices)
+        log = self.access_log(key)
+        if log is None:
+            return None
+        N = log.record_count()
+        indices = sampler(N)
+        sampled = AccessLog(log.version, log.headers, [log.rows[i] for i in indices])
+        with self.metrics.timer('filter'):
+            return N, len(indices), sampled.select(columns, conditions)
+
+    def read_sidecar(self, key : str, suffix : str):
+        '''Return content of auxiliary data stored alongside `key`
+
+        Default implementation stores no sidecars
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return {bytes} sidecar content, None if it does not exist
+        '''
+        return None
+
+    def write_sidecar(self, key : str, suffix : str, data : bytes):
+        '''Write auxiliary data alongside `key`
+
+        Default implementation is no-op
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @param {bytes} data sidecar content
+        @return None
+        '''
+        return
+
+    def delete_sidecar(self, key : str, suffix : str):
+        '''Remove auxiliary data stored alongside `key`, if any
+
+        Default implementation is no-op
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return None
+        '''
+        return
+
+    def write_checked_sidecar(self, key : str, suffix : str, data : bytes):
+        '''Write a sidecar prefixed with the current fingerprint of key
+
+        Must be called once the data of `key` has been written
+
+        @sa read_checked_sidecar
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @param {bytes} data sidecar content
+        @return None
+        '''
+        header = SIDECAR_HEADER + json.dumps(self.fingerprint(key)).encode('utf-8')
+        self.write_sidecar(key, suffix, header + b'\n' + data)
+
+    def read_checked_sidecar(self, key : str, suffix : str):
+        '''Return a sidecar written by `write_checked_sidecar`, if current
+
+        Sidecars are ignored once the data of `key` changes, e.g. when
+        overwritten by a store without the sidecar enabled, or when the
+        fingerprint of key is unknown
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return {bytes} sidecar content, None if missing or stale
+        '''
+        try:
+            data = self.read_sidecar(key, suffix)
+        except Exception:
+            return None
+        if data is None or not data.startswith(SIDECAR_HEADER):
+            return None
+        end = data.index(b'\n')
+        recorded = json.loads(data[len(SIDECAR_HEADER):end])
+        current = self.fingerprint(key)
+        if current is None or recorded != json.loads(json.dumps(current)):
+            return None
+        return data[end + 1:]
+
+    def update_sidecars(self, key : str, log : AccessLog):
+        '''Recompute all enabled sidecars for `key` from `log`
+
+        Must be called by `overwrite` implementations once the log data
+        has been written, so that sidecars stay consistent with it
+
+        @param {str} key key the log was written to
+        @param {AccessLog} log data that was written
+        @return None
+        '''
+        if self.sketch_columns:
+            sketches = SK.build_sketches(log, self.sketch_columns)
+            self.write_checked_sidecar(key, SK.SIDECAR_SUFFIX, SK.dumps(sketches))
+        if self.rollups_enabled:
+            rollup = RollupTable.from_log(log)
+            self.write_checked_sidecar(key, RU.SIDECAR_SUFFIX, rollup.dumps())
+
+    def delete_sidecars(self, key : str):
+        '''Remove all sidecars associated with `key`
+
+        Must be called by `delete` implementations
+
+        @param {str} key key of the deleted log
+        @return None
+        '''
+        for suffix in self.sidecar_suffixes():
+            self.delete_sidecar(key, suffix)
+
+    def sidecar_suffixes(self):
+        '''Return the suffixes of all sidecar types enabled on the store
+
+        @return {list} sidecar suffixes
+        '''
+        ret = []
+        if self.sketch_columns:
+            ret.append(SK.SIDECAR_SUFFIX)
+        if self.rollups_enabled:
+            ret.append(RU.SIDECAR_SUFFIX)
+        return ret
+
+    def enable_sketches(self, columns : list):
+        '''Maintain approximate distinct-count and top-k sketches
+
+        Sketches for `columns` are written as a sidecar on every
+        overwrite of a key, and are merged across keys by
+        `AccessLogSelector.approx_distinct` and `AccessLogSelector.top_k`
+
+        @param {list} columns column names to sketch
+        @return {DataStoreBase} self
+        '''
+        self.sketch_columns = tuple(columns)
+        return self
+
+    def sketches(self, key : str, columns : list):
+        '''Return sketches of `columns` for records associated with `key`
+
+        Reads the sketch sidecar when it covers all requested columns
+        and matches the current data, otherwise computes the sketches
+        from the access log itself
+
+        @param {str} key key used to locate the access log
+        @param {list} columns column names
+        @return {dict} column name to ColumnSketch map
+        '''
+        data = self.read_checked_sidecar(key, SK.SIDECAR_SUFFIX)
+        if data is not None:
+            sketches = SK.loads(data)
+            if all(c in sketches for c in columns):
+                return {c: sketches[c] for c in columns}
+
+        log = self.access_log(key)
+        if log is None:
+            return {}
+        return SK.build_sketches(log, columns)
+
+    def enable_rollups(self):
+        '''Maintain hourly rollups of requests, bytes, errors and hits
+
+        Rollups per hour, status class and edge location are written as
+        a sidecar on every overwrite of a key, and are used by
+        `AccessLogSelector.rollup`
+
+        @return {DataStoreBase} self
+        '''
+        self.rollups_enabled = True
+        return self
+
+    def rollup(self, key : str):
+        '''Return the hourly rollup of records associated with `key`
+
+        Reads the rollup sidecar, if it matches the current data,
+        otherwise computes the rollup from the access log itself
+
+        @param {str} key key used to locate the access log
+        @return {RollupTable} rollup table, empty if no records exist
+        '''
+        data = self.read_checked_sidecar(key, RU.SIDECAR_SUFFIX)
+        if data is not None:
+            return RollupTable.loads(data)
+
+        log = self.access_log(key)
+        if log is None:
+            return RollupTable()
+        return RollupTable.from_log(log)
+
+    def enable_cache(self, max_bytes : int = 256 * 1024 * 1024,
+                     write_through : bool = False):
+        '''Cache parsed access logs in memory
+
+        Cached logs are validated against the fingerprint of the stored
+        object on every `access_log` call, and are invalidated by
+        `overwrite` and `delete`. With `write_through`, `overwrite`
+        caches the written log instead, so that logs that are updated
+        repeatedly are not parsed again on the next merge
+
+        @param {int} max_bytes approximate memory budget of the cache
+        @param {bool} write_through cache logs on overwrite
+        @return {DataStoreBase} self
+        '''
+        self.cache = AccessLogCache(max_bytes)
+        self.cache_writes = write_through
+        return self
+
+    def enable_parallel_parsing(self, workers : int = None, chunk_bytes : int = None):
+        '''Parse and filter large logs in chunks, in worker processes
+
+        Logs are decompressed in the calling process, split into chunks
+        of whole lines, and the chunks are parsed, or filtered by
+        `select_key`, in up to `workers` processes. Results are kept in
+        chunk order. Logs of a single chunk are parsed in-process
+
+        @sa cf_parallel
+        @param {int} workers number of processes, os.cpu_count() by default
+        @param {int} chunk_bytes decompressed bytes per chunk,
+               `cf_parallel.CHUNK_BYTES` by default
+        @return {DataStoreBase} self
+        '''
+        self._stop_parse_pool()
+        self.parse_workers = workers or os.cpu_count() or 1
+        self.parse_chunk_bytes = chunk_bytes
+        return self
+
+    def parse_pool(self):
+        '''Return the process pool of the parse workers, if any
+
+        The pool is started on first use and shared by all parses and
+        selections of the store, until `close`, or until the store is
+        garbage collected or the interpreter exits
+
+        @return {ProcessPoolExecutor} pool, None without parallel parsing
+        '''
+        if self.parse_workers <= 1:
+            return None
+        with _POOL_LOCK:
+            if self.parse_executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+                weakref.finalize(self, self.parse_executor.shutdown, wait=False,
+                                 cancel_futures=True)
+            return self.parse_executor
+
+    def _stop_parse_pool(self):
+        with _POOL_LOCK:
+            executor, self.parse_executor = self.parse_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def close(self):
+        '''Release the resources of the store, e.g. its worker processes
+
+        @return None
+        '''
+        self._stop_parse_pool()
+
+    def enable_write_skipping(self):
+        '''Skip overwrites of keys whose content would not change
+
+        `overwrite` records a digest of the written records, see
+        `cf_accesslog.content_digest`, and skips compressing and writing
+        logs whose digest matches the stored one. Sidecars are not
+        updated by skipped overwrites
+
+        Merges of logs without new records are skipped regardless
+
+        @sa stored_digest
+        @return {DataStoreBase} self
+        '''
+        self.skip_unchanged = True
+        return self
+
+    def stored_digest(self, key : str):
+        '''Return the content digest recorded by the last overwrite of key
+
+        Default implementation records no digests
+
+        @sa enable_write_skipping
+        @param {str} key lookup key
+        @return {str} digest, None if unknown or no longer valid
+        '''
+        return None
+
+    def unchanged(self, key : str, log : AccessLog):
+        '''Return the digest of `log` and whether it matches that of key
+
+        Used by `overwrite` implementations. The digest is computed only
+        if write skipping is enabled
+
+        @param {str} key key the log is to be written to
+        @param {AccessLog} log sorted, deduplicated log
+        @return {tuple} (digest or None, true if the write can be skipped)
+        '''
+        if not self.skip_unchanged:
+            return None, False
+        digest = AL.content_digest(log)
+        if digest != self.stored_digest(key):
+            return digest, False
+        self.metrics.inc('writes_skipped')
+        return digest, True
+
+    def enable_metrics(self, metrics : MT.Metrics):
+        '''Record I/O counters and stage timings into `metrics`
+
+        @sa Metrics
+        @param {Metrics} metrics sink, may be shared with other stores,
+               the archiver and selectors
+        @return {DataStoreBase} self
+        '''
+        self.metrics = metrics
+        return self
+
+    def fingerprint(self, key : str):
+        '''Return a value that changes whenever data of `key` changes
+
+        Default implementation returns None, i.e. unknown
+
+        @param {str} key key used to locate the access log
+        @return {any} fingerprint, e.g. modification time or ETag
+        '''
+        return None
+
+    def invalidate(self, key : str):
+        '''Drop cached data associated with `key`
+
+        Must be called by `overwrite` and `delete` implementations
+
+        @param {str} key key used to locate the access log
+        @return None
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(key)
+
+    def archive_key(self, key : str):
+        '''Return the key of the month archive that may hold day `key`
+
+        Default implementation returns None, i.e. the store has no
+        archive tier
+
+        @sa cf_compactor
+        @param {str} key day key
+        @return {str} archive key, None if not supported
+        '''
+        return None
+
+    def list_day_keys(self):
+        '''Return keys of days stored individually, i.e. not archived
+
+        Default implementation returns all keys
+
+        @return {list} sorted list of day keys
+        '''
+        return self.list_keys()
+
+    def read_archive(self, archive_key : str, start : int, length : int = None):
+        '''Read a byte range of a month archive
+
+        Default implementation stores no archives
+
+        @param {str} archive_key archive key
+        @param {int} start first byte; negative values count from the end
+        @param {int} length number of bytes, None to read to the end
+        @return {bytes} archive content, None if it does not exist
+        '''
+        return None
+
+    def write_archive(self, archive_key : str, data : bytes):
+        '''Atomically write a month archive
+
+        @param {str} archive_key archive key
+        @param {bytes} data archive content
+        @return None
+        '''
+        raise NotImplementedError('Store has no archive tier')
+
+    def delete_archive(self, archive_key : str):
+        '''Remove a month archive, if any
+
+        @param {str} archive_key archive key
+        @return None
+        '''
+        return
+
+    def drop_day(self, key : str):
+        '''Remove the individually stored data of a day after archiving
+
+        Unlike `delete`, leaves archived data and sidecars in place
+
+        @param {str} key day key
+        @return None
+        '''
+        raise NotImplementedError('Store has no archive tier')
+
+    def archive_index(self, archive_key : str):
+        '''Return the index of a month archive
+
+        @param {str} archive_key archive key
+        @return {dict} archive index, None if the archive does not exist
+        '''
+        return CP.read_index(lambda start, length: self.read_archive(archive_key,
+                                                                     start, length))
+
+    def archived_keys(self, archive_key : str):
+        '''Return day keys of the days held in a month archive
+
+        @param {str} archive_key archive key
+        @return {list} sorted list of day keys
+        '''
+        index = self.archive_index(archive_key)
+        if index is None:
+            return []
+        return [CP.member_key(archive_key, name, self.extension)
+                for name in sorted(index['days'])]
+
+    def archived_log(self, key : str):
+        '''Return the archived access log of day `key`, if any
+
+        Reads the archive index and then only the member of the day
+
+        @param {str} key day key
+        @return {AccessLog} access log of the day, None if not archived
+        '''
+        archive_key = self.archive_key(key)
+        if archive_key is None:
+            return None
+        index = self.archive_index(archive_key)
+        if index is None:
+            return None
+        entry = index['days'].get(CP.key_member(key))
+        if entry is None:
+            return None
+        data = self.read_archive(archive_key, entry[0], entry[1])
+        return CP.decode_member(index['codec'], data)
+
+    def delete_archived(self, key : str):
+        '''Remove day `key` from its month archive, if archived
+
+        Remaining members are copied without recompression
+
+        @param {str} key day key
+        @return {bool} True if the day was archived
+        '''
+        return bool(self.delete_archived_list([key]))
+
+    def delete_archived_list(self, keys : list):
+        '''Remove days `keys` from their month archives, if archived
+
+        Each archive is rewritten once, without all of its removed days.
+        Remaining members are copied without recompression
+
+        @param {list} keys day keys
+        @return {list} keys of the days that were archived
+        '''
+        groups = {}
+        for key in keys:
+            archive_key = self.archive_key(key)
+            if archive_key is not None:
+                groups.setdefault(archive_key, {})[CP.key_member(key)] = key
+
+        removed = []
+        for archive_key, names in groups.items():
+            index = self.archive_index(archive_key)
+            if index is None:
+                continue
+            found = [key for name, key in names.items() if name in index['days']]
+            if not found:
+                continue
+
+            data = self.read_archive(archive_key, 0)
+            members = {d: data[o:o + n] for d, (o, n) in index['days'].items()
+                       if d not in names}
+            if members:
+                self.write_archive(archive_key, CP.pack(members, index['codec']))
+            else:
+                self.delete_archive(archive_key)
+            for key in found:
+                self.invalidate(key)
+            removed += found
+        return removed
+
+    def acquire_lease(self, name : str, owner : str, ttl : float):
+        '''Acquire, or renew, the lease `name` for `owner`
+
+        Leases are stored alongside the data and let several workers
+        share a store without overwriting each other's updates
+
+        @sa cf_lease
+        @sa cf_archiver.archive_shared
+        @param {str} name lease name, e.g. a store key
+        @param {str} owner owner ID
+        @param {float} ttl seconds until the lease expires
+        @return {bool} True if `owner` holds the lease
+        '''
+        raise NotImplementedError('Store does not support leases')
+
+    def release_lease(self, name : str, owner : str, done : list = None):
+        '''Release the lease `name`, if held by `owner`
+
+        @param {str} name lease name
+        @param {str} owner owner ID
+        @param {list} done keys completed under the lease, recorded in
+               the released lease for `read_lease`
+        @return {bool} True if the lease was released
+        '''
+        raise NotImplementedError('Store does not support leases')
+
+    def read_lease(self, name : str):
+        '''Return the current or last lease `name`
+
+        @param {str} name lease name
+        @return {dict} lease {name, owner, expires[, done]}, None if
+                there is none
+        '''
+        raise NotImplementedError('Store does not support leases')
+
+
+# Profile all stores when requested through the environment
+PF.install_from_environment(DataStoreBase)
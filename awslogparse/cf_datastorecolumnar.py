@@ -0,0 +1,411 @@
+import os, io, re, json, zlib, struct, bisect, tempfile
+from .cf_accesslog import AccessLog, AccessLogQuery, Equals, Between, \
+    compile_condition, regex_literal
+from .cf_datastore import DataStoreBase
+from .cf_datastorelocal import DataStoreLocal
+
+
+MAGIC = b'CFCL'
+FORMAT_VERSION = 1
+# footer length, format version, magic
+TRAILER = struct.Struct('<QI4s')
+
+CHUNK_ROWS = 16384
+# Use dictionary encoding while distinct values are at most this
+# fraction of the chunk rows
+DICT_RATIO = 0.5
+
+_TIME_RE = re.compile(r'^\d\d:\d\d:\d\d$')
+
+
+def bitpack(values : list, width : int):
+    '''Pack non-negative integers into `width` bits each
+
+    Values are packed in groups of 8, so each group takes exactly
+    `width` bytes
+
+    @param {list} values integers in [0, 2^width)
+    @param {int} width bits per value
+    @return {bytes} packed values
+    '''
+    if width == 0:
+        return b''
+    out = bytearray()
+    for i in range(0, len(values), 8):
+        acc = 0
+        for j, v in enumerate(values[i:i + 8]):
+            acc |= v << (j * width)
+        out += acc.to_bytes(width, 'little')
+    return bytes(out)
+
+
+def bitunpack(data : bytes, width : int, n : int):
+    '''Inverse of `bitpack`
+
+    @param {bytes} data packed values
+    @param {int} width bits per value
+    @param {int} n number of values
+    @return {list} list of integers
+    '''
+    if width == 0:
+        return [0] * n
+    mask = (1 << width) - 1
+    shifts = [j * width for j in range(8)]
+    out = []
+    for i in range(0, len(data), width):
+        acc = int.from_bytes(data[i:i + width], 'little')
+        out += [(acc >> s) & mask for s in shifts]
+    return out[:n]
+
+
+def _is_int(value : str):
+    return value.isdigit() and (value == '0' or value[0] != '0')
+
+
+def encode_column(values : list):
+    '''Encode a chunk of column values
+
+    Picks the encoding from the data:
+      - `delta`: HH:MM:SS times as bit-packed second deltas
+      - `int`: integers as bit-packed offsets from the minimum
+      - `dict`: low-cardinality strings as a dictionary plus
+                bit-packed indices
+      - `plain`: tab-separated utf-8 strings
+    The encoded data is then zlib-compressed
+
+    @param {list} values column values of a chunk
+    @return {tuple} (metadata dict, compressed bytes)
+    '''
+    n = len(values)
+    meta = {}
+    if n and all(_TIME_RE.match(v) for v in values):
+        secs = [int(v[:2]) * 3600 + int(v[3:5]) * 60 + int(v[6:]) for v in values]
+        deltas = [b - a for a, b in zip(secs, secs[1:])]
+        if all(d >= 0 for d in deltas):
+            width = max(deltas, default=0).bit_length()
+            meta = {'enc': 'delta', 'base': secs[0], 'width': width,
+                    'min': min(secs), 'max': max(secs)}
+            data = bitpack(deltas, width)
+    if not meta and n and all(_is_int(v) for v in values):
+        ints = [int(v) for v in values]
+        low = min(ints)
+        width = (max(ints) - low).bit_length()
+        meta = {'enc': 'int', 'base': low, 'width': width,
+                'min': low, 'max': max(ints)}
+        data = bitpack([v - low for v in ints], width)
+    if not meta:
+        distinct = sorted(set(values))
+        meta = {'min': distinct[0] if n else '', 'max': distinct[-1] if n else ''}
+        if len(distinct) <= max(1, DICT_RATIO * n):
+            index = {v: i for i, v in enumerate(distinct)}
+            width = (len(distinct) - 1).bit_length()
+            dictionary = '\t'.join(distinct).encode('utf-8')
+            meta.update({'enc': 'dict', 'width': width,
+                         'dict_length': len(dictionary)})
+            data = dictionary + bitpack([index[v] for v in values], width)
+        else:
+            meta['enc'] = 'plain'
+            data = '\t'.join(values).encode('utf-8')
+    return meta, zlib.compress(data)
+
+
+def decode_column(meta : dict, blob : bytes, n : int):
+    '''Inverse of `encode_column`
+
+    @param {dict} meta column chunk metadata
+    @param {bytes} blob compressed column chunk
+    @param {int} n number of rows in the chunk
+    @return {list} list of strings
+    '''
+    data = zlib.decompress(blob)
+    enc = meta['enc']
+    if enc == 'delta':
+        secs = [meta['base']]
+        for d in bitunpack(data, meta['width'], n - 1):
+            secs.append(secs[-1] + d)
+        return ['{:02}:{:02}:{:02}'.format(s // 3600, s // 60 % 60, s % 60)
+                for s in secs[:n]]
+    if enc == 'int':
+        base = meta['base']
+        return [str(v + base) for v in bitunpack(data, meta['width'], n)]
+    if enc == 'dict':
+        dl = meta['dict_length']
+        distinct = data[:dl].decode('utf-8').split('\t')
+        return [distinct[i] for i in bitunpack(data[dl:], meta['width'], n)]
+    if n == 0:
+        return []
+    return data.decode('utf-8').split('\t')
+
+
+def _zone_value(meta : dict, value : str):
+    # Convert a literal to the zone map domain of the column chunk
+    if meta['enc'] == 'delta':
+        if not _TIME_RE.match(value):
+            return None
+        return int(value[:2]) * 3600 + int(value[3:5]) * 60 + int(value[6:])
+    if meta['enc'] == 'int':
+        return int(value) if _is_int(value) else None
+    return value
+
+
+def may_match(meta : dict, expr):
+    '''Determine from zone maps if a column chunk may satisfy a condition
+
+    @param {dict} meta column chunk metadata with `min`/`max`
+    @param {str|Equals|Between} expr condition
+    @return {bool} False only if no value in the chunk can match
+    '''
+    low, high = meta['min'], meta['max']
+    numeric = meta['enc'] in ('delta', 'int')
+    if isinstance(expr, str):
+        lit = regex_literal(expr)
+        if lit is None:
+            return True
+        value, exact = lit
+        if not exact:
+            if numeric:
+                return True
+            return low[:len(value)] <= value <= high[:len(value)]
+        expr = Equals(value)
+
+    if isinstance(expr, Equals):
+        value = _zone_value(meta, expr.value)
+        if value is None:
+            # e.g. a non-integer literal can not equal integer values
+            return not numeric
+        return low <= value <= high
+
+    if isinstance(expr, Between):
+        lower, upper = expr.low, expr.high
+        if meta['enc'] == 'delta':
+            # Time range over a delta-encoded time column
+            if expr.numeric:
+                return True
+            lower = None if lower is None else _zone_value(meta, lower)
+            upper = None if upper is None else _zone_value(meta, upper)
+        elif expr.numeric != (meta['enc'] == 'int'):
+            return True
+        if lower is not None and high < lower:
+            return False
+        if upper is not None and low > upper:
+            return False
+    return True
+
+
+class DataStoreColumnar(DataStoreLocal):
+    '''Columnar local data store, accessible by date in YYYY-mm-dd format
+
+    Each day is stored in a single file of row chunks. Every column of
+    a chunk is encoded and compressed separately, and carries min/max
+    zone maps, so that selections read only the columns they need from
+    the chunks that may match
+
+    Uses the same directory layout and keys as DataStoreLocal
+
+    '''
+
+    extension = '.cfc'
+
+    def __init__(self, db_root_dir : str, chunk_rows : int = CHUNK_ROWS,
+                 partitioning = None):
+        super().__init__(db_root_dir, partitioning)
+        self.chunk_rows = chunk_rows
+
+    @staticmethod
+    def dumps(log : AccessLog, chunk_rows : int = CHUNK_ROWS):
+        '''Serialize an access log into the columnar file layout
+
+        @param {AccessLog} log sorted access log
+        @param {int} chunk_rows rows per chunk
+        @return {bytes} file content
+        '''
+        ncols = len(log.headers)
+        blobs = []
+        chunks = []
+        pos = 0
+        for start in range(0, log.record_count(), chunk_rows):
+            rows = log.rows[start:start + chunk_rows]
+            columns = []
+            for c in range(ncols):
+                meta, blob = encode_column([r[c] if c < len(r) else '' for r in rows])
+                meta['offset'] = pos
+                meta['length'] = len(blob)
+                columns.append(meta)
+                blobs.append(blob)
+                pos += len(blob)
+            chunks.append({'rows': len(rows), 'columns': columns})
+
+        footer = json.dumps({'version': log.version,
+                             'headers': log.headers,
+                             'chunks': chunks}).encode('utf-8')
+        return b''.join(blobs) + footer + TRAILER.pack(len(footer), FORMAT_VERSION, MAGIC)
+
+    @staticmethod
+    def read_footer(fd):
+        fd.seek(-TRAILER.size, os.SEEK_END)
+        length, ver, magic = TRAILER.unpack(fd.read(TRAILER.size))
+        if magic != MAGIC or ver != FORMAT_VERSION:
+            raise ValueError('Not a columnar access log file')
+        fd.seek(-TRAILER.size - length, os.SEEK_END)
+        return json.loads(fd.read(length).decode('utf-8'))
+
+    @staticmethod
+    def read_column(fd, chunk : dict, index : int):
+        meta = chunk['columns'][index]
+        fd.seek(meta['offset'])
+        return decode_column(meta, fd.read(meta['length']), chunk['rows'])
+
+    def access_log(self, key : str):
+        '''Return access log associated with key, if any
+
+        @sa DataStoreLocal.access_log
+        @param {str} key lookup key
+        @return {AccessLog} access log associated with the key, if
+                any, None otherwise
+        '''
+        if not os.path.exists(key):
+            return self.archived_log(key)
+
+        if self.cache is not None:
+            fingerprint = self.fingerprint(key)
+            log = self.cache.get(key, fingerprint)
+            if log is not None:
+                return log
+
+        log = self.decode_log(self.read_log(key))
+
+        if self.cache is not None:
+            self.cache.put(key, fingerprint, log)
+        return log
+
+    def select_key(self, key : str, columns, conditions : dict,
+                   limit : int = None, reverse : bool = False):
+        '''Run a selection over the records associated with `key`
+
+        Chunks whose zone maps rule out a condition are skipped without
+        being read. Condition columns are decoded first, and selected
+        columns only for chunks with matching rows
+
+        @sa DataStoreBase.select_key
+        '''
+        if not os.path.exists(key):
+            return DataStoreBase.select_key(self, key, columns, conditions,
+                                            limit, reverse)
+        with self.metrics.timer('filter'):
+            return self._select_chunks(key, columns, conditions, limit, reverse)
+
+    def sample_key(self, key : str, columns, conditions : dict, sampler):
+        '''Run a selection over a random sample of the records of `key`
+
+        Row counts are taken from the footer; only chunks holding
+        sampled rows are read
+
+        @sa DataStoreBase.sample_key
+        '''
+        if not os.path.exists(key):
+            return DataStoreBase.sample_key(self, key, columns, conditions, sampler)
+        with open(key, 'rb') as fd:
+            N = sum(chunk['rows'] for chunk in self.read_footer(fd)['chunks'])
+        indices = sampler(N)
+        with self.metrics.timer('filter'):
+            return N, len(indices), self._select_chunks(key, columns, conditions,
+                                                        None, False, indices)
+
+    def _select_chunks(self, key, columns, conditions, limit, reverse, indices=None):
+        with open(key, 'rb') as fd:
+            footer = self.read_footer(fd)
+            headers = footer['headers']
+            column_map = {h: i for i, h in enumerate(headers)}
+            if (columns == '*') or (columns == '[*]'):
+                columns = headers
+            select_cols = [column_map[x] for x in columns]
+            conds = [(column_map[c], v, compile_condition(v))
+                     for c, v in conditions.items()]
+
+            rows = []
+            if limit is not None and limit <= 0:
+                return AccessLogQuery(rows, columns)
+            chunks = []
+            start = 0
+            for chunk in footer['chunks']:
+                chunks.append((start, chunk))
+                start += chunk['rows']
+            for start, chunk in (reversed(chunks) if reverse else chunks):
+                matches = range(chunk['rows'])
+                if indices is not None:
+                    matches = [i - start for i in
+                               indices[bisect.bisect_left(indices, start):
+                                       bisect.bisect_left(indices, start + chunk['rows'])]]
+                    if not matches:
+                        continue
+                if not all(may_match(chunk['columns'][i], v) for i, v, m in conds):
+                    continue
+
+                decoded = {}
+                for index, v, matcher in conds:
+                    if index not in decoded:
+                        decoded[index] = self.read_column(fd, chunk, index)
+                    values = decoded[index]
+                    matches = [i for i in matches if matcher.search(values[i])]
+                    if not matches:
+                        break
+                if not matches:
+                    continue
+
+                for index in select_cols:
+                    if index not in decoded:
+                        decoded[index] = self.read_column(fd, chunk, index)
+                for i in (reversed(matches) if reverse else matches):
+                    rows.append([decoded[x][i] for x in select_cols])
+                    if limit is not None and len(rows) >= limit:
+                        return AccessLogQuery(rows, columns)
+        return AccessLogQuery(rows, columns)
+
+    def overwrite(self, key : str, log : AccessLog):
+        '''Overwrite existing data associated with `key`
+
+        @param {str} key key used to locate record-set
+        @param {AccessLog} log accesslog to overwrite existing content
+        @return None
+        '''
+        self.write_log(key, self.encode_log(log), log)
+
+    def encode_log(self, log : AccessLog):
+        log.sort()
+        with self.metrics.timer('compress'):
+            return self.dumps(log, self.chunk_rows)
+
+    def decode_log(self, data : bytes):
+        with self.metrics.timer('parse'):
+            fd = io.BytesIO(data)
+            footer = self.read_footer(fd)
+            rows = []
+            ncols = len(footer['headers'])
+            for chunk in footer['chunks']:
+                cols = [self.read_column(fd, chunk, i) for i in range(ncols)]
+                rows += [list(r) for r in zip(*cols)]
+        self.metrics.inc('rows_parsed', len(rows))
+        return AccessLog(footer['version'], footer['headers'], rows)
+
+    def write_log(self, key : str, data : bytes, log : AccessLog, digest : str = None):
+        '''Atomically write the columnar content of `log` to key
+
+        Digests are not recorded
+
+        @sa DataStoreBase.write_log
+        '''
+        dirname = os.path.dirname(key)
+        os.makedirs(dirname, exist_ok=True)
+        with self.metrics.timer('upload'):
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, key)
+        self.metrics.inc('bytes_uploaded', len(data))
+        self.invalidate(key)
+        if self.cache is not None and self.cache_writes:
+            self.cache.put(key, self.fingerprint(key), log)
+        self.update_sidecars(key, log)
+
+    def enable_binary_cache(self):
+        raise NotImplementedError('Columnar files are already pre-parsed')
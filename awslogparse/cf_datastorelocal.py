@@ -1,16 +1,42 @@
-import os, gzip, glob, re
+import os, glob, re, json, tempfile
 from .cf_datastore import DataStoreBase
 from .cf_accesslog import AccessLog
+from . import cf_binlog as BL
+from .cf_binlog import BinaryLog
+from . import cf_compactor as CP
+from . import cf_partition as PT
+from . import cf_lease as LL
 from datetime import datetime
 
 
+# Suffix of the sidecar holding the content digest of a day file
+DIGEST_SUFFIX = '.digest'
+
+
 
 class DataStoreLocal(DataStoreBase):
     '''GZipped local data store, accessible by date in YYYY-mm-dd format
 
+    Days of months compacted by `cf_compactor.compact` are read from
+    the month archive when no day file exists
+
     '''
-    def __init__(self, db_root_dir : str):
+
+    # File extension of stored day files
+    extension = '.gz'
+    # Whether pre-parsed binary sidecars are written and used
+    binary_cache = False
+    encoded_writes = True
+
+    def __init__(self, db_root_dir : str, partitioning : PT.PartitionScheme = None):
+        '''
+        @param {str} db_root_dir directory holding the stored files
+        @param {PartitionScheme} partitioning key layout, one file per
+               day by default
+        '''
         self.db_dir = db_root_dir
+        if partitioning is not None:
+            self.partitioning = partitioning
 
     def access_log(self, key : str):
         '''Return access log associated with key, if any
@@ -23,33 +49,153 @@ class DataStoreLocal(DataStoreBase):
         @return {AccessLog} access log associated with the key, if
                 any, None otherwise
 
+        '''
+        if not os.path.exists(key):
+            return self.archived_log(key)
+
+        if self.cache is not None or self.binary_cache:
+            fingerprint = self.fingerprint(key)
+        if self.cache is not None:
+            log = self.cache.get(key, fingerprint)
+            if log is not None:
+                return log
+
+        log = None
+        if self.binary_cache:
+            binlog = BinaryLog.open(key + BL.SIDECAR_SUFFIX, fingerprint)
+            if binlog is not None:
+                with binlog:
+                    log = binlog.access_log()
+        if log is None:
+            log = AccessLog.loads(self.read_log(key), self.metrics,
+                                  self.parse_workers, self.parse_chunk_bytes,
+                                  self.parse_pool())
+
+        if self.cache is not None:
+            self.cache.put(key, fingerprint, log)
+        return log
+
+    def read_log(self, key : str):
+        '''Return the content of the day file of key, if any
+
+        @sa DataStoreBase.read_log
+        @param {str} key lookup key
+        @return {bytes} gzipped content, None if no day file exists
         '''
         if not os.path.exists(key):
             return None
+        with self.metrics.timer('fetch'):
+            with open(key, 'rb') as fd:
+                data = fd.read()
+        self.metrics.inc('objects_fetched')
+        self.metrics.inc('bytes_downloaded', len(data))
+        return data
+
+    def select_key(self, key : str, columns, conditions : dict,
+                   limit : int = None, reverse : bool = False):
+        '''Run a selection over the records associated with `key`
+
+        Uses a cached log or, if enabled and fresh, the binary sidecar,
+        which decodes only the columns the query needs
 
-        fd = gzip.open(key, 'r')
-        return AccessLog.load(fd)
+        @sa DataStoreBase.select_key
+        '''
+        if self.binary_cache and not (self.cache is not None
+                                      and key in self.cache.entries):
+            binlog = BinaryLog.open(key + BL.SIDECAR_SUFFIX, self.fingerprint(key))
+            if binlog is not None:
+                with binlog, self.metrics.timer('filter'):
+                    return binlog.select(columns, conditions, limit, reverse)
+        return super().select_key(key, columns, conditions, limit, reverse)
+
+    def sample_key(self, key : str, columns, conditions : dict, sampler):
+        '''Run a selection over a random sample of the records of `key`
+
+        Uses the binary sidecar, if enabled and fresh, which decodes
+        only the sampled rows of the needed columns
+
+        @sa DataStoreBase.sample_key
+        '''
+        if self.binary_cache and not (self.cache is not None
+                                      and key in self.cache.entries):
+            binlog = BinaryLog.open(key + BL.SIDECAR_SUFFIX, self.fingerprint(key))
+            if binlog is not None:
+                with binlog:
+                    indices = sampler(binlog.nrows)
+                    with self.metrics.timer('filter'):
+                        return binlog.nrows, len(indices), binlog.select(
+                            columns, conditions, indices=indices)
+        return super().sample_key(key, columns, conditions, sampler)
 
-    def item_key(self, row : list):
+    async def access_log_async(self, key : str):
+        if self.binary_cache:
+            # Sidecars are memory-mapped, there is nothing to offload
+            return await self.run_io(self.access_log, key)
+        return await super().access_log_async(key)
+
+    def enable_binary_cache(self):
+        '''Write a pre-parsed binary sidecar of each day on overwrite
+
+        The sidecar is memory-mapped on access and is ignored, falling
+        back to the gzipped file, when missing or older than the file
+
+        @sa cf_binlog
+        @return {DataStoreLocal} self
+        '''
+        self.binary_cache = True
+        return self
+
+    def update_sidecars(self, key : str, log : AccessLog):
+        super().update_sidecars(key, log)
+        if self.binary_cache:
+            self.write_sidecar(key, BL.SIDECAR_SUFFIX,
+                               BL.dumps(log, self.fingerprint(key)))
+
+    def sidecar_suffixes(self):
+        ret = super().sidecar_suffixes()
+        if self.binary_cache:
+            ret.append(BL.SIDECAR_SUFFIX)
+        if self.skip_unchanged:
+            ret.append(DIGEST_SUFFIX)
+        return ret
+
+    def fingerprint(self, key : str):
+        '''Return modification time and size of the file of `key`
+
+        Archived days use the fingerprint of their month archive
+
+        @param {str} key lookup key
+        @return {tuple} (mtime in ns, size), None if no file exists
+        '''
+        try:
+            st = os.stat(key)
+        except FileNotFoundError:
+            archive_key = self.archive_key(key)
+            if archive_key is None or not os.path.exists(archive_key):
+                return None
+            st = os.stat(archive_key)
+            return ('archive', st.st_mtime_ns, st.st_size)
+        return (st.st_mtime_ns, st.st_size)
+
+    def item_key(self, row : list, distribution : str = None):
         '''Return key used for locating a row in a CF access log
 
         Associated CF logs with the key may be nonexistent
 
-        Implementation uses only the date, so row can be replaced with
-        ['YYYY-mm-dd'] format to fetch keys associated with a logs for
-        a day
+        With daily partitions, implementation uses only the date, so
+        row can be replaced with ['YYYY-mm-dd'] format to fetch keys
+        associated with a logs for a day
 
+        @sa PartitionScheme.path
         @param {list} row CF row data
-        @return {str} lookup key for access log for a day
+        @param {str} distribution distribution ID, for per-distribution
+                     partitions
+        @return {str} lookup key for access log for a partition
 
         '''
-
-        date_str = row[0]
-        dt = datetime.strptime(date_str, '%Y-%m-%d')
-        basedir = os.path.join(self.db_dir,
-                               str(dt.year),
-                               '{:02}'.format(dt.month))
-        return os.path.join(basedir, '{}.gz'.format(date_str))
+        return os.path.join(self.db_dir,
+                            *self.partitioning.path(row, distribution,
+                                                    self.extension))
 
     def overwrite(self, key : str, log : AccessLog):
         '''Overwrite existing data associated with `key
@@ -58,11 +204,49 @@ class DataStoreLocal(DataStoreBase):
         @param {AccessLog} log accesslog to overwrite existing content
         @return None
 
+        '''
+        digest, skip = self.unchanged(key, log)
+        if skip:
+            return
+        self.write_log(key, self.encode_log(log), log, digest)
+
+    def write_log(self, key : str, data : bytes, log : AccessLog, digest : str = None):
+        '''Write the gzipped content of `log` to the file of key
+
+        @sa DataStoreBase.write_log
         '''
         dirname = os.path.dirname(key)
         os.makedirs(dirname, exist_ok=True)
-        fd = gzip.open(key, 'wb')
-        log.dump(fd)
+        with self.metrics.timer('upload'):
+            with open(key, 'wb') as fd:
+                fd.write(data)
+        self.metrics.inc('bytes_uploaded', len(data))
+        self.invalidate(key)
+        if self.cache is not None and self.cache_writes:
+            self.cache.put(key, self.fingerprint(key), log)
+        self.update_sidecars(key, log)
+        if digest is not None:
+            entry = {'digest': digest, 'fingerprint': self.fingerprint(key)}
+            self.write_sidecar(key, DIGEST_SUFFIX, json.dumps(entry).encode('utf-8'))
+
+    def stored_digest(self, key : str):
+        '''Return the digest recorded alongside the file of key, if valid
+
+        Digests are stored with the fingerprint of the file they were
+        computed for, and are ignored once the file changes
+
+        @sa DataStoreBase.stored_digest
+        @param {str} key lookup key
+        @return {str} digest, None if unknown or stale
+        '''
+        data = self.read_sidecar(key, DIGEST_SUFFIX)
+        if data is None:
+            return None
+        entry = json.loads(data)
+        fingerprint = self.fingerprint(key)
+        if fingerprint is None or list(fingerprint) != entry['fingerprint']:
+            return None
+        return entry['digest']
 
     def list_keys_ranged(self, t0 : str, t1 : str):
         # Fetch all keys
@@ -72,11 +256,11 @@ class DataStoreLocal(DataStoreBase):
         t1_dt = datetime.strptime(t1, '%Y-%m-%d')
         ret = []
         for k in keys:
-            match = re.search('(\d{4}-\d{2}-\d{2}).gz', k)
-            dt = datetime.strptime(match.group(1), '%Y-%m-%d')
+            partition = PT.key_partition(k, self.extension)
+            dt = datetime.strptime(partition[:10], '%Y-%m-%d')
             if (dt >= t0_dt) and (dt <= t1_dt):
                 ret.append(k)
-        return sorted(ret)
+        return ret
 
     def list_keys(self, **kwargs):
         '''Return list of available keys in store
@@ -95,9 +279,17 @@ class DataStoreLocal(DataStoreBase):
             r = kwargs['date_range']
             return self.list_keys_ranged(r[0], r[1])
 
-        p = os.path.join(self.db_dir, '**/*.gz')
-        ret = glob.glob(p, recursive=True)
-        return sorted(ret)
+        ret = set(self.list_day_keys())
+        p = os.path.join(self.db_dir, '**/*' + CP.ARCHIVE_EXTENSION)
+        for archive_key in glob.glob(p, recursive=True):
+            ret.update(self.archived_keys(archive_key))
+        return PT.sort_keys(ret, self.extension)
+
+    def list_day_keys(self):
+        p = os.path.join(self.db_dir, '**/*' + self.extension)
+        ret = [k for k in glob.glob(p, recursive=True)
+               if PT.key_partition(k, self.extension) is not None]
+        return PT.sort_keys(ret, self.extension)
 
     def delete(self, key : str):
         ''' Remove records associated with `key`, if any
@@ -105,11 +297,130 @@ class DataStoreLocal(DataStoreBase):
         @param {str} key key identifying the access log
         @return {bool} True if successful, false otherwise
         '''
+        return self._delete(key, self.delete_archived(key))
+
+    def delete_list(self, **kwargs):
+        '''Delete all associated data with keys
+
+        Days of a month archive are removed from it in a single rewrite
+
+        @sa DataStoreBase.delete_list
+        '''
+        keys = kwargs['keys']
+        if isinstance(keys, str):
+            keys = [keys]
+        archived = set(self.delete_archived_list(keys))
+        for k in keys:
+            self._delete(k, k in archived)
+        return True
+
+    def _delete(self, key : str, archived : bool):
+        # Remove the day file of key, once removed from its archive
         if not os.path.exists(key):
-            return False
+            if archived:
+                self.delete_sidecars(key)
+            return archived
 
         try:
             os.remove(key)
         except:
             return False
-        return true
+        self.invalidate(key)
+        self.delete_sidecars(key)
+        return True
+
+    def archive_key(self, key : str):
+        return CP.month_archive_key(key, self.extension)
+
+    def read_archive(self, archive_key : str, start : int, length : int = None):
+        try:
+            fd = open(archive_key, 'rb')
+        except FileNotFoundError:
+            return None
+        with fd:
+            if start < 0:
+                fd.seek(max(start, -os.fstat(fd.fileno()).st_size), os.SEEK_END)
+            else:
+                fd.seek(start)
+            return fd.read() if length is None else fd.read(length)
+
+    def write_archive(self, archive_key : str, data : bytes):
+        dirname = os.path.dirname(archive_key)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, archive_key)
+
+    def delete_archive(self, archive_key : str):
+        try:
+            os.remove(archive_key)
+        except FileNotFoundError:
+            pass
+
+    def drop_day(self, key : str):
+        try:
+            os.remove(key)
+        except FileNotFoundError:
+            pass
+        self.invalidate(key)
+        # Binary sidecars mirror the day file and are stale without it
+        self.delete_sidecar(key, BL.SIDECAR_SUFFIX)
+
+    def lease_path(self, name : str):
+        return os.path.join(self.db_dir, LL.LEASE_DIR, LL.lease_file(name))
+
+    def acquire_lease(self, name : str, owner : str, ttl : float):
+        '''Acquire, or renew, a lease backed by an exclusively linked file
+
+        @sa DataStoreBase.acquire_lease
+        '''
+        return LL.acquire_file_lease(self.lease_path(name), name, owner, ttl)
+
+    def release_lease(self, name : str, owner : str, done : list = None):
+        return LL.release_file_lease(self.lease_path(name), owner, done)
+
+    def read_lease(self, name : str):
+        return LL.read_file_lease(self.lease_path(name))
+
+    def read_sidecar(self, key : str, suffix : str):
+        '''Return content of the sidecar file `<key><suffix>`, if any
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return {bytes} sidecar content, None if it does not exist
+        '''
+        path = key + suffix
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def write_sidecar(self, key : str, suffix : str, data : bytes):
+        '''Write sidecar file `<key><suffix>`
+
+        Content is written to a temporary file first and moved in
+        place, so readers never observe a partial sidecar
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @param {bytes} data sidecar content
+        @return None
+        '''
+        path = key + suffix
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp, path)
+
+    def delete_sidecar(self, key : str, suffix : str):
+        '''Remove sidecar file `<key><suffix>`, if any
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return None
+        '''
+        try:
+            os.remove(key + suffix)
+        except FileNotFoundError:
+            pass
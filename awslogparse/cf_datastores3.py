@@ -1,12 +1,33 @@
-import io, os, itertools, re, gzip
+import os, itertools, re
 from datetime import datetime
-import botocore, boto3
 from . import cf_accesslog as AL
 from .cf_datastore import DataStoreBase
 from .cf_accesslog import AccessLog
+from .cf_diskcache import DiskCache
+from . import cf_compactor as CP
+from . import cf_partition as PT
+from . import cf_lease as LL
+from . import cf_metrics as MT
 
 
 
+# User metadata key of the content digest of stored logs
+DIGEST_METADATA = 'content-digest'
+
+
+def client_error():
+    '''Return the botocore client error type
+
+    botocore is imported on first use rather than with this module, so
+    that importing the package stays fast without S3. Used in except
+    clauses, which are evaluated only once an exception is raised
+
+    @return {type} botocore.exceptions.ClientError
+    '''
+    from botocore.exceptions import ClientError
+    return ClientError
+
+
 def grouper(iterable, n, fillvalue=None):
     '''Collect data into fixed-length chunks or blocks
 
@@ -40,7 +61,71 @@ def is_valid_cf_logkey(key):
     return (re.search('\w{6,20}\.\d{4}-\d{2}-\d{2}-\d{2}\.\w{8}\.gz', key) != None)
 
 
-def list_cf_logkeys(s3, bucket : str, prefix : str = ''):
+def is_not_modified(error):
+    '''Determine if a client error is a `304 Not Modified` response
+
+    @param {botocore.exceptions.ClientError} error
+    @return {bool} True if the conditional request found no changes
+    '''
+    meta = error.response.get('ResponseMetadata', {})
+    code = error.response.get('Error', {}).get('Code')
+    return (meta.get('HTTPStatusCode') == 304) or (code in ('304', 'NotModified'))
+
+
+def is_not_found(error):
+    '''Determine if a client error is a missing object or key response
+
+    @param {botocore.exceptions.ClientError} error
+    @return {bool} True if the requested object does not exist
+    '''
+    meta = error.response.get('ResponseMetadata', {})
+    code = error.response.get('Error', {}).get('Code')
+    return (meta.get('HTTPStatusCode') == 404) or (code in ('404', 'NoSuchKey'))
+
+
+def is_precondition_failed(error):
+    '''Determine if a client error is a failed conditional write
+
+    @param {botocore.exceptions.ClientError} error
+    @return {bool} True if an If-Match/If-None-Match condition failed,
+            or lost to a concurrent conditional write
+    '''
+    meta = error.response.get('ResponseMetadata', {})
+    code = error.response.get('Error', {}).get('Code')
+    return (meta.get('HTTPStatusCode') in (409, 412)) \
+        or (code in ('PreconditionFailed', 'ConditionalRequestConflict'))
+
+
+def list_objects(s3, bucket : str, prefix : str = '', start_after : str = None,
+                 metrics : MT.Metrics = MT.NULL):
+    '''Generator yielding all objects under `bucket` and `prefix`
+
+    Follows continuation tokens, 1000 objects per request
+
+    @param {S3.Client} s3 AWS S3 client
+    @param {str} bucket AWS S3 bucket name
+    @param {str} prefix key prefix
+    @param {str} start_after list only keys sorting after this key
+    @param {Metrics} metrics sink of listing timings and counts
+    @return {Generator} object summaries, e.g. {'Key': ..., 'Size': ...}
+    '''
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after is not None:
+        kwargs['StartAfter'] = start_after
+    while True:
+        with metrics.timer('list'):
+            response = s3.list_objects_v2(**kwargs)
+        contents = response.get('Contents', [])
+        metrics.inc('objects_listed', len(contents))
+        for obj in contents:
+            yield obj
+        if response.get('IsTruncated') is not True:
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def list_cf_logkeys(s3, bucket : str, prefix : str = '',
+                    metrics : MT.Metrics = MT.NULL):
     '''Return the list of S3 keys under `bucket` representing CF access logs
 
     This is almost similar to running following AWS CLI command
@@ -51,25 +136,33 @@ def list_cf_logkeys(s3, bucket : str, prefix : str = ''):
     to what it deems to be valid accesslog data using only the
     names
 
-    It will return only the first 1000 if there are more keys.
-
     @param {S3.Client} s3 AWS S3 client
     @param {str} bucket AWS S3 bucket name
-    @return {list} list of keys representing CF logs, maxed out at 1000
+    @param {Metrics} metrics sink of listing timings and counts
+    @return {list} list of keys representing CF logs
     '''
-    response = s3.list_objects_v2(Bucket=bucket, Prefix = prefix)
-    contents = response.get('Contents', [])
-    ret = []
-    return [obj['Key'] for obj in contents if (is_valid_cf_logkey(obj['Key']))]
+    return [obj['Key'] for obj in list_objects(s3, bucket, prefix, metrics=metrics)
+            if is_valid_cf_logkey(obj['Key'])]
 
 
 class DataStoreS3(DataStoreBase):
-    '''GZipped local data store, accessible by date in YYYY-mm-dd format
+    '''GZipped S3 data store, accessible by date in YYYY-mm-dd format
+
+    Days of months compacted by `cf_compactor.compact` are read from
+    the month archive with ranged GETs when no day object exists
 
     '''
-    def __init__(self, bucket : str, session : boto3.Session = None, prefix : str = ''):
+
+    # Extension of stored day objects
+    extension = '.gz'
+    encoded_writes = True
+    def __init__(self, bucket : str, session : 'boto3.Session' = None, prefix : str = '',
+                 partitioning : PT.PartitionScheme = None):
         self.bucket = bucket
+        if partitioning is not None:
+            self.partitioning = partitioning
         if session is None:
+            import boto3
             self.session = boto3.Session()
         else:
             self.session = session
@@ -77,6 +170,26 @@ class DataStoreS3(DataStoreBase):
 
         self.prefix = prefix
 
+    # On-disk cache of object bodies, if enabled
+    disk_cache = None
+
+    def enable_disk_cache(self, root_dir : str, max_bytes : int = 4 * 1024 ** 3,
+                          revalidate : bool = True):
+        '''Cache fetched objects on local disk
+
+        Cached objects are revalidated with a conditional GET on access,
+        which transfers no data if the object is unchanged. Without
+        revalidation, cached objects are used without contacting S3.
+        The cache directory may be shared between processes
+
+        @param {str} root_dir cache directory
+        @param {int} max_bytes size cap of the cache directory
+        @param {bool} revalidate revalidate cached objects on access
+        @return {DataStoreS3} self
+        '''
+        self.disk_cache = DiskCache(root_dir, max_bytes, revalidate)
+        return self
+
     def access_log(self, key : str):
         '''Keys must dates in YYYY-MM-DD format
 
@@ -87,25 +200,122 @@ class DataStoreS3(DataStoreBase):
 
         '''
         try:
-            resp =  self.s3.get_object(Bucket=self.bucket, Key=key)
-            return AL.AccessLog.load(resp['Body'])
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.lookup(key)
+            stored = None
+            if self.disk_cache is not None:
+                stored = self.disk_cache.get(key)
+
+            etag = None
+            if cached is not None:
+                etag = cached[0]
+            elif stored is not None:
+                etag = stored[0]
+
+            if stored is not None and not self.disk_cache.revalidate:
+                return self._cached_log(key, cached, stored)
+
+            kwargs = {}
+            if etag is not None:
+                kwargs['IfNoneMatch'] = etag
+            try:
+                with self.metrics.timer('fetch'):
+                    resp = self.s3.get_object(Bucket=self.bucket, Key=key, **kwargs)
+                    data = resp['Body'].read()
+            except client_error() as e:
+                if etag is not None and is_not_modified(e):
+                    return self._cached_log(key, cached, stored, etag)
+                if is_not_found(e):
+                    return self.archived_log(key)
+                raise
+
+            etag = resp.get('ETag')
+            self.metrics.inc('objects_fetched')
+            self.metrics.inc('bytes_downloaded', len(data))
+            if self.disk_cache is not None:
+                self.disk_cache.put(key, etag, data)
+            log = AL.AccessLog.loads(data, self.metrics, self.parse_workers,
+                                     self.parse_chunk_bytes, self.parse_pool())
+            if self.cache is not None:
+                self.cache.put(key, etag, log)
+            return log
         except:
             return None
 
-    def item_key(self, row : list):
+    def read_log(self, key : str):
+        '''Return the content of the object of key, if not cached on disk
+
+        Objects cached on disk are read through `access_log`, which
+        revalidates them
+
+        @sa DataStoreBase.read_log
+        @param {str} key object key
+        @return {bytes} gzipped content, None if the object does not
+                exist, cannot be read or the disk cache is enabled
+        '''
+        if self.disk_cache is not None:
+            return None
+        try:
+            with self.metrics.timer('fetch'):
+                resp = self.s3.get_object(Bucket=self.bucket, Key=key)
+                data = resp['Body'].read()
+        except client_error():
+            return None
+        self.metrics.inc('objects_fetched')
+        self.metrics.inc('bytes_downloaded', len(data))
+        return data
+
+    def _cached_log(self, key, cached, stored, revalidated=None):
+        # Return the log from the memory or disk cache entries, that of
+        # the `revalidated` ETag if any, since the other may be stale
+        if revalidated is not None:
+            if cached is not None and cached[0] == revalidated:
+                return cached[1]
+        elif cached is not None and (stored is None or cached[0] == stored[0]):
+            return cached[1]
+        log = AL.AccessLog.loads(stored[1], self.metrics, self.parse_workers,
+                                 self.parse_chunk_bytes, self.parse_pool())
+        if self.cache is not None:
+            self.cache.put(key, stored[0], log)
+        return log
+
+    def fingerprint(self, key : str):
+        '''Return the ETag of the object of `key`
+
+        @param {str} key object key
+        @return {str} ETag, None if the object does not exist
+        '''
+        try:
+            resp = self.s3.head_object(Bucket=self.bucket, Key=key)
+        except client_error():
+            return None
+        return resp.get('ETag')
+
+    def invalidate(self, key : str):
+        '''Drop cached data associated with `key` from memory and disk
+
+        @param {str} key object key
+        @return None
+        '''
+        super().invalidate(key)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(key)
+
+    def item_key(self, row : list, distribution : str = None):
         '''Return the key associated with the record (or would be record)
 
-        Single entry list of the format ['YYYY-mm-dd'] can be used to
-        record the data
+        With daily partitions, single entry list of the format
+        ['YYYY-mm-dd'] can be used to record the data
 
+        @sa PartitionScheme.path
         @param {list} row accesslog row. Only single date is needed
+                      for daily partitions
+        @param {str} distribution distribution ID, for per-distribution
+                     partitions
         '''
-        date_str = row[0]
-        dt = datetime.strptime(date_str, '%Y-%m-%d')
-        return '{}{}/{}/{}.gz'.format(self.prefix,
-                                      str(dt.year),
-                                      '{:02}'.format(dt.month),
-                                      date_str)
+        return self.prefix + '/'.join(self.partitioning.path(row, distribution,
+                                                             self.extension))
 
     def overwrite(self, key : str, log : AccessLog):
         '''Overwrite existing data associated with `key
@@ -116,14 +326,45 @@ class DataStoreS3(DataStoreBase):
                      generated through item_key
         @param {AccessLog} log accesslog to overwrite existing content
         '''
-        bytes_ = io.BytesIO()
-        fd = gzip.open(bytes_, 'wb')
-        log.dump(fd)
-        fd.close()
-        self.s3.put_object(Body = bytes_.getvalue(),
-                           ACL = 'private',
-                           Bucket = self.bucket,
-                           Key = key)
+        digest, skip = self.unchanged(key, log)
+        if skip:
+            return
+        self.write_log(key, self.encode_log(log), log, digest)
+
+    def write_log(self, key : str, data : bytes, log : AccessLog, digest : str = None):
+        '''Put the gzipped content of `log` as the object of key
+
+        @sa DataStoreBase.write_log
+        '''
+        kwargs = {}
+        if digest is not None:
+            kwargs['Metadata'] = {DIGEST_METADATA: digest}
+
+        with self.metrics.timer('upload'):
+            resp = self.s3.put_object(Body = data,
+                                      ACL = 'private',
+                                      Bucket = self.bucket,
+                                      Key = key,
+                                      **kwargs)
+        self.metrics.inc('bytes_uploaded', len(data))
+        self.invalidate(key)
+        if self.cache is not None and self.cache_writes:
+            self.cache.put(key, resp.get('ETag'), log)
+        self.update_sidecars(key, log)
+
+    def stored_digest(self, key : str):
+        '''Return the digest recorded in the metadata of the object of key
+
+        @sa DataStoreBase.stored_digest
+        @param {str} key object key
+        @return {str} digest, None if the object does not exist or has
+                no digest
+        '''
+        try:
+            resp = self.s3.head_object(Bucket=self.bucket, Key=key)
+        except client_error():
+            return None
+        return resp.get('Metadata', {}).get(DIGEST_METADATA)
 
     def delete(self, key : str):
         ''''Delete a single key
@@ -132,6 +373,42 @@ class DataStoreS3(DataStoreBase):
         '''
         return self.delete_list(keys=[key])
 
+    def read_sidecar(self, key : str, suffix : str):
+        '''Return content of the sidecar object `<key><suffix>`, if any
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return {bytes} sidecar content, None if it does not exist
+        '''
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=key + suffix)
+            return resp['Body'].read()
+        except client_error():
+            return None
+
+    def write_sidecar(self, key : str, suffix : str, data : bytes):
+        '''Write sidecar object `<key><suffix>`
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @param {bytes} data sidecar content
+        @return None
+        '''
+        self.s3.put_object(Body = data,
+                           ACL = 'private',
+                           Bucket = self.bucket,
+                           Key = key + suffix)
+
+    def delete_sidecar(self, key : str, suffix : str):
+        '''Remove sidecar object `<key><suffix>`, if any
+
+        @param {str} key key of the access log the sidecar belongs to
+        @param {str} suffix sidecar type identifier
+        @return None
+        '''
+        self.s3.delete_objects(Bucket=self.bucket,
+                               Delete={'Objects': [{'Key': key + suffix}]})
+
     def delete_list(self, **kwarg):
         '''Delete list of keys
 
@@ -150,6 +427,11 @@ class DataStoreS3(DataStoreBase):
         divide_count = kwarg.get('divide_count', 800)
         if isinstance(keys, str):
             keys = [keys]
+        for k in keys:
+            self.invalidate(k)
+        self.delete_archived_list(keys)
+        keys = list(keys) + [k + suffix for k in keys
+                             for suffix in self.sidecar_suffixes()]
 
         dk = [{'Key': k} for k in keys]
 
@@ -159,7 +441,7 @@ class DataStoreS3(DataStoreBase):
         try:
             # Limit number of consecutive requests number of requests
             for sub in grouper(keys, N):
-                dk = [{'Key': k} for k in sub]
+                dk = [{'Key': k} for k in sub if k is not None]
                 self.s3.delete_objects(Bucket=self.bucket, Delete={'Objects': dk})
         except:
             return False
@@ -172,8 +454,6 @@ class DataStoreS3(DataStoreBase):
 
         t0 and t1 must be in YYYY-mm-dd format
 
-        Will look up only the first 1000 keys
-
         @param {str} t0 starting date in YYYY-mm-dd format
         @param {str} t1 end date in YYYY-mm-dd format
         @return {list} sorted list of the keys with data in [t0, t1]
@@ -184,39 +464,162 @@ class DataStoreS3(DataStoreBase):
         t1_dt = datetime.strptime(t1, '%Y-%m-%d')
         ret = []
         for k in keys:
-            match = re.search('(\d{4}-\d{2}-\d{2}).gz', k)
-            dt = datetime.strptime(match.group(1), '%Y-%m-%d')
+            partition = PT.key_partition(k, self.extension)
+            dt = datetime.strptime(partition[:10], '%Y-%m-%d')
             if (dt >= t0_dt) and (dt <= t1_dt):
                 ret.append(k)
-        return sorted(ret)
+        return ret
 
     def list_keys(self, **kwargs):
-        '''TODO Actually these are not the same stored files
+        '''Return list of available day keys in store
 
         This is almost similar to running following AWS CLI command
 
         > aws s3api list-objects-v2 --bucket <bucket-name> --prefix <prefix>
 
         Given the response, this method filters out the returned keys
-        to what it deems to be valid accesslog data using only the
-        names
-
-        It will return only the first 1000 if there are more keys.
+        to day objects using only the names, and adds the days held in
+        month archives
 
-        @param kwargs: Unused
-        @return {list} list of available keys, maxed out at 1000
+        @param kwargs {
+           date_range = [t0, t1]
+        }
+        @return {list} sorted list of available keys
 
         '''
         if 'date_range' in kwargs:
             r = kwargs['date_range']
             return self.list_keys_ranged(r[0], r[1])
 
-        response = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=self.prefix)
-        contents = response.get('Contents', [])
-        ret = []
-        for obj in contents:
-            key = obj['key']
-            if (is_valid_cf_logkey(key)):
-                ret.append(key)
-        return sorted(ret)
+        day_keys, archive_keys = self._list_objects()
+        ret = set(day_keys)
+        for archive_key in archive_keys:
+            ret.update(self.archived_keys(archive_key))
+        return PT.sort_keys(ret, self.extension)
+
+    def list_day_keys(self):
+        return self._list_objects()[0]
+
+    def _list_objects(self):
+        # Split stored objects into day keys and month archive keys
+        archive_re = re.compile(r'\d{4}-\d{2}' + re.escape(CP.ARCHIVE_EXTENSION) + '$')
+        day_keys = []
+        archive_keys = []
+        for obj in list_objects(self.s3, self.bucket, self.prefix, metrics=self.metrics):
+            key = obj['Key']
+            if PT.key_partition(key, self.extension) is not None:
+                day_keys.append(key)
+            elif archive_re.search(key):
+                archive_keys.append(key)
+        return PT.sort_keys(day_keys, self.extension), sorted(archive_keys)
+
+    def archive_key(self, key : str):
+        return CP.month_archive_key(key, self.extension)
+
+    def read_archive(self, archive_key : str, start : int, length : int = None):
+        '''Read a byte range of a month archive with a ranged GET
+
+        @sa DataStoreBase.read_archive
+        '''
+        if start < 0:
+            byte_range = 'bytes={}'.format(start)
+        elif length is None:
+            byte_range = 'bytes={}-'.format(start)
+        else:
+            byte_range = 'bytes={}-{}'.format(start, start + length - 1)
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=archive_key,
+                                      Range=byte_range)
+        except client_error() as e:
+            if is_not_found(e):
+                return None
+            raise
+        return resp['Body'].read()
+
+    def write_archive(self, archive_key : str, data : bytes):
+        self.s3.put_object(Body = data,
+                           ACL = 'private',
+                           Bucket = self.bucket,
+                           Key = archive_key)
+
+    def delete_archive(self, archive_key : str):
+        self.s3.delete_objects(Bucket=self.bucket,
+                               Delete={'Objects': [{'Key': archive_key}]})
+
+    def drop_day(self, key : str):
+        self.s3.delete_objects(Bucket=self.bucket,
+                               Delete={'Objects': [{'Key': key}]})
+        self.invalidate(key)
+
+    def lease_key(self, name : str):
+        return self.prefix + LL.LEASE_DIR + '/' + LL.lease_file(name)
+
+    def _put_lease(self, key : str, data : bytes, **condition):
+        # Return True if the conditional write succeeded
+        try:
+            self.s3.put_object(Body=data, ACL='private', Bucket=self.bucket,
+                               Key=key, **condition)
+            return True
+        except client_error() as e:
+            if is_precondition_failed(e):
+                return False
+            raise
+
+    def acquire_lease(self, name : str, owner : str, ttl : float):
+        '''Acquire, or renew, a lease backed by S3 conditional writes
+
+        New leases are created with `If-None-Match: *`; expired or own
+        leases are replaced with `If-Match` on the ETag that was read,
+        so only one of several concurrent takeovers succeeds
+
+        @sa DataStoreBase.acquire_lease
+        '''
+        key = self.lease_key(name)
+        data = LL.encode_lease(name, owner, ttl)
+        if self._put_lease(key, data, IfNoneMatch='*'):
+            return True
+
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except client_error() as e:
+            # Released in the meantime; retry on the next attempt
+            if is_not_found(e):
+                return False
+            raise
+        if not LL.is_available(LL.decode_lease(resp['Body'].read()), owner):
+            return False
+        return self._put_lease(key, data, IfMatch=resp['ETag'])
+
+    def release_lease(self, name : str, owner : str, done : list = None):
+        '''Release a lease, if held by `owner`
 
+        The lease object is replaced by an expired lease, conditional
+        on its ETag, rather than deleted
+
+        @sa DataStoreBase.release_lease
+        '''
+        key = self.lease_key(name)
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except client_error() as e:
+            if is_not_found(e):
+                return False
+            raise
+        lease = LL.decode_lease(resp['Body'].read())
+        if lease is None or lease.get('owner') != owner:
+            return False
+        return self._put_lease(key, LL.encode_lease(name, owner, -1, done),
+                               IfMatch=resp['ETag'])
+
+    def read_lease(self, name : str):
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=self.lease_key(name))
+        except client_error() as e:
+            if is_not_found(e):
+                return None
+            raise
+        lease = LL.decode_lease(resp['Body'].read())
+        if lease is None:
+            # Conditional writes never leave partial leases
+            return {'owner': None, 'expires': 0}
+        return lease
@@ -0,0 +1,261 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from .cf_datastore import DataStoreBase
+from .cf_accesslog import AccessLog
+from . import cf_accesslog as AL
+from . import cf_datastores3 as DS3
+from . import cf_partition as PT
+from . import cf_metrics as MT
+
+
+# Records may be delivered in files named after a later hour
+DELIVERY_SLACK = timedelta(hours=1)
+
+_HOUR_FORMAT = '%Y-%m-%d-%H'
+
+
+def _time_key(row):
+    # Same order as `cf_accesslog.sort_fn`, without parsing
+    return (row[0], row[1])
+
+
+class DataStoreSource(DataStoreBase):
+    '''Read-only store of the raw CloudFront logs of a delivery bucket
+
+    Makes logs that are not archived yet queryable. Keys are days in
+    YYYY-mm-dd format. The log of a day is merged from the objects
+    delivered during the day, and within `slack` after it, since
+    CloudFront delivers some records late. Objects are pruned by the
+    delivery hour in their names, fetched in parallel, and their sorted
+    logs are merged as they are combined
+
+    With `distributions`, listings start at the first hour of the date
+    range of every distribution and stop after its last hour. Otherwise
+    all keys under the prefix are listed, and pruned by name
+
+    The object keys of the days returned by `list_keys` are reused by
+    `access_log` until the next `list_keys`, so that queries list the
+    bucket once
+
+    '''
+
+    def __init__(self, bucket : str, session : 'boto3.Session' = None, prefix : str = '',
+                 distributions : list = None, workers : int = 8,
+                 slack : timedelta = DELIVERY_SLACK, InDataStore = None):
+        '''
+        @param {str} bucket bucket CloudFront delivers logs to
+        @param {boto3.Session} session AWS session
+        @param {str} prefix key prefix of the logs
+        @param {list} distributions distribution IDs to query, all by
+               default
+        @param {int} workers number of objects fetched concurrently
+        @param {timedelta} slack delivery delay of records
+        @param {DataStoreS3} InDataStore store reading the raw objects, a
+               DataStoreS3 of `bucket` by default
+        '''
+        self.objects = InDataStore
+        if self.objects is None:
+            self.objects = DS3.DataStoreS3(bucket, session, prefix=prefix)
+        self.s3 = self.objects.s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.distributions = distributions
+        self.workers = workers
+        self.slack = slack
+        # Object keys of every day of the last listing
+        self.day_objects = {}
+
+    def enable_metrics(self, metrics : MT.Metrics):
+        self.objects.enable_metrics(metrics)
+        return super().enable_metrics(metrics)
+
+    def list_objects(self, h0 : str = None, h1 : str = None):
+        '''Return the keys of the logs delivered in hours [h0, h1]
+
+        @param {str} h0 first hour in YYYY-mm-dd-HH format, if any
+        @param {str} h1 last hour in YYYY-mm-dd-HH format, if any
+        @return {list} raw log keys
+        '''
+        if self.distributions is None:
+            listings = [(self.prefix, None)]
+        else:
+            listings = [(self.prefix + d + '.', None) for d in self.distributions]
+            if h0 is not None:
+                listings = [(p, p + h0) for p, start_after in listings]
+
+        ret = []
+        for prefix, start_after in listings:
+            for obj in DS3.list_objects(self.s3, self.bucket, prefix, start_after,
+                                        self.metrics):
+                hour = PT.delivery_hour(obj['Key'])
+                if hour is None or (h0 is not None and hour < h0):
+                    continue
+                if h1 is not None and hour > h1:
+                    # Keys of a distribution are sorted by hour
+                    if self.distributions is not None:
+                        break
+                    continue
+                ret.append(obj['Key'])
+        return ret
+
+    def object_days(self, key : str):
+        '''Return the days whose records may be in a raw log
+
+        @param {str} key raw log key
+        @return {set} days in YYYY-mm-dd format
+        '''
+        hour = datetime.strptime(PT.delivery_hour(key), _HOUR_FORMAT)
+        return {hour.strftime('%Y-%m-%d'), (hour - self.slack).strftime('%Y-%m-%d')}
+
+    def _hour_range(self, d0 : str, d1 : str):
+        # Delivery hours of the records of days [d0, d1]
+        t1 = datetime.strptime(d1, '%Y-%m-%d') + timedelta(hours=23) + self.slack
+        return d0 + '-00', t1.strftime(_HOUR_FORMAT)
+
+    def list_keys(self, **kwargs):
+        '''Return the days with delivered logs
+
+        @param kwargs {
+           date_range = [t0, t1]
+        }
+        @return {list} sorted list of days in YYYY-mm-dd format
+        '''
+        d0, d1 = kwargs.get('date_range', (None, None))
+        if d0 is None:
+            keys = self.list_objects()
+        else:
+            keys = self.list_objects(*self._hour_range(d0, d1))
+
+        day_objects = {}
+        for key in keys:
+            for day in self.object_days(key):
+                if d0 is None or d0 <= day <= d1:
+                    day_objects.setdefault(day, []).append(key)
+        self.day_objects = day_objects
+        return sorted(day_objects)
+
+    def access_log(self, key : str):
+        '''Return the records of a day, merged from its raw logs
+
+        @param {str} key day in YYYY-mm-dd format
+        @return {AccessLog} sorted, deduplicated records, None if no
+                records of the day were delivered
+        '''
+        keys = self.day_objects.get(key)
+        if keys is None:
+            keys = self.list_objects(*self._hour_range(key, key))
+        if not keys:
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            logs = [l for l in pool.map(self.objects.access_log, keys) if l is not None]
+        if not logs:
+            return None
+
+        runs = [[r for r in log.rows if r[log.date_col] == key] for log in logs]
+        n = sum(len(run) for run in runs)
+        if n == 0:
+            return None
+        with self.metrics.timer('merge'):
+            log = AccessLog(logs[0].version, logs[0].headers,
+                            list(heapq.merge(*runs, key=_time_key)))
+            log.remove_duplicates()
+        self.metrics.inc('duplicates_dropped', n - log.record_count())
+        return log
+
+    def item_key(self, row : list, distribution : str = None):
+        return row[0]
+
+    def overwrite(self, key : str, log : AccessLog):
+        raise NotImplementedError('Read-only store')
+
+    def delete(self, key : str):
+        raise NotImplementedError('Read-only store')
+
+
+class DataStoreUnion(DataStoreBase):
+    '''Read-only view of an archive and of the logs not archived yet
+
+    Keys are days in YYYY-mm-dd format. Days before the last archived
+    day are read from the archive only. The last archived day, which is
+    likely being filled, and later days are merged from the archive and
+    the source, dropping the records that are in both
+
+    '''
+
+    def __init__(self, archive : DataStoreBase, source : DataStoreBase):
+        '''
+        @param {DataStoreBase} archive store the logs are archived to
+        @param {DataStoreBase} source store of the logs not archived
+               yet, e.g. a DataStoreSource of the delivery bucket
+        '''
+        self.archive = archive
+        self.source = source
+        # Archive keys of every day and source days of the last listing
+        self.archive_days = {}
+        self.source_days = set()
+
+    def _day(self, key : str):
+        partition = PT.key_partition(key, getattr(self.archive, 'extension', ''))
+        return key if partition is None else partition[:10]
+
+    def list_keys(self, **kwargs):
+        '''Return the days with records in either store
+
+        @param kwargs {
+           date_range = [t0, t1]
+        }
+        @return {list} sorted list of days in YYYY-mm-dd format
+        '''
+        archive_days = {}
+        for key in self.archive.list_keys(**kwargs):
+            archive_days.setdefault(self._day(key), []).append(key)
+
+        d0, d1 = kwargs.get('date_range', (None, None))
+        if archive_days:
+            d0 = max(d0 or '', max(archive_days))
+            # No logs are delivered after tomorrow, in any time zone
+            d1 = d1 or (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%d')
+        if d0 is None:
+            source_days = self.source.list_keys()
+        elif d0 <= d1:
+            source_days = self.source.list_keys(date_range=[d0, d1])
+        else:
+            source_days = []
+
+        self.archive_days = archive_days
+        self.source_days = set(source_days)
+        return sorted(self.source_days.union(archive_days))
+
+    def access_log(self, key : str):
+        '''Return the records of a day from both stores
+
+        @param {str} key day in YYYY-mm-dd format
+        @return {AccessLog} sorted, deduplicated records, None if
+                neither store has any
+        '''
+        if key not in self.source_days and key not in self.archive_days:
+            self.list_keys(date_range=[key, key])
+
+        logs = [self.archive.access_log(k) for k in self.archive_days.get(key, [])]
+        if key in self.source_days:
+            logs.append(self.source.access_log(key))
+        logs = [l for l in logs if l is not None and l.record_count() > 0]
+        if not logs:
+            return None
+        if len(logs) == 1:
+            return logs[0]
+        # Copied, since logs may be held by the caches of the stores
+        log = AccessLog(logs[0].version, logs[0].headers,
+                        [r for l in logs for r in l.rows])
+        return AL.merge_log(log, self.metrics)
+
+    def item_key(self, row : list, distribution : str = None):
+        return row[0]
+
+    def overwrite(self, key : str, log : AccessLog):
+        raise NotImplementedError('Read-only store')
+
+    def delete(self, key : str):
+        raise NotImplementedError('Read-only store')
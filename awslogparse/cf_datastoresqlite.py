@@ -0,0 +1,363 @@
+import re, json, sqlite3, threading
+from datetime import datetime
+from .cf_datastore import DataStoreBase
+from .cf_accesslog import AccessLog, AccessLogQuery, Equals, Between, regex_literal
+
+
+# Columns indexed by default, together with the date
+DEFAULT_INDEXES = ('time', 'c-ip', 'sc-status', 'cs-uri-stem')
+
+
+def quote(name : str):
+    '''Quote an identifier, e.g. a column name such as `cs(Host)`
+
+    @param {str} name identifier
+    @return {str} quoted identifier
+    '''
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _regexp(pattern, value):
+    # Backs the REGEXP operator; re caches compiled patterns
+    if value is None:
+        return False
+    return re.search(pattern, value) is not None
+
+
+def _between(value, low, high):
+    # Numeric range matching with the semantics of `Between`
+    return Between(low, high).search(value or '')
+
+
+def prefix_bound(prefix : str):
+    '''Return the smallest string greater than all strings with `prefix`
+
+    @param {str} prefix string prefix
+    @return {str} exclusive upper bound, None if there is none
+    '''
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def condition_sql(column : str, expr):
+    '''Translate a `where` condition into an SQL expression
+
+    Equality, prefix and string range conditions become plain SQL
+    comparisons that can use indexes. Other regexes use the REGEXP
+    operator, and numeric ranges a registered function
+
+    @param {str} column column name
+    @param {str|Equals|Between} expr condition
+    @return {tuple} (sql, parameters)
+    '''
+    col = quote(column)
+    if isinstance(expr, str):
+        lit = regex_literal(expr)
+        if lit is None:
+            return '{} REGEXP ?'.format(col), [expr]
+        value, exact = lit
+        if exact:
+            return '{} = ?'.format(col), [value]
+        # A range, unlike substr() or LIKE, is served by the index
+        high = prefix_bound(value)
+        if high is None:
+            return '{} >= ?'.format(col), [value]
+        return '{} >= ? AND {} < ?'.format(col, col), [value, high]
+    if isinstance(expr, Equals):
+        return '{} = ?'.format(col), [expr.value]
+    if isinstance(expr, Between):
+        if expr.numeric:
+            return 'cf_between({}, ?, ?)'.format(col), [expr.low, expr.high]
+        parts = []
+        params = []
+        if expr.low is not None:
+            parts.append('{} >= ?'.format(col))
+            params.append(expr.low)
+        if expr.high is not None:
+            parts.append('{} <= ?'.format(col))
+            params.append(expr.high)
+        return ' AND '.join(parts) or '1', params
+    raise ValueError('Unsupported condition {!r}'.format(expr))
+
+
+class DataStoreSQLite(DataStoreBase):
+    '''SQLite data store, accessible by date in YYYY-mm-dd format
+
+    Records are stored in one table per day or per month. Keys are
+    dates, and selections are translated into SQL over the partition
+    holding the date
+
+    '''
+
+    def __init__(self, db_path : str, partition : str = 'day',
+                 indexes : list = DEFAULT_INDEXES):
+        '''
+        @param {str} db_path database file path, or ':memory:'
+        @param {str} partition 'day' or 'month' tables
+        @param {list} indexes columns to index, together with the date
+        '''
+        if partition not in ('day', 'month'):
+            raise ValueError('Unknown partition {}'.format(partition))
+        self.db_path = db_path
+        self.partition = partition
+        self.indexes = tuple(indexes)
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.create_function('regexp', 2, _regexp)
+        self.conn.create_function('cf_between', 3, _between)
+        if db_path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cf_days ('
+                              'date TEXT PRIMARY KEY, tbl TEXT, version TEXT, '
+                              'headers TEXT, revision INTEGER)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cf_sidecars ('
+                              'key TEXT, suffix TEXT, data BLOB, '
+                              'PRIMARY KEY (key, suffix))')
+            # Store-wide revision counter, so that revisions of a date
+            # deleted and written again never repeat
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cf_counters ('
+                              'name TEXT PRIMARY KEY, value INTEGER)')
+            self.conn.execute("INSERT OR IGNORE INTO cf_counters "
+                              "SELECT 'revision', COALESCE(MAX(revision), 0) FROM cf_days")
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+    def table(self, key : str):
+        '''Return the name of the table holding records of date `key`
+
+        @param {str} key date in YYYY-mm-dd format
+        @return {str} table name
+        '''
+        dt = datetime.strptime(key, '%Y-%m-%d')
+        if self.partition == 'day':
+            return 'log_{:04}_{:02}_{:02}'.format(dt.year, dt.month, dt.day)
+        return 'log_{:04}_{:02}'.format(dt.year, dt.month)
+
+    def _day(self, key : str):
+        row = self.conn.execute('SELECT tbl, version, headers, revision '
+                                'FROM cf_days WHERE date = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def item_key(self, row : list, distribution : str = None):
+        '''Return key used for locating a row, i.e. its date
+
+        @param {list} row CF row data, or ['YYYY-mm-dd']
+        @param {str} distribution unused, records of all distributions
+                     share the date tables
+        @return {str} date in YYYY-mm-dd format
+        '''
+        datetime.strptime(row[0], '%Y-%m-%d')
+        return row[0]
+
+    def fingerprint(self, key : str):
+        '''Return the revision of the records of `key`
+
+        @param {str} key date in YYYY-mm-dd format
+        @return {int} revision, from a store-wide counter incremented
+                on every overwrite
+        '''
+        with self.lock:
+            day = self._day(key)
+        return None if day is None else day[3]
+
+    def access_log(self, key : str):
+        '''Return access log associated with key, if any
+
+        @param {str} key date in YYYY-mm-dd format
+        @return {AccessLog} access log of the date, None if no records
+        '''
+        with self.lock:
+            day = self._day(key)
+            if day is None:
+                return None
+            tbl, version, headers, revision = day
+            if self.cache is not None:
+                log = self.cache.get(key, revision)
+                if log is not None:
+                    return log
+
+            cols = ', '.join(quote(h) for h in headers)
+            cursor = self.conn.execute(
+                'SELECT {} FROM {} WHERE "date" = ? ORDER BY rowid'
+                .format(cols, quote(tbl)), (key,))
+            rows = [list(r) for r in cursor]
+
+        log = AccessLog(version, headers, rows)
+        if self.cache is not None:
+            self.cache.put(key, revision, log)
+        return log
+
+    def select_key(self, key : str, columns, conditions : dict,
+                   limit : int = None, reverse : bool = False):
+        '''Run a selection over the records of `key` in SQL
+
+        @sa DataStoreBase.select_key
+        '''
+        with self.lock:
+            day = self._day(key)
+            if day is None:
+                return None
+            return self._select(day, key, columns, conditions, limit, reverse)
+
+    def _select(self, day, key, columns, conditions, limit, reverse, rowids=None):
+        # Selection over the records of `day`, or only the rows of
+        # `rowids`; called with the lock held
+        tbl, version, headers, revision = day
+        if (columns == '*') or (columns == '[*]'):
+            columns = headers
+        for c in list(columns) + list(conditions):
+            if c not in headers:
+                raise KeyError(c)
+
+        where = ['"date" = ?']
+        params = [key]
+        if rowids is not None:
+            where.append('rowid IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(rowids))
+        for column, expr in conditions.items():
+            sql, p = condition_sql(column, expr)
+            where.append('({})'.format(sql))
+            params += p
+
+        query = 'SELECT {} FROM {} WHERE {} ORDER BY rowid{}'.format(
+            ', '.join(quote(c) for c in columns), quote(tbl),
+            ' AND '.join(where), ' DESC' if reverse else '')
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(max(limit, 0))
+        rows = [list(r) for r in self.conn.execute(query, params)]
+        return AccessLogQuery(rows, list(columns))
+
+    def sample_key(self, key : str, columns, conditions : dict, sampler):
+        '''Run a selection over a random sample of the records of `key`
+
+        Row IDs are read from the date index, and only the sampled
+        rows are fetched and filtered in SQL
+
+        @sa DataStoreBase.sample_key
+        '''
+        with self.lock:
+            day = self._day(key)
+            if day is None:
+                return None
+            tbl = day[0]
+            rowids = [r[0] for r in self.conn.execute(
+                'SELECT rowid FROM {} WHERE "date" = ? ORDER BY rowid'.format(quote(tbl)),
+                (key,))]
+            indices = sampler(len(rowids))
+            return len(rowids), len(indices), self._select(
+                day, key, columns, conditions, None, False, [rowids[i] for i in indices])
+
+    def _ensure_table(self, tbl : str, headers : list):
+        existing = [r[1] for r in self.conn.execute(
+            'PRAGMA table_info({})'.format(quote(tbl)))]
+        if not existing:
+            cols = ', '.join('{} TEXT'.format(quote(h)) for h in headers)
+            self.conn.execute('CREATE TABLE {} ({})'.format(quote(tbl), cols))
+        else:
+            for h in headers:
+                if h not in existing:
+                    self.conn.execute('ALTER TABLE {} ADD COLUMN {} TEXT'
+                                      .format(quote(tbl), quote(h)))
+
+        indexes = [['date', c] for c in self.indexes if c in headers] or [['date']]
+        for cols in indexes:
+            name = 'idx_{}_{}'.format(tbl, re.sub(r'\W', '_', cols[-1]))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                quote(name), quote(tbl), ', '.join(quote(c) for c in cols)))
+
+    def overwrite(self, key : str, log : AccessLog):
+        '''Overwrite existing records of date `key`
+
+        Rows are inserted in bulk, sorted, in a single transaction
+
+        @param {str} key date in YYYY-mm-dd format
+        @param {AccessLog} log accesslog to overwrite existing content
+        @return None
+        '''
+        log.sort()
+        tbl = self.table(key)
+        headers = list(log.headers)
+        n = len(headers)
+        rows = (row[:n] + [''] * (n - len(row)) for row in log.rows)
+        insert = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(tbl), ', '.join(quote(h) for h in headers), ', '.join('?' * n))
+
+        with self.lock:
+            with self.conn:
+                self._ensure_table(tbl, headers)
+                self.conn.execute('DELETE FROM {} WHERE "date" = ?'.format(quote(tbl)),
+                                  (key,))
+                self.conn.executemany(insert, rows)
+                self.conn.execute("UPDATE cf_counters SET value = value + 1 "
+                                  "WHERE name = 'revision'")
+                revision = self.conn.execute("SELECT value FROM cf_counters "
+                                             "WHERE name = 'revision'").fetchone()[0]
+                self.conn.execute('INSERT OR REPLACE INTO cf_days VALUES (?, ?, ?, ?, ?)',
+                                  (key, tbl, log.version, json.dumps(headers), revision))
+            self.invalidate(key)
+            self.update_sidecars(key, log)
+
+    def delete(self, key : str):
+        '''Remove records of date `key`, if any
+
+        @param {str} key date in YYYY-mm-dd format
+        @return {bool} True if successful, false otherwise
+        '''
+        with self.lock:
+            day = self._day(key)
+            if day is None:
+                return False
+            tbl = day[0]
+            with self.conn:
+                self.conn.execute('DELETE FROM {} WHERE "date" = ?'.format(quote(tbl)),
+                                  (key,))
+                self.conn.execute('DELETE FROM cf_days WHERE date = ?', (key,))
+                remaining = self.conn.execute('SELECT COUNT(*) FROM cf_days WHERE tbl = ?',
+                                              (tbl,)).fetchone()[0]
+                if remaining == 0:
+                    self.conn.execute('DROP TABLE {}'.format(quote(tbl)))
+            self.invalidate(key)
+            self.delete_sidecars(key)
+        return True
+
+    def list_keys(self, **kwargs):
+        '''Return list of available keys in store
+
+        @param kwargs {
+           date_range = [t0, t1]
+        }
+        @return {list} sorted list of dates with records
+        '''
+        query = 'SELECT date FROM cf_days'
+        params = []
+        if 'date_range' in kwargs:
+            query += ' WHERE date >= ? AND date <= ?'
+            params = list(kwargs['date_range'])
+        with self.lock:
+            return [r[0] for r in self.conn.execute(query + ' ORDER BY date', params)]
+
+    def read_sidecar(self, key : str, suffix : str):
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM cf_sidecars WHERE key = ? '
+                                    'AND suffix = ?', (key, suffix)).fetchone()
+        return None if row is None else row[0]
+
+    def write_sidecar(self, key : str, suffix : str, data : bytes):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO cf_sidecars VALUES (?, ?, ?)',
+                              (key, suffix, data))
+
+    def delete_sidecar(self, key : str, suffix : str):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM cf_sidecars WHERE key = ? AND suffix = ?',
+                              (key, suffix))
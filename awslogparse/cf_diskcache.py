@@ -0,0 +1,116 @@
+import os, hashlib, tempfile
+
+
+class DiskCache():
+    '''Size-bounded on-disk cache of object bodies keyed by key and ETag
+
+    Each entry is a single file holding the ETag on its first line
+    followed by the object body. Entries are written to a temporary
+    file and renamed in place, so several processes can share one
+    cache directory: readers see either a complete entry or none.
+    Access times are tracked through file modification times, and
+    least recently used entries are evicted once the cache exceeds
+    its size cap
+
+    '''
+
+    def __init__(self, root_dir : str, max_bytes : int, revalidate : bool = True):
+        '''
+        @param {str} root_dir cache directory, created if missing
+        @param {int} max_bytes size cap of the cache directory
+        @param {bool} revalidate whether hits must be revalidated
+                      against the source (e.g. with a conditional GET)
+        '''
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        os.makedirs(root_dir, exist_ok=True)
+
+    def path(self, key : str):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root_dir, digest + '.entry')
+
+    def get(self, key : str):
+        '''Return the cached ETag and body of `key`
+
+        @param {str} key object key
+        @return {tuple} (etag, bytes), None if not cached
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fd:
+                etag = fd.readline().rstrip(b'\n').decode('utf-8')
+                data = fd.read()
+        except FileNotFoundError:
+            return None
+
+        # Mark as recently used; may race with eviction by another
+        # process, which is harmless
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return etag, data
+
+    def put(self, key : str, etag : str, data : bytes):
+        '''Atomically store the body of `key` with its ETag
+
+        @param {str} key object key
+        @param {str} etag ETag of the object
+        @param {bytes} data object body
+        @return None
+        '''
+        if etag is None or len(data) > self.max_bytes:
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=self.root_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(etag.encode('utf-8') + b'\n')
+                f.write(data)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def invalidate(self, key : str):
+        '''Remove the entry of `key`, if any
+
+        @param {str} key object key
+        @return None
+        '''
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        '''Remove least recently used entries until under the size cap
+
+        @return None
+        '''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root_dir):
+            if not entry.name.endswith('.entry'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,182 @@
+import re, time
+from datetime import datetime, timedelta
+from . import cf_archiver as archiver
+from . import cf_datastores3 as DS3
+
+
+# <head><YYYY-mm-dd-HH>.<unique-id>.gz, head ending with the distribution ID
+_KEY_RE = re.compile(r'^(.*\w{6,20}\.)(\d{4}-\d{2}-\d{2}-\d{2})\.\w{8}\.gz$')
+
+
+class Follower():
+    '''Continuously archive CloudFront logs as they are delivered to S3
+
+    Each poll lists only keys after the last seen delivery hour of every
+    distribution, with `StartAfter`, minus a `lookback` for files
+    delivered late into an earlier hour. New files are accumulated into
+    micro-batches that are archived once they are `max_wait` seconds
+    old or hold `max_bytes` of compressed logs
+
+    The output store keeps recently written logs in a write-through
+    cache, so that the day being filled is merged in memory rather than
+    read back and parsed on every batch
+
+    Distributions under the prefix that sort before all known ones are
+    only discovered by the first listing, and keys of distributions
+    sorting after the earliest one are listed in full on every poll
+
+    '''
+
+    def __init__(self, s3, bucket : str, OutDataStore, prefix : str = '',
+                 InDataStore = None, delete_source : bool = False,
+                 max_wait : float = 60, max_bytes : int = 64 * 1024 ** 2,
+                 lookback : timedelta = timedelta(hours=1),
+                 cache_bytes : int = 512 * 1024 ** 2):
+        '''
+        @param {S3.Client} s3 AWS S3 client
+        @param {str} bucket source bucket of the CloudFront logs
+        @param {DataStoreBase} OutDataStore output archive data store
+        @param {str} prefix source key prefix
+        @param {DataStoreBase} InDataStore input store reading the
+               source bucket, a DataStoreS3 of `bucket` by default
+        @param {bool} delete_source delete archived files from bucket
+        @param {float} max_wait seconds before a batch is archived
+        @param {int} max_bytes batch size that triggers archiving
+        @param {timedelta} lookback delivery delay tolerated within
+               an hour that was already seen
+        @param {int} cache_bytes memory budget of the output store
+               cache, if it has none yet
+        '''
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.in_store = InDataStore
+        if self.in_store is None:
+            self.in_store = DS3.DataStoreS3(bucket, prefix=prefix)
+        self.out_store = OutDataStore
+        if self.out_store.cache is None:
+            self.out_store.enable_cache(cache_bytes, write_through=True)
+        self.delete_source = delete_source
+        self.max_wait = max_wait
+        self.max_bytes = max_bytes
+        self.lookback = lookback
+
+        # Latest delivery hour seen, per key head (i.e. distribution)
+        self.watermarks = {}
+        # Keys archived within the lookback window, to skip on re-listing
+        self.seen = {}
+        # Keys to archive, to (head, hour, size), in listing order
+        self.batch = {}
+        self.batch_bytes = 0
+        self.batch_start = None
+
+    def start_after(self):
+        '''Return the `StartAfter` key of the next listing
+
+        @return {str} key sorting before every unseen key, None before
+                the first listing
+        '''
+        if not self.watermarks:
+            return None
+        return min(head + (hour - self.lookback).strftime('%Y-%m-%d-%H')
+                   for head, hour in self.watermarks.items())
+
+    def poll(self):
+        '''List new CloudFront log files and add them to the batch
+
+        @return {int} number of new files
+        '''
+        count = 0
+        for obj in DS3.list_objects(self.s3, self.bucket, self.prefix,
+                                    self.start_after(), self.in_store.metrics):
+            key = obj['Key']
+            match = _KEY_RE.match(key)
+            if match is None or key in self.seen or key in self.batch:
+                continue
+            head = match.group(1)
+            hour = datetime.strptime(match.group(2), '%Y-%m-%d-%H')
+            # Listed again because another distribution starts earlier
+            watermark = self.watermarks.get(head)
+            if watermark is not None and hour < watermark - self.lookback:
+                continue
+            if watermark is None or hour > watermark:
+                self.watermarks[head] = hour
+            if self.batch_start is None:
+                self.batch_start = time.monotonic()
+            self.batch[key] = (head, hour, obj.get('Size', 0))
+            self.batch_bytes += obj.get('Size', 0)
+            count += 1
+
+        # Keys older than the lookback window are skipped regardless.
+        # Keys of the batch are kept until archived
+        self.seen = {k: (head, hour) for k, (head, hour) in self.seen.items()
+                     if hour >= self.watermarks[head] - self.lookback}
+        return count
+
+    def batch_ready(self):
+        '''Determine if the current batch is due for archiving
+
+        @return {bool} True if the batch is old or large enough
+        '''
+        if not self.batch:
+            return False
+        return (self.batch_bytes >= self.max_bytes) or \
+            (time.monotonic() - self.batch_start >= self.max_wait)
+
+    def flush(self):
+        '''Archive the current batch, if any
+
+        Keys that were not archived, e.g. whose fetch failed, stay in
+        the batch and are retried by the next flush. If archiving
+        raises, the whole batch is kept; keys archived before the error
+        are merged again without duplicating records
+
+        @return {list} list of keys that were processed
+        '''
+        if not self.batch:
+            return []
+        # Archive in delivery hour order, across distributions
+        keys = sorted(self.batch, key=lambda k: (self.batch[k][1], k))
+        processed = archiver.archive(keys, self.in_store, self.out_store,
+                                     self.delete_source)
+        for key in processed:
+            head, hour, size = self.batch.pop(key)
+            self.seen[key] = (head, hour)
+            self.batch_bytes -= size
+        if not self.batch:
+            self.batch_bytes = 0
+            self.batch_start = None
+        return processed
+
+    def run(self, poll_interval : float = 10, iterations : int = None,
+            max_backoff : float = 300):
+        '''Poll and archive until interrupted
+
+        Errors of a poll or flush, e.g. transient S3 errors, are printed
+        and retried after a delay doubling with every consecutive
+        failure, up to `max_backoff`
+
+        @param {float} poll_interval seconds between listings
+        @param {int} iterations number of polls, unbounded by default
+        @param {float} max_backoff longest delay after failures, in seconds
+        @return None
+        '''
+        i = 0
+        failures = 0
+        try:
+            while iterations is None or i < iterations:
+                delay = poll_interval
+                try:
+                    self.poll()
+                    if self.batch_ready():
+                        self.flush()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    delay = min(poll_interval * 2 ** failures, max_backoff)
+                    print('follow error, retrying in {}s: {!r}'.format(delay, e))
+                i += 1
+                if iterations is None or i < iterations:
+                    time.sleep(delay)
+        finally:
+            self.flush()
@@ -0,0 +1,212 @@
+import os, re, json, time, socket, hashlib, uuid
+
+
+# Directory, relative to the store root, holding lease objects
+LEASE_DIR = '.leases'
+LEASE_EXTENSION = '.lease'
+# Age after which an abandoned break lock of a file lease is removed
+BREAK_TIMEOUT = 60
+
+# <distribution-id>.<YYYY-mm-dd-HH>.<unique-id>.gz
+_SHARD_RE = re.compile(r'(\w{6,20})\.(\d{4}-\d{2}-\d{2}-\d{2})\.\w{8}\.gz$')
+
+
+class LeaseLost(Exception):
+    '''Raised when a lease expired and was taken over by another owner'''
+
+
+def default_owner():
+    '''Return an owner ID unique to this process
+
+    @return {str} <hostname>:<pid>:<random>
+    '''
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                             uuid.uuid4().hex[:8])
+
+
+def shard_of(key : str):
+    '''Return the shard of a raw CloudFront log key, i.e. its
+    distribution ID and delivery hour
+
+    @param {str} key e.g. E2ABCDEF12.2019-06-09-17.ab3a8cd4.gz
+    @return {str} shard name, e.g. E2ABCDEF12.2019-06-09-17, None if
+            not a CloudFront log key
+    '''
+    match = _SHARD_RE.search(key)
+    return None if match is None else '{}.{}'.format(*match.groups())
+
+
+def lease_file(name : str):
+    '''Return the file name of the lease object of `name`
+
+    @param {str} name lease name, e.g. a store key
+    @return {str} file name
+    '''
+    return hashlib.sha1(name.encode('utf-8')).hexdigest() + LEASE_EXTENSION
+
+
+def encode_lease(name : str, owner : str, ttl : float, done : list = None):
+    '''Serialize a lease held by `owner` for `ttl` seconds from now
+
+    Expiry uses wall clock time, so clocks of the workers sharing a
+    store must be reasonably synchronized
+
+    @param {str} name lease name
+    @param {str} owner owner ID
+    @param {float} ttl lease duration in seconds
+    @param {list} done keys completed under the lease, if any
+    @return {bytes} lease content
+    '''
+    lease = {'name': name, 'owner': owner, 'expires': time.time() + ttl}
+    if done is not None:
+        lease['done'] = list(done)
+    return json.dumps(lease).encode('utf-8')
+
+
+def decode_lease(data : bytes):
+    '''Parse lease content
+
+    @param {bytes} data lease content
+    @return {dict} lease, None if unreadable
+    '''
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def is_available(lease : dict, owner : str):
+    '''Determine if `owner` may take a lease
+
+    @param {dict} lease current lease, None if unreadable
+    @param {str} owner owner ID
+    @return {bool} True if expired, unreadable or already owned
+    '''
+    return (lease is None) or (lease.get('owner') == owner) \
+        or (lease.get('expires', 0) <= time.time())
+
+
+def read_file_lease(path : str):
+    '''Return the lease of a lockfile
+
+    Lease files are written in full before they appear, so unreadable
+    content is a corrupt file, held until BREAK_TIMEOUT after its last
+    modification
+
+    @param {str} path lease file path
+    @return {dict} lease, None if there is no lease file
+    '''
+    try:
+        with open(path, 'rb') as fd:
+            lease = decode_lease(fd.read())
+            mtime = os.fstat(fd.fileno()).st_mtime
+    except FileNotFoundError:
+        return None
+    if lease is None:
+        return {'owner': None, 'expires': mtime + BREAK_TIMEOUT}
+    return lease
+
+
+def _create(path : str, data : bytes):
+    # Atomically create the lease file with its content, return True
+    # if it did not exist. Hard links fail on existing targets
+    tmp = '{}.tmp{}'.format(path, uuid.uuid4().hex)
+    with open(tmp, 'wb') as fd:
+        fd.write(data)
+    try:
+        os.link(tmp, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+
+def _break_lock(path : str):
+    # Serializes takeovers and releases of an existing lease file.
+    # Return True if the lock was taken
+    breaker = path + '.break'
+    try:
+        os.close(os.open(breaker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        pass
+    # Holder died while holding the break lock
+    try:
+        if os.stat(breaker).st_mtime < time.time() - BREAK_TIMEOUT:
+            os.remove(breaker)
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def acquire_file_lease(path : str, name : str, owner : str, ttl : float):
+    '''Acquire or renew a lease backed by a local lockfile
+
+    The lease file is written to a temporary file and hard linked into
+    place, so it never appears without its content. Expired leases are
+    taken over, and own leases renewed, under an O_EXCL break lock so
+    that concurrent takeovers can not both succeed
+
+    @param {str} path lease file path
+    @param {str} name lease name
+    @param {str} owner owner ID
+    @param {float} ttl lease duration in seconds
+    @return {bool} True if `owner` holds the lease
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = encode_lease(name, owner, ttl)
+    if _create(path, data):
+        return True
+
+    lease = read_file_lease(path)
+    if lease is None:
+        # Released in the meantime
+        return _create(path, data)
+    if not is_available(lease, owner) or not _break_lock(path):
+        return False
+    try:
+        # Re-check under the break lock
+        lease = read_file_lease(path)
+        if lease is None:
+            return _create(path, data)
+        if not is_available(lease, owner):
+            return False
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+    finally:
+        os.remove(path + '.break')
+
+
+def release_file_lease(path : str, owner : str, done : list = None):
+    '''Release a lease backed by a local lockfile, if held by `owner`
+
+    @param {str} path lease file path
+    @param {str} owner owner ID
+    @param {list} done keys completed under the lease, kept in an
+           expired lease; the file is removed otherwise
+    @return {bool} True if the lease was released
+    '''
+    lease = read_file_lease(path)
+    if lease is None or lease.get('owner') != owner:
+        return False
+    # Spin briefly, the break lock is only held for a few file operations
+    while not _break_lock(path):
+        time.sleep(0.01)
+    try:
+        lease = read_file_lease(path)
+        if lease is None or lease.get('owner') != owner:
+            return False
+        if done is None:
+            os.remove(path)
+            return True
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(encode_lease(lease.get('name'), owner, -1, done))
+        os.replace(tmp, path)
+        return True
+    finally:
+        os.remove(path + '.break')
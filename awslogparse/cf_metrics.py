@@ -0,0 +1,241 @@
+import os, json, time, bisect, tempfile, threading, contextlib
+
+
+# Upper bounds, in seconds, of stage latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+# Stages timed by the stores, archiver and selector
+STAGES = ('list', 'fetch', 'decompress', 'parse', 'sort', 'merge',
+          'filter', 'compress', 'upload')
+
+
+def _label_key(labels : dict):
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(key : tuple, extra : tuple = ()):
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                          for k, v in pairs) + '}'
+
+
+class Histogram():
+    '''Cumulative histogram of observed values, as exposed by Prometheus
+
+    '''
+
+    def __init__(self, buckets : tuple = LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+        self.max = 0
+
+    def observe(self, value : float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q : float):
+        '''Return the upper bound of the bucket holding quantile `q`
+
+        @param {float} q quantile, in [0, 1]
+        @return {float} bucket bound, the maximum for the last bucket
+        '''
+        rank = q * self.count
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= rank and n > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return 0
+
+
+class Metrics():
+    '''Thread-safe sink of counters and stage latency histograms
+
+    Stores, the archiver and selectors record into the sink passed to
+    them, e.g. `DataStoreBase.enable_metrics`. Counters include
+
+      - objects_listed, objects_fetched
+      - bytes_downloaded, bytes_decompressed, bytes_uploaded
+      - rows_parsed, rows_filtered, rows_written, duplicates_dropped
+      - writes_skipped
+
+    and `stage_seconds` is a histogram labelled by stage, one of
+    `STAGES`. Stages are timed without nesting, so their totals add up
+    to the instrumented wall time, and the stage with the largest share
+    is the one limiting throughput
+
+    '''
+
+    def __init__(self, namespace : str = 'awslogparse'):
+        '''
+        @param {str} namespace prefix of the exported metric names
+        '''
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name : str, value : float = 1, **labels):
+        '''Increment a counter
+
+        @param {str} name counter name
+        @param {float} value increment
+        @param {kwargs} labels label name-value pairs
+        @return None
+        '''
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name : str, value : float, buckets : tuple = LATENCY_BUCKETS,
+                **labels):
+        '''Record a value into a histogram
+
+        @param {str} name histogram name
+        @param {float} value observed value
+        @param {tuple} buckets bucket bounds, used on first observation
+        @param {kwargs} labels label name-value pairs
+        @return None
+        '''
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, stage : str):
+        '''Context manager recording its duration into `stage_seconds`
+
+        @param {str} stage stage name
+        '''
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - t0, stage=stage)
+
+    def counter(self, name : str, **labels):
+        '''Return the value of a counter
+
+        @param {str} name counter name
+        @param {kwargs} labels label name-value pairs
+        @return {float} counter value, 0 if never incremented
+        '''
+        with self.lock:
+            return self.counters.get((name, _label_key(labels)), 0)
+
+    def summary(self):
+        '''Return counters and per-stage latency statistics
+
+        @return {dict} {'counters': {name: value},
+                        'stages': {stage: {count, seconds, share, mean,
+                                           p50, p99, max}}},
+                stages ordered by decreasing total time
+        '''
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters[name + _label_text(labels)] = value
+            stages = {dict(labels).get('stage'): hist
+                      for (name, labels), hist in self.histograms.items()
+                      if name == 'stage_seconds'}
+            total = sum(h.sum for h in stages.values())
+            ret = {'counters': counters, 'stages': {}}
+            for stage, hist in sorted(stages.items(), key=lambda x: -x[1].sum):
+                ret['stages'][stage] = {
+                    'count': hist.count,
+                    'seconds': hist.sum,
+                    'share': hist.sum / total if total > 0 else 0,
+                    'mean': hist.sum / hist.count,
+                    'p50': hist.quantile(0.5),
+                    'p99': hist.quantile(0.99),
+                    'max': hist.max,
+                }
+        return ret
+
+    def dumps(self):
+        '''Return the JSON summary
+
+        @sa summary
+        @return {str} JSON document
+        '''
+        return json.dumps(self.summary(), indent=2)
+
+    def prometheus(self):
+        '''Return the metrics in the Prometheus text exposition format
+
+        Counters are exported with a `_total` suffix
+
+        @return {str} exposition text
+        '''
+        lines = []
+        with self.lock:
+            names = sorted(set(name for name, labels in self.counters))
+            for name in names:
+                full = '{}_{}_total'.format(self.namespace, name)
+                lines.append('# TYPE {} counter'.format(full))
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append('{}{} {}'.format(full, _label_text(labels), value))
+
+            names = sorted(set(name for name, labels in self.histograms))
+            for name in names:
+                full = '{}_{}'.format(self.namespace, name)
+                lines.append('# TYPE {} histogram'.format(full))
+                for (n, labels), hist in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    total = 0
+                    for bound, count in zip(hist.bounds + ('+Inf',), hist.counts):
+                        total += count
+                        lines.append('{}_bucket{} {}'.format(
+                            full, _label_text(labels, (('le', bound),)), total))
+                    lines.append('{}_sum{} {}'.format(full, _label_text(labels), hist.sum))
+                    lines.append('{}_count{} {}'.format(full, _label_text(labels), hist.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path : str):
+        '''Atomically write the metrics to a file
+
+        Files ending with `.prom` are written in the Prometheus text
+        format, e.g. for the node exporter textfile collector, and
+        other files as the JSON summary
+
+        @param {str} path output file
+        @return None
+        '''
+        data = self.prometheus() if path.endswith('.prom') else self.dumps()
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class NullMetrics(Metrics):
+    '''Sink discarding everything, used when no metrics are enabled
+
+    '''
+
+    def inc(self, name : str, value : float = 1, **labels):
+        return
+
+    def observe(self, name : str, value : float, buckets : tuple = LATENCY_BUCKETS,
+                **labels):
+        return
+
+    def timer(self, stage : str):
+        return contextlib.nullcontext()
+
+
+# Shared default sink
+NULL = NullMetrics()
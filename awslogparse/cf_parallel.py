@@ -0,0 +1,223 @@
+import io, gzip, itertools
+from collections import deque
+from io import TextIOWrapper
+from .cf_accesslog import AccessLog, AccessLogQuery, parse
+from .cf_rawlog import RawLog
+from . import cf_metrics as MT
+
+
+# Decompressed bytes per chunk handed to a worker
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def iter_chunks(fd, chunk_bytes : int = CHUNK_BYTES, metrics : MT.Metrics = MT.NULL):
+    '''Generator yielding the content of a binary stream in chunks of
+    whole lines
+
+    Every read of `chunk_bytes` is cut after its last newline, and the
+    remainder is prepended to the next chunk, so that chunks hold about
+    `chunk_bytes` unless a line is longer. The last chunk may miss a
+    trailing newline
+
+    @param {file} fd binary stream, e.g. a GzipFile
+    @param {int} chunk_bytes bytes read at a time
+    @param {Metrics} metrics sink counting the bytes read
+    @return {Generator} bytes
+    '''
+    rest = b''
+    while True:
+        block = fd.read(chunk_bytes)
+        if not block:
+            break
+        metrics.inc('bytes_decompressed', len(block))
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            rest = block
+            continue
+        rest = block[cut:]
+        yield block[:cut]
+    if rest:
+        yield rest
+
+
+def _parse_chunk(chunk : bytes):
+    # Rows of a chunk, split as `cf_accesslog.parse` does
+    return [line.rstrip().split('\t') for line in TextIOWrapper(io.BytesIO(chunk))]
+
+
+def _select_chunk(args):
+    headers, chunk, columns, conditions, limit, reverse = args
+    return RawLog(chunk, headers).select(columns, conditions, limit, reverse).rows
+
+
+def _ordered(pool, fn, chunks, window : int, metrics : MT.Metrics, stage : str):
+    # Yield fn(chunk) in chunk order, reading and submitting chunks
+    # while at most `window` results are pending. Reads are timed as
+    # decompression, waits for results as `stage`
+    pending = deque()
+
+    def result():
+        with metrics.timer(stage):
+            return pending.popleft().result()
+
+    try:
+        while True:
+            with metrics.timer('decompress'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            pending.append(pool.submit(fn, chunk))
+            if len(pending) >= window:
+                yield result()
+        while pending:
+            yield result()
+    finally:
+        # Pools may be shared, drop the work of a closed generator only
+        for future in pending:
+            future.cancel()
+
+
+def _map_chunks(fn, chunks, workers : int, metrics : MT.Metrics, stage : str,
+                pool = None):
+    '''Generator yielding fn(chunk) for every chunk, in chunk order
+
+    Chunks are read, and thus decompressed, while workers process the
+    previous ones. Inputs of a single chunk are processed in-process.
+    Without a `pool`, one is started for the call
+
+    '''
+    chunks = iter(chunks)
+    with metrics.timer('decompress'):
+        head = list(itertools.islice(chunks, 2))
+    if len(head) <= 1:
+        for chunk in head:
+            with metrics.timer(stage):
+                result = fn(chunk)
+            yield result
+        return
+
+    if pool is not None:
+        yield from _ordered(pool, fn, itertools.chain(head, chunks), 2 * workers,
+                            metrics, stage)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield from _ordered(pool, fn, itertools.chain(head, chunks), 2 * workers,
+                            metrics, stage)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _read_header(fd, metrics : MT.Metrics):
+    # Version and header lines, as read by `cf_accesslog.parse`
+    lines = [fd.readline(), fd.readline()]
+    metrics.inc('bytes_decompressed', len(lines[0]) + len(lines[1]))
+    lines = [line.decode('utf-8') for line in lines]
+    ver, headers, rows = parse(lines)
+    return ver, headers
+
+
+def _binary_stream(data : bytes):
+    if data[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb')
+    return io.BytesIO(data)
+
+
+def load(fd, workers : int, chunk_bytes : int = None,
+         metrics : MT.Metrics = MT.NULL, pool = None):
+    '''Load an access log from a binary stream, parsing chunks of it in
+    worker processes
+
+    Rows are concatenated in chunk order, then sorted in-process
+
+    @sa AccessLog.load
+    @param {file} fd binary stream of the decompressed content, e.g. a
+           GzipFile
+    @param {int} workers number of worker processes
+    @param {int} chunk_bytes decompressed bytes per chunk
+    @param {Metrics} metrics sink timing the decompress, parse and sort
+           stages
+    @param {ProcessPoolExecutor} pool pool of `workers` processes to
+           reuse, one is started for the call by default
+    @return {AccessLog} sorted data as a new AccessLog object
+    '''
+    ver, headers = _read_header(fd, metrics)
+    rows = []
+    if ver == '1.0':
+        chunks = iter_chunks(fd, chunk_bytes or CHUNK_BYTES, metrics)
+        for chunk_rows in _map_chunks(_parse_chunk, chunks, workers, metrics, 'parse',
+                                      pool):
+            rows += chunk_rows
+    metrics.inc('rows_parsed', len(rows))
+    with metrics.timer('sort'):
+        return AccessLog(ver, headers, rows).sort()
+
+
+def loads(data : bytes, workers : int, chunk_bytes : int = None,
+          metrics : MT.Metrics = MT.NULL, pool = None):
+    '''Same as `load`, from the content of an access log file
+
+    @param {bytes} data file content, gzipped or not
+    @return {AccessLog} sorted data as a new AccessLog object
+    '''
+    return load(_binary_stream(data), workers, chunk_bytes, metrics, pool)
+
+
+def select(fd, columns, conditions : dict, workers : int,
+           chunk_bytes : int = None, limit : int = None, reverse : bool = False,
+           metrics : MT.Metrics = MT.NULL, pool = None):
+    '''Run a selection over a binary stream, filtering chunks of it in
+    worker processes
+
+    Results are the same as `RawLog.select`: rows are in file order and
+    only the selected fields of matching rows are decoded. Forward
+    selections with a `limit` stop reading once it is reached
+
+    @sa RawLog.select
+    @param {file} fd binary stream of the decompressed content
+    @param {list} columns names to include in results, or `*`
+    @param {dict} conditions column-regex key-value pairs
+    @param {int} workers number of worker processes
+    @param {int} chunk_bytes decompressed bytes per chunk
+    @param {int} limit stop after this many matching rows, if any
+    @param {bool} reverse scan rows from last to first
+    @param {Metrics} metrics sink timing the decompress and filter stages
+    @param {ProcessPoolExecutor} pool pool of `workers` processes to
+           reuse, one is started for the call by default
+    @return {AccessLogQuery} results matching the query
+    '''
+    ver, headers = _read_header(fd, metrics)
+    if (columns == '*') or (columns == '[*]'):
+        columns = headers
+    if ver != '1.0' or (limit is not None and limit <= 0):
+        return AccessLogQuery([], columns)
+
+    chunks = ((headers, chunk, columns, conditions, limit, reverse)
+              for chunk in iter_chunks(fd, chunk_bytes or CHUNK_BYTES, metrics))
+    results = _map_chunks(_select_chunk, chunks, workers, metrics, 'filter', pool)
+    rows = []
+    try:
+        for chunk_rows in (reversed(list(results)) if reverse else results):
+            rows += chunk_rows
+            if limit is not None and len(rows) >= limit:
+                del rows[limit:]
+                break
+    finally:
+        # Stops the workers, once the limit is reached
+        results.close()
+    return AccessLogQuery(rows, columns)
+
+
+def selects(data : bytes, columns, conditions : dict, workers : int,
+            chunk_bytes : int = None, limit : int = None, reverse : bool = False,
+            metrics : MT.Metrics = MT.NULL, pool = None):
+    '''Same as `select`, over the content of an access log file
+
+    @param {bytes} data file content, gzipped or not
+    @return {AccessLogQuery} results matching the query
+    '''
+    return select(_binary_stream(data), columns, conditions, workers, chunk_bytes,
+                  limit, reverse, metrics, pool)
@@ -0,0 +1,109 @@
+import re
+from datetime import datetime
+from . import cf_accesslog as AL
+
+
+# Raw CloudFront log key, <distribution-id>.<YYYY-mm-dd-HH>.<unique-id>.gz
+_CF_KEY_RE = re.compile(r'(?:^|/)(\w{6,20})\.(\d{4}-\d{2}-\d{2}-\d{2})\.\w{8}\.gz$')
+
+
+def distribution_id(key : str):
+    '''Return the distribution ID of a raw CloudFront log key
+
+    @param {str} key e.g. logs/E2ABCDEF123456.2019-06-09-17.ab3a8cd4.gz
+    @return {str} distribution ID, None if not a CloudFront log key
+    '''
+    match = _CF_KEY_RE.search(key)
+    return None if match is None else match.group(1)
+
+
+def delivery_hour(key : str):
+    '''Return the delivery hour in the name of a raw CloudFront log key
+
+    @param {str} key e.g. logs/E2ABCDEF123456.2019-06-09-17.ab3a8cd4.gz
+    @return {str} hour in YYYY-mm-dd-HH format, None if not a
+            CloudFront log key
+    '''
+    match = _CF_KEY_RE.search(key)
+    return None if match is None else match.group(2)
+
+
+def key_partition(key : str, extension : str):
+    '''Return the partition of a stored key, i.e. its YYYY-mm-dd or
+    YYYY-mm-dd-HH name
+
+    @param {str} key stored key, e.g. db/2019/01/2019-01-02-13.gz
+    @param {str} extension extension of stored keys
+    @return {str} partition name, None if `key` is not a stored key
+    '''
+    match = re.search(r'(\d{4}-\d{2}-\d{2}(?:-\d{2})?)' + re.escape(extension) + '$',
+                      key)
+    return None if match is None else match.group(1)
+
+
+def sort_keys(keys, extension : str):
+    '''Sort stored keys by time, then by distribution
+
+    Plain sorting would order per-distribution keys by distribution
+    first, which breaks time ordered scans over several distributions
+
+    @param {iterable} keys stored keys
+    @param {str} extension extension of stored keys
+    @return {list} sorted list of keys
+    '''
+    return sorted(keys, key=lambda k: (key_partition(k, extension) or '', k))
+
+
+class PartitionScheme():
+    '''Specifies how records are split into stored keys
+
+    By default records are stored one key per day, e.g.
+    2019/01/2019-01-02.gz. Hourly partitions are named after the hour,
+    e.g. 2019/01/2019-01-02-13.gz, and per-distribution partitions are
+    placed under the distribution ID, e.g. E2ABCDEF123456/2019/01/...
+
+    '''
+
+    def __init__(self, hourly : bool = False, by_distribution : bool = False):
+        '''
+        @param {bool} hourly one partition per hour instead of per day
+        @param {bool} by_distribution separate partitions per
+                      distribution ID
+        '''
+        self.hourly = hourly
+        self.by_distribution = by_distribution
+
+    def grouper_generator(self):
+        '''Return the generator splitting sorted records into partitions
+
+        @sa DataStoreBase.grouper_generator
+        @return {function} generator taking an AccessLog
+        '''
+        if self.hourly:
+            return AL.group_by_hour_generator
+        return AL.group_by_date_generator
+
+    def path(self, row : list, distribution : str = None, extension : str = ''):
+        '''Return the path components of the partition holding `row`
+
+        @param {list} row CF row data. ['YYYY-mm-dd'] is sufficient for
+                      daily partitions, hourly ones also need the time
+        @param {str} distribution distribution ID, required with
+                     `by_distribution`
+        @param {str} extension extension of stored keys
+        @return {list} path components, e.g. ['2019', '01', '2019-01-02.gz']
+        '''
+        date_str = row[0]
+        dt = datetime.strptime(date_str, '%Y-%m-%d')
+        name = date_str
+        if self.hourly:
+            if len(row) < 2:
+                raise ValueError('Hourly partitions require the record time')
+            name += '-' + row[1][:2]
+
+        ret = [str(dt.year), '{:02}'.format(dt.month), name + extension]
+        if self.by_distribution:
+            if distribution is None:
+                raise ValueError('Per-distribution partitions require a distribution ID')
+            ret.insert(0, distribution)
+        return ret
@@ -0,0 +1,279 @@
+import os, sys, atexit, threading, tracemalloc, contextlib
+from collections import Counter
+from .cf_metrics import Metrics
+
+
+# Environment variables enabling profiling without code changes
+ENV_DIR = 'AWSLOGPARSE_PROFILE'
+ENV_MODE = 'AWSLOGPARSE_PROFILE_MODE'
+ENV_INTERVAL = 'AWSLOGPARSE_PROFILE_INTERVAL'
+ENV_ALLOCATIONS = 'AWSLOGPARSE_PROFILE_ALLOCATIONS'
+
+MODES = ('sample', 'cprofile')
+
+
+def collapse(frame, max_depth : int = 128):
+    '''Return the call stack ending at `frame`, outermost call first
+
+    @param {frame} frame innermost frame
+    @param {int} max_depth number of innermost frames kept
+    @return {list} list of module:function names
+    '''
+    ret = []
+    while frame is not None and len(ret) < max_depth:
+        code = frame.f_code
+        ret.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), code.co_name))
+        frame = frame.f_back
+    return ret[::-1]
+
+
+class Profiler(Metrics):
+    '''Metrics sink profiling the stages it times
+
+    Hot paths are timed as stages by the stores, archiver and
+    selectors, e.g. parse, sort, merge (remove_duplicates), filter
+    (select), compress (dump), fetch and upload (store I/O). Installed
+    as the default sink of all stores, the profiler records their
+    metrics, and, depending on `mode`,
+
+      - sample: samples the stacks of all threads every `interval`
+        seconds, and writes them in the collapsed format read by
+        flamegraph.pl and speedscope, rooted at the active stage
+      - cprofile: runs cProfile in the thread calling `start`, and
+        writes its statistics
+
+    With `allocations`, tracemalloc also records the allocation sites
+    of the first `snapshots` calls of every stage, and the `allocations`
+    largest ones are written per stage. Tracing allocations slows
+    execution significantly
+
+    Files are suffixed with the process ID, so that several processes
+    may share an output directory
+
+    '''
+
+    def __init__(self, out_dir : str, mode : str = 'sample', interval : float = 0.005,
+                 allocations : int = 0, snapshots : int = 3):
+        '''
+        @param {str} out_dir directory the profiles are written to
+        @param {str} mode one of `MODES`
+        @param {float} interval seconds between stack samples
+        @param {int} allocations number of allocation sites reported
+               per stage, 0 to disable tracemalloc
+        @param {int} snapshots calls per stage whose allocations are traced
+        '''
+        super().__init__()
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode {}'.format(mode))
+        self.out_dir = out_dir
+        self.mode = mode
+        self.interval = interval
+        self.allocations = allocations
+        self.snapshots = snapshots
+
+        # Active stages of every thread, innermost last
+        self.active = {}
+        self.samples = Counter()
+        self.allocation_sites = {}
+        self.snapshot_counts = Counter()
+        self.sampler = None
+        self.stopping = threading.Event()
+        self.cprofile = None
+        self.started_tracemalloc = False
+        self.installed = None
+
+    @contextlib.contextmanager
+    def timer(self, stage : str):
+        stack = self.active.setdefault(threading.get_ident(), [])
+        stack.append(stage)
+        before = self._snapshot(stage)
+        try:
+            with super().timer(stage):
+                yield
+        finally:
+            stack.pop()
+            if before is not None:
+                self._record_allocations(stage, before)
+
+    def _snapshot(self, stage : str):
+        if not self.allocations or not tracemalloc.is_tracing():
+            return None
+        with self.lock:
+            if self.snapshot_counts[stage] >= self.snapshots:
+                return None
+            self.snapshot_counts[stage] += 1
+        return tracemalloc.take_snapshot()
+
+    def _record_allocations(self, stage : str, before):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__)]
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        stats = after.compare_to(before.filter_traces(ignore), 'lineno')
+        with self.lock:
+            sites = self.allocation_sites.setdefault(stage, Counter())
+            for stat in stats:
+                if stat.size_diff > 0:
+                    sites[str(stat.traceback[0])] += stat.size_diff
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                try:
+                    root = self.active[ident][-1]
+                except (KeyError, IndexError):
+                    root = 'other'
+                stack = ';'.join([root] + collapse(frame))
+                with self.lock:
+                    self.samples[stack] += 1
+
+    def start(self):
+        '''Start profiling
+
+        @return {Profiler} self
+        '''
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        if self.mode == 'sample':
+            self.stopping.clear()
+            self.sampler = threading.Thread(target=self._sample, daemon=True,
+                                            name='awslogparse-profiler')
+            self.sampler.start()
+        else:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        return self
+
+    def stop(self):
+        '''Stop profiling, keeping the collected data
+
+        @return None
+        '''
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.uninstall()
+        self.write_profiles()
+
+    def install(self, base=None):
+        '''Make the profiler the sink of stores without their own
+
+        @param {type} base store base class, DataStoreBase by default
+        @return {Profiler} self
+        '''
+        if base is None:
+            from .cf_datastore import DataStoreBase as base
+        self.installed = (base, base.metrics)
+        base.metrics = self
+        return self
+
+    def uninstall(self):
+        '''Restore the default sink replaced by `install`
+
+        @return None
+        '''
+        if self.installed is not None:
+            base, metrics = self.installed
+            base.metrics = metrics
+            self.installed = None
+
+    def path(self, name : str):
+        return os.path.join(self.out_dir, '{}-{}'.format(name, os.getpid()))
+
+    def write_profiles(self):
+        '''Write the collected profiles and metrics to `out_dir`
+
+        Writes, as available
+          - profile-<pid>.collapsed stack samples
+          - profile-<pid>.pstats and profile-<pid>.txt cProfile statistics
+          - allocations-<pid>.txt largest allocation sites per stage
+          - metrics-<pid>.json metrics summary
+
+        @return {list} paths of the written files
+        '''
+        os.makedirs(self.out_dir, exist_ok=True)
+        ret = []
+        if self.samples:
+            path = self.path('profile') + '.collapsed'
+            with self.lock, open(path, 'w') as fd:
+                for stack, count in sorted(self.samples.items()):
+                    fd.write('{} {}\n'.format(stack, count))
+            ret.append(path)
+
+        if self.cprofile is not None:
+            import pstats
+            path = self.path('profile')
+            self.cprofile.dump_stats(path + '.pstats')
+            with open(path + '.txt', 'w') as fd:
+                stats = pstats.Stats(self.cprofile, stream=fd)
+                stats.sort_stats('cumulative').print_stats(50)
+            ret += [path + '.pstats', path + '.txt']
+
+        if self.allocation_sites:
+            path = self.path('allocations') + '.txt'
+            with self.lock, open(path, 'w') as fd:
+                for stage, sites in sorted(self.allocation_sites.items()):
+                    fd.write('{} (first {} calls)\n'.format(
+                        stage, self.snapshot_counts[stage]))
+                    for site, size in sites.most_common(self.allocations):
+                        fd.write('  {:>12.1f} KiB  {}\n'.format(size / 1024, site))
+            ret.append(path)
+
+        path = self.path('metrics') + '.json'
+        self.write(path)
+        ret.append(path)
+        return ret
+
+
+def from_environment(environ : dict = os.environ):
+    '''Return a profiler configured by environment variables, if enabled
+
+      - AWSLOGPARSE_PROFILE: output directory, enables profiling
+      - AWSLOGPARSE_PROFILE_MODE: sample (default) or cprofile
+      - AWSLOGPARSE_PROFILE_INTERVAL: seconds between samples
+      - AWSLOGPARSE_PROFILE_ALLOCATIONS: allocation sites per stage
+
+    @param {dict} environ environment variables
+    @return {Profiler} profiler, not started, None if not enabled
+    '''
+    out_dir = environ.get(ENV_DIR)
+    if not out_dir:
+        return None
+    return Profiler(out_dir, environ.get(ENV_MODE, 'sample'),
+                    float(environ.get(ENV_INTERVAL, 0.005)),
+                    int(environ.get(ENV_ALLOCATIONS, 0)))
+
+
+def install_from_environment(base):
+    '''Profile all stores until exit, if enabled by the environment
+
+    @sa from_environment
+    @param {type} base store base class
+    @return {Profiler} running profiler, None if not enabled
+    '''
+    profiler = from_environment()
+    if profiler is None:
+        return None
+    profiler.install(base).start()
+
+    def finish():
+        profiler.stop()
+        profiler.write_profiles()
+    atexit.register(finish)
+    return profiler
@@ -0,0 +1,271 @@
+import re, gzip
+from array import array
+from .cf_accesslog import AccessLog, AccessLogQuery, Equals, regex_literal
+from . import cf_metrics as MT
+
+
+# Bytes stripped from line ends, as str.rstrip does
+_WHITESPACE = frozenset(b' \t\r\n\x0b\x0c')
+
+
+def _field_offsets(find, start : int, end : int, n : int):
+    # Start offsets of the first `n` fields of the line [start, end),
+    # followed by one past the end of the last located field
+    ret = [start]
+    pos = start
+    for i in range(n):
+        tab = find(b'\t', pos, end)
+        if tab < 0:
+            ret.append(end + 1)
+            break
+        pos = tab + 1
+        ret.append(pos)
+    return ret
+
+
+def compile_bytes_condition(expr):
+    '''Return a matcher of a `where` condition over a bytes buffer
+
+    The matcher takes (buffer, memoryview, start, end) and tests the
+    field buffer[start:end]. Anchored literal regexes and `Equals` are
+    compared in place, other ASCII regexes are searched on the bytes,
+    and remaining conditions on the decoded value. CloudFront escapes
+    non-ASCII characters in its fields, so bytes and str regexes match
+    alike
+
+    @sa compile_condition
+    @param {str|Equals|Between} expr regex string or condition object
+    @return {function} matcher
+    '''
+    if isinstance(expr, Equals):
+        value = expr.value.encode('utf-8')
+        return lambda data, mv, s, e: e - s == len(value) and data.startswith(value, s)
+
+    if isinstance(expr, str):
+        literal = regex_literal(expr)
+        if literal is not None:
+            value = literal[0].encode('utf-8')
+            if literal[1]:
+                return lambda data, mv, s, e: e - s == len(value) and data.startswith(value, s)
+            return lambda data, mv, s, e: data.startswith(value, s, e)
+        if expr.isascii():
+            pattern = re.compile(expr.encode('ascii'))
+            return lambda data, mv, s, e: pattern.search(mv[s:e]) is not None
+        pattern = re.compile(expr)
+        return lambda data, mv, s, e: pattern.search(str(mv[s:e], 'utf-8')) is not None
+
+    return lambda data, mv, s, e: bool(expr.search(str(mv[s:e], 'utf-8')))
+
+
+class RawRecord():
+    '''Record backed by offsets into the buffer of a RawLog
+
+    Fields are decoded on access
+
+    '''
+
+    __slots__ = ('log', 'start', 'end', 'offsets')
+
+    def __init__(self, log, start : int, end : int):
+        self.log = log
+        self.start = start
+        self.end = end
+        self.offsets = None
+
+    def _locate(self):
+        if self.offsets is None:
+            self.offsets = _field_offsets(self.log.data.find, self.start, self.end,
+                                          len(self.log.headers))
+        return self.offsets
+
+    def __len__(self):
+        return len(self._locate()) - 1
+
+    def field(self, index : int):
+        '''Return the raw bytes of a field, without copying
+
+        @param {int} index column index
+        @return {memoryview} field bytes
+        '''
+        offsets = self._locate()
+        if index + 1 >= len(offsets):
+            raise IndexError('Record has {} fields'.format(len(offsets) - 1))
+        return self.log.view[offsets[index]:offsets[index + 1] - 1]
+
+    def __getitem__(self, index : int):
+        return str(self.field(index), 'utf-8')
+
+    def to_list(self):
+        '''Decode all fields
+
+        @return {list} list of strings, as a row of AccessLog
+        '''
+        return str(self.log.view[self.start:self.end], 'utf-8').split('\t')
+
+
+class RawLog():
+    '''Access log indexed over its decompressed bytes
+
+    Only line boundaries are located on load. `select` evaluates
+    conditions on the bytes of the condition columns, and decodes to
+    str only the selected fields of matching rows, so that selective
+    queries allocate little more than their results
+
+    Rows are kept in file order, which is sorted for logs written by
+    the stores
+
+    '''
+
+    def __init__(self, data : bytes, headers : list = None):
+        '''
+        @param {bytes} data decompressed log content
+        @param {list} headers column names, if `data` holds version 1.0
+               rows without the header lines, e.g. a chunk of a file
+        '''
+        self.data = data
+        self.view = memoryview(data)
+        self.version = ''
+        self.headers = []
+        self.column_map = {}
+        self.starts = array('Q')
+        self.ends = array('Q')
+
+        if headers is None:
+            pos = self._header(0)
+        else:
+            self.version = '1.0'
+            self.headers = headers
+            self.column_map = {h: i for i, h in enumerate(headers)}
+            pos = 0
+
+        find = data.find
+        size = len(data)
+        starts = self.starts
+        ends = self.ends
+        while pos < size:
+            end = find(b'\n', pos)
+            if end < 0:
+                end = size
+            stop = end
+            while stop > pos and data[stop - 1] in _WHITESPACE:
+                stop -= 1
+            starts.append(pos)
+            ends.append(stop)
+            pos = end + 1
+
+    def _header(self, pos : int):
+        # Parse the version and fields lines, return the offset of the rows
+        end = self.data.find(b'\n', pos)
+        line = str(self.view[pos:end if end >= 0 else len(self.data)], 'utf-8')
+        split = line.rstrip().split(' ')
+        self.version = split[1] if len(split) > 1 else ''
+        if self.version != '1.0' or end < 0:
+            return len(self.data)
+        pos = end + 1
+        end = self.data.find(b'\n', pos)
+        line = str(self.view[pos:end if end >= 0 else len(self.data)], 'utf-8')
+        self.headers = line.rstrip().split(' ')[1:]
+        self.column_map = {h: i for i, h in enumerate(self.headers)}
+        return len(self.data) if end < 0 else end + 1
+
+    @staticmethod
+    def loads(data : bytes, metrics : MT.Metrics = MT.NULL):
+        '''Index the content of an access log file
+
+        @param {bytes} data file content, gzipped or not
+        @param {Metrics} metrics sink timing the decompress and parse
+               stages
+        @return {RawLog} indexed log
+        '''
+        if data[:2] == b'\x1f\x8b':
+            with metrics.timer('decompress'):
+                data = gzip.decompress(data)
+        metrics.inc('bytes_decompressed', len(data))
+        with metrics.timer('parse'):
+            ret = RawLog(data)
+        metrics.inc('rows_parsed', ret.record_count())
+        return ret
+
+    def record_count(self):
+        return len(self.starts)
+
+    def record(self, index : int):
+        '''Return the record at `index`
+
+        @param {int} index row index
+        @return {RawRecord} record
+        '''
+        return RawRecord(self, self.starts[index], self.ends[index])
+
+    def records(self):
+        '''Generator yielding all records in file order
+
+        @return {Generator} RawRecord objects
+        '''
+        for start, end in zip(self.starts, self.ends):
+            yield RawRecord(self, start, end)
+
+    def access_log(self):
+        '''Decode all rows into an AccessLog, in file order
+
+        @return {AccessLog} log
+        '''
+        return AccessLog(self.version, list(self.headers),
+                         [r.to_list() for r in self.records()])
+
+    def select(self, columns, conditions : dict, limit : int = None,
+               reverse : bool = False, indices : list = None):
+        '''Same as `AccessLog.select`, decoding only the returned fields
+
+        Fields missing from short rows are treated as empty
+
+        @param {list} columns names to include in results, or `*`
+        @param {dict} conditions column-regex key-value pairs
+        @param {int} limit stop after this many matching rows, if any
+        @param {bool} reverse scan rows from last to first
+        @param {list} indices sorted row indices to scan, all by default
+        @return {AccessLogQuery} results matching the query
+        '''
+        if (columns == '*') or (columns == '[*]'):
+            columns = self.headers
+
+        matchers = [(self.column_map[c], compile_bytes_condition(v))
+                    for c, v in conditions.items()]
+        select_cols = [self.column_map[x] for x in columns]
+        # Fields located per row: up to the last condition column, and,
+        # for matching rows, up to the last selected column
+        ncond = max([i for i, m in matchers], default=-1) + 1
+        nselect = max(select_cols, default=-1) + 1
+
+        rows = []
+        if limit is not None and limit <= 0:
+            return AccessLogQuery(rows, columns)
+
+        data = self.data
+        mv = self.view
+        find = data.find
+        if indices is None:
+            indices = range(len(self.starts))
+        for i in (reversed(indices) if reverse else indices):
+            start = self.starts[i]
+            end = self.ends[i]
+            offsets = _field_offsets(find, start, end, ncond)
+            matched = True
+            for index, matcher in matchers:
+                if index + 1 < len(offsets):
+                    s, e = offsets[index], offsets[index + 1] - 1
+                else:
+                    s = e = end
+                if not matcher(data, mv, s, e):
+                    matched = False
+                    break
+            if not matched:
+                continue
+
+            if nselect > ncond:
+                offsets = _field_offsets(find, start, end, nselect)
+            rows.append([str(mv[offsets[x]:offsets[x + 1] - 1], 'utf-8')
+                         if x + 1 < len(offsets) else '' for x in select_cols])
+            if limit is not None and len(rows) >= limit:
+                break
+        return AccessLogQuery(rows, columns)
@@ -0,0 +1,108 @@
+import json, gzip, hashlib, threading
+from collections import OrderedDict
+from .cf_accesslog import AccessLogQuery
+from .cf_diskcache import DiskCache
+
+
+def plan_key(columns, conditions : dict, **options):
+    '''Return a normalized representation of a per-key query plan
+
+    Two plans selecting the same rows produce the same representation
+    regardless of condition ordering
+
+    @param {list} columns selected columns, or `*`
+    @param {dict} conditions column-regex key-value pairs
+    @param {kwargs} options other parameters affecting the results,
+                    e.g. limit and scan direction
+    @return {str} normalized plan
+    '''
+    if columns in ('*', '[*]'):
+        columns = '*'
+    return json.dumps({'columns': columns,
+                       'conditions': sorted((c, repr(v)) for c, v in conditions.items()),
+                       'options': sorted(options.items())})
+
+
+class QueryResultCache():
+    '''Bounded cache of per-key query results
+
+    Results are keyed on the normalized query plan, the store key and
+    the fingerprint of the data of that key (e.g. mtime and size, or
+    ETag), so an entry is never served once the underlying data
+    changes. Entries are kept in a memory LRU and, optionally, in an
+    on-disk cache that may be shared between processes
+
+    '''
+
+    def __init__(self, max_entries : int = 1024, root_dir : str = None,
+                 max_disk_bytes : int = 512 * 1024 * 1024):
+        '''
+        @param {int} max_entries maximum number of in-memory entries
+        @param {str} root_dir on-disk cache directory. None to keep
+                     results in memory only
+        @param {int} max_disk_bytes size cap of the on-disk cache
+        '''
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.disk = None if root_dir is None else DiskCache(root_dir, max_disk_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_key(plan : str, key : str, fingerprint):
+        doc = json.dumps([plan, key, fingerprint])
+        return hashlib.sha1(doc.encode('utf-8')).hexdigest()
+
+    def get(self, plan : str, key : str, fingerprint):
+        '''Return cached results of `plan` over the data of `key`
+
+        @param {str} plan normalized query plan
+        @param {str} key store key
+        @param {any} fingerprint current fingerprint of the data
+        @return {AccessLogQuery} copy of the cached results, or None
+        '''
+        ek = self.entry_key(plan, key, fingerprint)
+        with self.lock:
+            entry = self.entries.get(ek)
+            if entry is not None:
+                self.entries.move_to_end(ek)
+        if entry is None and self.disk is not None:
+            stored = self.disk.get(ek)
+            if stored is not None:
+                doc = json.loads(gzip.decompress(stored[1]).decode('utf-8'))
+                entry = (doc['headers'], doc['rows'])
+                self._remember(ek, entry)
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        headers, rows = entry
+        return AccessLogQuery(list(rows), list(headers))
+
+    def put(self, plan : str, key : str, fingerprint, result : AccessLogQuery):
+        '''Store results of `plan` over the data of `key`
+
+        @param {str} plan normalized query plan
+        @param {str} key store key
+        @param {any} fingerprint fingerprint of the data the results
+                     were computed from
+        @param {AccessLogQuery} result query results
+        @return None
+        '''
+        ek = self.entry_key(plan, key, fingerprint)
+        entry = (list(result.headers), list(result.rows))
+        self._remember(ek, entry)
+        if self.disk is not None:
+            doc = {'headers': entry[0], 'rows': entry[1]}
+            self.disk.put(ek, 'result',
+                          gzip.compress(json.dumps(doc).encode('utf-8')))
+
+    def _remember(self, ek, entry):
+        with self.lock:
+            self.entries[ek] = entry
+            self.entries.move_to_end(ek)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
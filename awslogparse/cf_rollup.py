@@ -0,0 +1,158 @@
+import gzip
+
+
+SIDECAR_SUFFIX = '.rollup'
+
+# Dimensions of a rollup entry, in key order
+DIMENSIONS = ['date', 'hour', 'status', 'edge']
+# Aggregated metrics, in value order
+METRICS = ['requests', 'bytes', 'errors', 'hits']
+
+# x-edge-result-type values counted as cache hits
+HIT_TYPES = ('Hit', 'RefreshHit')
+
+
+def status_class(status : str):
+    '''Return the class of an http status code, e.g. `404` -> `4xx`
+
+    @param {str} status sc-status column value
+    @return {str} status class, '-' if status is not a code
+    '''
+    if len(status) == 3 and status.isdigit():
+        return status[0] + 'xx'
+    return '-'
+
+
+class RollupTable():
+    '''Per-hour aggregates of an access log
+
+    Entries are keyed by (date, hour, status class, edge location) and
+    hold the number of requests, bytes sent, edge errors and cache hits
+
+    '''
+
+    def __init__(self, entries : dict = None):
+        self.entries = {} if entries is None else entries
+
+    @staticmethod
+    def from_log(log, rows : list = None):
+        '''Compute the rollup of an access log
+
+        @param {AccessLog} log source access log
+        @param {list} rows subset of rows to use. Defaults to all rows
+        @return {RollupTable} rollup of the rows
+        '''
+        if rows is None:
+            rows = log.rows
+
+        cmap = log.column_map
+        date_i = cmap.get('date', 0)
+        time_i = cmap.get('time', 1)
+        status_i = cmap.get('sc-status')
+        edge_i = cmap.get('x-edge-location')
+        bytes_i = cmap.get('sc-bytes')
+        result_i = cmap.get('x-edge-result-type')
+
+        entries = {}
+        for row in rows:
+            status = '-' if status_i is None else status_class(row[status_i])
+            edge = '-' if edge_i is None else row[edge_i]
+            key = (row[date_i], row[time_i][:2], status, edge)
+            acc = entries.get(key)
+            if acc is None:
+                acc = entries[key] = [0, 0, 0, 0]
+            acc[0] += 1
+            if bytes_i is not None and row[bytes_i].isdigit():
+                acc[1] += int(row[bytes_i])
+            if result_i is not None:
+                result = row[result_i]
+                if result == 'Error':
+                    acc[2] += 1
+                elif result in HIT_TYPES:
+                    acc[3] += 1
+        return RollupTable(entries)
+
+    def merge(self, other):
+        '''Add the entries of other table into self
+
+        @param {RollupTable} other
+        @return {RollupTable} self
+        '''
+        for key, values in other.entries.items():
+            acc = self.entries.get(key)
+            if acc is None:
+                self.entries[key] = list(values)
+            else:
+                for i, v in enumerate(values):
+                    acc[i] += v
+        return self
+
+    def group(self, by : list):
+        '''Aggregate entries over the given dimensions
+
+        Output rows contain the dimension values followed by the
+        metrics, and the derived error rate and cache-hit ratio
+
+        @param {list} by subset of `DIMENSIONS`
+        @return {list} sorted list of rows
+        '''
+        indices = [DIMENSIONS.index(d) for d in by]
+        groups = {}
+        for key, values in self.entries.items():
+            gkey = tuple(key[i] for i in indices)
+            acc = groups.get(gkey)
+            if acc is None:
+                groups[gkey] = list(values)
+            else:
+                for i, v in enumerate(values):
+                    acc[i] += v
+
+        ret = []
+        for gkey in sorted(groups):
+            requests, bytes_, errors, hits = groups[gkey]
+            error_rate = errors / requests if requests else 0.0
+            hit_ratio = hits / requests if requests else 0.0
+            ret.append(list(gkey) + [requests, bytes_, errors, hits,
+                                     error_rate, hit_ratio])
+        return ret
+
+    def dumps(self):
+        '''Serialize the table into gzipped tab-separated bytes
+
+        @return {bytes} sidecar content
+        '''
+        lines = ['#Fields: {}'.format(' '.join(DIMENSIONS + METRICS))]
+        for key in sorted(self.entries):
+            values = [str(v) for v in self.entries[key]]
+            lines.append('\t'.join(list(key) + values))
+        return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    @staticmethod
+    def loads(data : bytes):
+        '''Inverse of `dumps`
+
+        @param {bytes} data sidecar content
+        @return {RollupTable}
+        '''
+        entries = {}
+        lines = gzip.decompress(data).decode('utf-8').splitlines()
+        n = len(DIMENSIONS)
+        for line in lines[1:]:
+            split = line.split('\t')
+            entries[tuple(split[:n])] = [int(v) for v in split[n:]]
+        return RollupTable(entries)
+
+
+class RollupQuery():
+    '''Result of a rollup query
+
+    '''
+
+    def __init__(self, rows : list, group_by : list):
+        self.rows = rows
+        self.headers = list(group_by) + METRICS + ['error-rate', 'hit-ratio']
+
+    def display(self):
+        print(', '.join(self.headers))
+        for r in self.rows:
+            print(' | '.join(str(v) for v in r))
@@ -0,0 +1,297 @@
+import sys, math, json, gzip, base64, hashlib, operator
+from array import array
+
+
+# Default sketch dimensions. HLL error is ~1.04/sqrt(2^p), i.e. ~0.8%
+# for p=14; count-min over-estimates by at most e/width * N with
+# probability 1 - exp(-depth)
+HLL_PRECISION = 14
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+TOP_CAPACITY = 64
+
+SIDECAR_SUFFIX = '.sketch'
+
+
+def hash64(value : str):
+    '''Return a stable 64-bit hash of a string value
+
+    Python's builtin `hash` is salted per process, so it can not be
+    used for anything persisted to disk
+
+    @param {str} value value to hash
+    @return {int} unsigned 64-bit hash
+    '''
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _pack(arr : array):
+    if sys.byteorder == 'big':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def _unpack(typecode : str, data : str):
+    arr = array(typecode)
+    arr.frombytes(base64.b64decode(data))
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+class HyperLogLog():
+    '''Mergeable distinct-count estimator
+
+    '''
+
+    def __init__(self, precision : int = HLL_PRECISION):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add_hash(self, h : int):
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = 65 - self.p if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value : str):
+        self.add_hash(hash64(value))
+
+    def merge(self, other):
+        '''Merge other estimator into self
+
+        Both estimators must have the same precision
+
+        @param {HyperLogLog} other
+        @return {HyperLogLog} self
+        '''
+        if self.p != other.p:
+            raise ValueError('Mismatch between HLL precisions ({}, {})'
+                             .format(self.p, other.p))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        '''Return the estimated number of distinct values
+
+        @return {int} cardinality estimate
+        '''
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Small range correction: fall back to linear counting
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'p': self.p,
+                'registers': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @staticmethod
+    def from_dict(d : dict):
+        ret = HyperLogLog(d['p'])
+        ret.registers = bytearray(base64.b64decode(d['registers']))
+        return ret
+
+
+class CountMinSketch():
+    '''Mergeable frequency estimator with a bounded heavy-hitter list
+
+    Alongside the count-min table, keeps up to `capacity` candidate
+    values with the largest estimated counts (space-saving style), so
+    that top-k queries can be answered without the original data
+
+    '''
+
+    def __init__(self, width : int = CMS_WIDTH, depth : int = CMS_DEPTH,
+                 capacity : int = TOP_CAPACITY):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.table = array('Q', bytes(8 * width * depth))
+        self.total = 0
+        self.candidates = {}
+        # Lower bound on the smallest candidate count once full
+        self._floor = 0
+
+    def _cells(self, h : int):
+        # Kirsch-Mitzenmacher: derive `depth` hashes from two halves
+        h1 = h & 0xFFFFFFFF
+        h2 = h >> 32
+        w = self.width
+        return [i * w + (h1 + i * h2) % w for i in range(self.depth)]
+
+    def add(self, value : str, count : int = 1):
+        self.add_hash(value, hash64(value), count)
+
+    def add_hash(self, value : str, h : int, count : int = 1):
+        cells = self._cells(h)
+        table = self.table
+        for c in cells:
+            table[c] += count
+        self.total += count
+        self._offer(value, min(table[c] for c in cells))
+
+    def _offer(self, value : str, estimate : int):
+        cand = self.candidates
+        if value in cand or len(cand) < self.capacity:
+            cand[value] = estimate
+            return
+        if estimate <= self._floor:
+            return
+        smallest = min(cand, key=cand.get)
+        if estimate > cand[smallest]:
+            del cand[smallest]
+            cand[value] = estimate
+        self._floor = min(cand.values())
+
+    def estimate(self, value : str):
+        '''Return the (over-)estimated number of occurrences of value
+
+        @param {str} value
+        @return {int} estimated count
+        '''
+        table = self.table
+        return min(table[c] for c in self._cells(hash64(value)))
+
+    def merge(self, other):
+        '''Merge other sketch into self
+
+        Both sketches must have the same dimensions
+
+        @param {CountMinSketch} other
+        @return {CountMinSketch} self
+        '''
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Mismatch between count-min dimensions')
+        self.table = array('Q', map(operator.add, self.table, other.table))
+        self.total += other.total
+
+        # Re-rank the union of the candidates against merged counts
+        values = set(self.candidates) | set(other.candidates)
+        ranked = sorted(((self.estimate(v), v) for v in values), reverse=True)
+        self.candidates = {v: n for n, v in ranked[:self.capacity]}
+        self._floor = 0
+        return self
+
+    def top_k(self, k : int):
+        '''Return the k most frequent values with estimated counts
+
+        @param {int} k number of values to return
+        @return {list} list of (value, count) tuples, most frequent first
+        '''
+        ranked = sorted(((self.estimate(v), v) for v in self.candidates),
+                        key=lambda x: (-x[0], x[1]))
+        return [(v, n) for n, v in ranked[:k]]
+
+    def to_dict(self):
+        return {'width': self.width,
+                'depth': self.depth,
+                'capacity': self.capacity,
+                'total': self.total,
+                'table': _pack(self.table),
+                'candidates': self.candidates}
+
+    @staticmethod
+    def from_dict(d : dict):
+        ret = CountMinSketch(d['width'], d['depth'], d['capacity'])
+        ret.table = _unpack('Q', d['table'])
+        ret.total = d['total']
+        ret.candidates = dict(d['candidates'])
+        return ret
+
+
+class ColumnSketch():
+    '''Distinct-count and heavy-hitter sketches for one column
+
+    '''
+
+    def __init__(self, hll : HyperLogLog = None, cms : CountMinSketch = None):
+        self.hll = HyperLogLog() if hll is None else hll
+        self.cms = CountMinSketch() if cms is None else cms
+
+    def add(self, value : str):
+        h = hash64(value)
+        self.hll.add_hash(h)
+        self.cms.add_hash(value, h)
+
+    def merge(self, other):
+        self.hll.merge(other.hll)
+        self.cms.merge(other.cms)
+        return self
+
+    def to_dict(self):
+        return {'hll': self.hll.to_dict(), 'cms': self.cms.to_dict()}
+
+    @staticmethod
+    def from_dict(d : dict):
+        return ColumnSketch(HyperLogLog.from_dict(d['hll']),
+                            CountMinSketch.from_dict(d['cms']))
+
+
+def build_sketches(log, columns : list, rows : list = None):
+    '''Compute column sketches over the rows of an access log
+
+    Columns missing from the log headers are skipped
+
+    @param {AccessLog} log source access log
+    @param {list} columns column names to sketch
+    @param {list} rows subset of rows to use. Defaults to all rows
+    @return {dict} column name to ColumnSketch map
+    '''
+    if rows is None:
+        rows = log.rows
+
+    ret = {}
+    for col in columns:
+        if col not in log.column_map:
+            continue
+        index = log.column_map[col]
+        sketch = ColumnSketch()
+        for row in rows:
+            sketch.add(row[index])
+        ret[col] = sketch
+    return ret
+
+
+def merge_sketches(target : dict, other : dict):
+    '''Merge column sketch map `other` into `target`
+
+    @param {dict} target column name to ColumnSketch map, modified
+    @param {dict} other column name to ColumnSketch map
+    @return {dict} target
+    '''
+    for col, sketch in other.items():
+        if col in target:
+            target[col].merge(sketch)
+        else:
+            target[col] = sketch
+    return target
+
+
+def dumps(sketches : dict):
+    '''Serialize column sketches into gzipped json bytes
+
+    @param {dict} sketches column name to ColumnSketch map
+    @return {bytes} sidecar content
+    '''
+    doc = {'version': 1,
+           'columns': {c: s.to_dict() for c, s in sketches.items()}}
+    return gzip.compress(json.dumps(doc).encode('utf-8'))
+
+
+def loads(data : bytes):
+    '''Inverse of `dumps`
+
+    @param {bytes} data sidecar content
+    @return {dict} column name to ColumnSketch map
+    '''
+    doc = json.loads(gzip.decompress(data).decode('utf-8'))
+    return {c: ColumnSketch.from_dict(d) for c, d in doc['columns'].items()}
@@ -5,11 +5,18 @@ from . import cf_datastores3 as DS3
 from . import cf_archiver as archiver
 from .cf_datastorelocal import DataStoreLocal
 from .cf_datastores3 import DataStoreS3
+from .cf_partition import PartitionScheme
+from .cf_follow import Follower
+from . import cf_metrics as MT
+from .cf_metrics import Metrics
+from . import cf_profile as PF
 
 
 def s3_to_local(bucket : str, db_path : str = '',
                 delete_source : bool = False,
-                bucket_prefix : str = '', profile : str = None):
+                bucket_prefix : str = '', profile : str = None,
+                partitioning : PartitionScheme = None,
+                metrics : Metrics = None):
     '''Fetch and archive CF log data from S3 to local drive
 
     Deletes associates files on S3.
@@ -18,6 +25,8 @@ def s3_to_local(bucket : str, db_path : str = '',
     @param {str} bucket_prefix S3 content prefix
     @param {str} delete_source delete files from bucket after processing
     @param {str} profile_name AWS named profile name to use (~/.aws/credentials)
+    @param {PartitionScheme} partitioning local key layout, daily by default
+    @param {Metrics} metrics sink of listing, I/O and stage timings
     '''
 
     # Path of current script file
@@ -28,7 +37,8 @@ def s3_to_local(bucket : str, db_path : str = '',
     # Get list of unprocessed cloudfront accesslogs from bucket
     # These keys are different than the ones DataStoreS3 creates, but
     # they are interchangable for following use-case
-    keys = DS3.list_cf_logkeys(session.client('s3'), bucket, bucket_prefix)
+    keys = DS3.list_cf_logkeys(session.client('s3'), bucket, bucket_prefix,
+                               metrics or MT.NULL)
 
     if len(keys) == 0:
         print('Nothing to do')
@@ -36,12 +46,51 @@ def s3_to_local(bucket : str, db_path : str = '',
 
     # S3 access log data store
     in_store = DataStoreS3(bucket, session)
-    # Location on local drive to store the data -- TODO
-    out_store = DataStoreLocal(os.path.join(__dirname, '../db'))
+    # Location on local drive to store the data
+    out_store = DataStoreLocal(db_path or os.path.join(__dirname, '../db'),
+                               partitioning)
+    if metrics is not None:
+        in_store.enable_metrics(metrics)
+        out_store.enable_metrics(metrics)
 
     archiver.archive(keys, in_store, out_store, delete_source)
 
 
+def follow_s3_to_local(bucket : str, db_path : str = '',
+                       delete_source : bool = False,
+                       bucket_prefix : str = '', profile : str = None,
+                       partitioning : PartitionScheme = None,
+                       poll_interval : float = 10, max_wait : float = 60,
+                       max_bytes : int = 64 * 1024 ** 2,
+                       metrics : Metrics = None):
+    '''Continuously archive CF log data from S3 to local drive
+
+    Runs until interrupted
+
+    @sa Follower
+    @param {str} bucket AWS S3 bucket name
+    @param {str} bucket_prefix S3 content prefix
+    @param {str} delete_source delete files from bucket after processing
+    @param {str} profile_name AWS named profile name to use (~/.aws/credentials)
+    @param {PartitionScheme} partitioning local key layout, daily by default
+    @param {float} poll_interval seconds between listings of the bucket
+    @param {float} max_wait seconds before new files are archived
+    @param {int} max_bytes size of new files that triggers archiving
+    @param {Metrics} metrics sink of listing, I/O and stage timings
+    '''
+    __dirname = os.path.dirname(os.path.realpath(__file__))
+    session = boto3.Session(profile_name=profile)
+    in_store = DataStoreS3(bucket, session)
+    out_store = DataStoreLocal(db_path or os.path.join(__dirname, '../db'),
+                               partitioning)
+    if metrics is not None:
+        in_store.enable_metrics(metrics)
+        out_store.enable_metrics(metrics)
+    follower = Follower(session.client('s3'), bucket, out_store, bucket_prefix,
+                        in_store, delete_source, max_wait, max_bytes)
+    follower.run(poll_interval)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Archive CF logs to local drive')
 
@@ -64,9 +113,55 @@ if __name__ == '__main__':
     optional.add_argument('--delete-source', default=False,
                           action='store_true',
                           help='Delete files from S3 once processed')
+    optional.add_argument('--hourly', default=False, action='store_true',
+                          help='Store one file per hour instead of per day')
+    optional.add_argument('--by-distribution', default=False,
+                          action='store_true',
+                          help='Store each distribution ID separately')
+    optional.add_argument('--follow', default=False, action='store_true',
+                          help='Keep running, archiving new files in batches')
+    optional.add_argument('--poll-seconds', type=float, default=10,
+                          help='Seconds between listings with --follow')
+    optional.add_argument('--batch-seconds', type=float, default=60,
+                          help='Maximum age of a batch with --follow')
+    optional.add_argument('--batch-mb', type=float, default=64,
+                          help='Maximum size of a batch with --follow')
+    optional.add_argument('--metrics', type=str, default=None,
+                          help='Write metrics to this file on exit, in the '
+                          'Prometheus text format if ending with .prom, '
+                          'as JSON otherwise')
+    optional.add_argument('--profile-out', type=str, default=None,
+                          help='Profile parsing, sorting, merging and I/O, '
+                          'writing flamegraph stacks to this directory')
+    optional.add_argument('--profile-mode', choices=PF.MODES, default='sample',
+                          help='Sample stacks, or run cProfile')
+    optional.add_argument('--profile-allocations', type=int, default=0,
+                          help='Report this many allocation sites per stage')
     args = parser.parse_args()
     db_path = os.path.join(os.getcwd(), args.dbpath)
 
-    s3_to_local(args.bucket, db_path,
-                args.delete_source, args.bucket_prefix,
-                args.profile)
+    partitioning = PartitionScheme(args.hourly, args.by_distribution)
+    metrics = None if args.metrics is None else Metrics()
+    profiler = None
+    if args.profile_out is not None:
+        profiler = PF.Profiler(args.profile_out, args.profile_mode,
+                               allocations=args.profile_allocations)
+        # The profiler records the metrics too
+        metrics = profiler.install().start()
+    try:
+        if args.follow:
+            follow_s3_to_local(args.bucket, db_path,
+                               args.delete_source, args.bucket_prefix,
+                               args.profile, partitioning,
+                               args.poll_seconds, args.batch_seconds,
+                               int(args.batch_mb * 1024 ** 2), metrics)
+        else:
+            s3_to_local(args.bucket, db_path,
+                        args.delete_source, args.bucket_prefix,
+                        args.profile, partitioning, metrics)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_profiles()
+        if args.metrics is not None:
+            metrics.write(args.metrics)
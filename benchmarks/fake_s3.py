@@ -0,0 +1,211 @@
+import io, time, random, hashlib, threading
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+
+def client_error(operation : str, code : str, status : int, message : str = ''):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status}},
+                       operation)
+
+
+class FakeS3():
+    '''In-process stand-in for a boto3 S3 client
+
+    Implements the calls used by the stores: list_objects_v2, head_object,
+    get_object (with Range and conditional reads), put_object (with
+    conditional writes and user metadata), delete_objects, and multipart uploads. Every
+    request sleeps for `latency` seconds plus its transfer time at
+    `bandwidth`, outside of any lock, so that concurrent requests
+    overlap as they would against S3
+
+    Requests are throttled with `SlowDown` errors at `throttle_rate`.
+    Like botocore's standard retry mode, throttled requests are retried
+    internally with exponential backoff, up to `max_attempts`
+
+    Buckets are created on first use
+
+    '''
+
+    def __init__(self, latency : float = 0.02, bandwidth : float = 100e6,
+                 throttle_rate : float = 0, max_attempts : int = 3,
+                 page_size : int = 1000, seed : int = 0):
+        '''
+        @param {float} latency seconds added to every request
+        @param {float} bandwidth bytes per second of transfers
+        @param {float} throttle_rate fraction of throttled requests
+        @param {int} max_attempts attempts per request, including retries
+        @param {int} page_size maximum keys per listing page
+        @param {int} seed seed of the throttling decisions
+        '''
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.page_size = page_size
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.uploads = {}
+        self.stats = {'requests': 0, 'throttled': 0,
+                      'bytes_in': 0, 'bytes_out': 0}
+
+    def _request(self, operation : str, size : int = 0):
+        # Account and wait for a request, raising if throttled throughout
+        for attempt in range(self.max_attempts):
+            with self.lock:
+                self.stats['requests'] += 1
+                throttled = self.rng.random() < self.throttle_rate
+                if throttled:
+                    self.stats['throttled'] += 1
+                backoff = min(20, 0.05 * 2 ** attempt) * self.rng.random()
+            time.sleep(self.latency)
+            if not throttled:
+                time.sleep(size / self.bandwidth)
+                return
+            time.sleep(backoff)
+        raise client_error(operation, 'SlowDown', 503, 'Please reduce your request rate')
+
+    def _bucket(self, name : str):
+        return self.buckets.setdefault(name, {})
+
+    def list_objects_v2(self, Bucket : str, Prefix : str = '', StartAfter : str = '',
+                        ContinuationToken : str = None, MaxKeys : int = 1000):
+        self._request('ListObjectsV2')
+        with self.lock:
+            keys = sorted(k for k in self._bucket(Bucket)
+                          if k.startswith(Prefix) and k > (ContinuationToken or StartAfter))
+            page = keys[:min(MaxKeys, self.page_size)]
+            contents = [{'Key': k, 'Size': len(self.buckets[Bucket][k][0]),
+                         'ETag': self.buckets[Bucket][k][1]} for k in page]
+        ret = {'KeyCount': len(page), 'IsTruncated': len(keys) > len(page)}
+        if contents:
+            ret['Contents'] = contents
+        if ret['IsTruncated']:
+            ret['NextContinuationToken'] = page[-1]
+        return ret
+
+    def get_object(self, Bucket : str, Key : str, Range : str = None,
+                   IfNoneMatch : str = None, IfMatch : str = None):
+        with self.lock:
+            obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            self._request('GetObject')
+            raise client_error('GetObject', 'NoSuchKey', 404, Key)
+        data, etag, metadata = obj
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            self._request('GetObject')
+            raise client_error('GetObject', '304', 304, 'Not Modified')
+        if IfMatch is not None and IfMatch != etag:
+            self._request('GetObject')
+            raise client_error('GetObject', 'PreconditionFailed', 412)
+        if Range is not None:
+            data = data[self._slice(Range, len(data))]
+        self._request('GetObject', len(data))
+        with self.lock:
+            self.stats['bytes_out'] += len(data)
+        return {'Body': StreamingBody(io.BytesIO(data), len(data)),
+                'ContentLength': len(data), 'ETag': etag, 'Metadata': dict(metadata)}
+
+    def head_object(self, Bucket : str, Key : str):
+        self._request('HeadObject')
+        with self.lock:
+            obj = self._bucket(Bucket).get(Key)
+        if obj is None:
+            raise client_error('HeadObject', '404', 404, 'Not Found')
+        return {'ContentLength': len(obj[0]), 'ETag': obj[1], 'Metadata': dict(obj[2])}
+
+    @staticmethod
+    def _slice(byte_range : str, size : int):
+        # bytes=a-b, bytes=a- or bytes=-n
+        start, end = byte_range[len('bytes='):].split('-')
+        if start == '':
+            return slice(max(0, size - int(end)), size)
+        return slice(int(start), size if end == '' else int(end) + 1)
+
+    def put_object(self, Bucket : str, Key : str, Body : bytes = b'',
+                   IfNoneMatch : str = None, IfMatch : str = None,
+                   Metadata : dict = None, **kwargs):
+        if not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        self._request('PutObject', len(Body))
+        etag = '"{}"'.format(hashlib.md5(Body).hexdigest())
+        with self.lock:
+            self.stats['bytes_in'] += len(Body)
+            bucket = self._bucket(Bucket)
+            current = bucket.get(Key)
+            if IfNoneMatch == '*' and current is not None:
+                raise client_error('PutObject', 'PreconditionFailed', 412)
+            if IfMatch is not None and (current is None or current[1] != IfMatch):
+                raise client_error('PutObject', 'PreconditionFailed', 412)
+            bucket[Key] = (bytes(Body), etag, dict(Metadata or {}))
+        return {'ETag': etag}
+
+    def delete_objects(self, Bucket : str, Delete : dict):
+        self._request('DeleteObjects')
+        deleted = []
+        with self.lock:
+            bucket = self._bucket(Bucket)
+            for obj in Delete['Objects']:
+                bucket.pop(obj['Key'], None)
+                deleted.append({'Key': obj['Key']})
+        return {'Deleted': deleted}
+
+    def create_multipart_upload(self, Bucket : str, Key : str, **kwargs):
+        self._request('CreateMultipartUpload')
+        with self.lock:
+            upload_id = '{:016x}'.format(self.rng.getrandbits(64))
+            self.uploads[upload_id] = (Bucket, Key, {})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket : str, Key : str, UploadId : str,
+                    PartNumber : int, Body : bytes):
+        if not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        self._request('UploadPart', len(Body))
+        etag = '"{}"'.format(hashlib.md5(Body).hexdigest())
+        with self.lock:
+            if UploadId not in self.uploads:
+                raise client_error('UploadPart', 'NoSuchUpload', 404, UploadId)
+            self.stats['bytes_in'] += len(Body)
+            self.uploads[UploadId][2][PartNumber] = (bytes(Body), etag)
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket : str, Key : str, UploadId : str,
+                                  MultipartUpload : dict):
+        self._request('CompleteMultipartUpload')
+        with self.lock:
+            upload = self.uploads.pop(UploadId, None)
+            if upload is None:
+                raise client_error('CompleteMultipartUpload', 'NoSuchUpload', 404)
+            parts = upload[2]
+            data = b''
+            for part in MultipartUpload['Parts']:
+                body, etag = parts[part['PartNumber']]
+                if part['ETag'] != etag:
+                    raise client_error('CompleteMultipartUpload', 'InvalidPart', 400)
+                data += body
+            etag = '"{}-{}"'.format(hashlib.md5(data).hexdigest(),
+                                    len(MultipartUpload['Parts']))
+            self._bucket(Bucket)[Key] = (data, etag, {})
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket : str, Key : str, UploadId : str):
+        self._request('AbortMultipartUpload')
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeSession():
+    '''Stand-in for boto3.Session returning a shared FakeS3 client
+
+    '''
+
+    def __init__(self, s3 : FakeS3):
+        self.s3 = s3
+
+    def client(self, service : str, **kwargs):
+        if service != 's3':
+            raise ValueError('Only s3 is faked')
+        return self.s3
@@ -0,0 +1,184 @@
+import io, gzip, random, bisect, string
+from datetime import datetime, timedelta
+from awslogparse.cf_accesslog import AccessLog
+
+
+# Fields of CloudFront standard logs, version 1.0
+HEADERS = ['date', 'time', 'x-edge-location', 'sc-bytes', 'c-ip',
+           'cs-method', 'cs(Host)', 'cs-uri-stem', 'sc-status',
+           'cs(Referer)', 'cs(User-Agent)', 'cs-uri-query', 'cs(Cookie)',
+           'x-edge-result-type', 'x-edge-request-id', 'x-host-header',
+           'cs-protocol', 'cs-bytes', 'time-taken', 'x-forwarded-for',
+           'ssl-protocol', 'ssl-cipher', 'x-edge-response-result-type',
+           'cs-protocol-version', 'fle-status', 'fle-encrypted-fields',
+           'c-port', 'time-to-first-byte', 'x-edge-detailed-result-type',
+           'sc-content-type', 'sc-content-len', 'sc-range-start',
+           'sc-range-end']
+
+EDGE_LOCATIONS = ['IAD89-C1', 'IAD89-C2', 'FRA56-P1', 'LHR62-C2',
+                  'NRT57-C3', 'SFO53-C1', 'GRU3-C1', 'SIN2-P2']
+USER_AGENTS = ['Mozilla/5.0%20(Windows%20NT%2010.0;%20Win64;%20x64)',
+               'Mozilla/5.0%20(Macintosh;%20Intel%20Mac%20OS%20X%2010_15_7)',
+               'Mozilla/5.0%20(iPhone;%20CPU%20iPhone%20OS%2016_0)',
+               'curl/7.68.0', 'Googlebot/2.1', 'python-requests/2.25.1']
+CONTENT_TYPES = ['text/html', 'application/javascript', 'text/css',
+                 'image/png', 'image/jpeg', 'application/json']
+# (status, result type, weight)
+STATUSES = [('200', 'Hit', 60), ('200', 'Miss', 20), ('304', 'RefreshHit', 8),
+            ('404', 'Error', 6), ('403', 'Error', 2), ('301', 'Redirect', 2),
+            ('500', 'Error', 1), ('503', 'Error', 1)]
+
+
+class Zipf():
+    '''Sampler of ranks 0..n-1 with probability proportional to 1/(rank+1)^s
+
+    '''
+
+    def __init__(self, n : int, s : float = 1.1):
+        total = 0
+        self.cum = []
+        for i in range(n):
+            total += 1 / (i + 1) ** s
+            self.cum.append(total)
+
+    def sample(self, rng : random.Random):
+        return bisect.bisect_left(self.cum, rng.random() * self.cum[-1])
+
+
+class LogGenerator():
+    '''Deterministic generator of realistic CloudFront access logs
+
+    Client IPs and URIs follow Zipf distributions, so a few of them
+    account for most requests. Records are emitted in time order,
+    except for a fraction swapped with a nearby record, and a fraction
+    repeated, as CloudFront may deliver a record more than once
+
+    '''
+
+    def __init__(self, seed : int = 0, ips : int = 10000, uris : int = 2000,
+                 skew : float = 1.1, out_of_order : float = 0.01,
+                 duplicates : float = 0.001, host : str = 'd111111abcdef8.cloudfront.net'):
+        '''
+        @param {int} seed random seed; equal seeds produce equal logs
+        @param {int} ips number of distinct client IPs
+        @param {int} uris number of distinct URIs
+        @param {float} skew Zipf exponent of IP and URI popularity
+        @param {float} out_of_order fraction of records out of order
+        @param {float} duplicates fraction of duplicated records
+        @param {str} host distribution domain name
+        '''
+        self.rng = random.Random(seed)
+        self.out_of_order = out_of_order
+        self.duplicates = duplicates
+        self.host = host
+        self.ip_rank = Zipf(ips, skew)
+        self.uri_rank = Zipf(uris, skew)
+        # Fixed random maps from rank to value
+        self.ips = ['{}.{}.{}.{}'.format(self.rng.randint(1, 223), self.rng.randint(0, 255),
+                                         self.rng.randint(0, 255), self.rng.randint(1, 254))
+                    for i in range(ips)]
+        self.uris = ['/{}/{}.{}'.format(self.rng.choice(['static', 'api', 'img', 'blog']),
+                                        ''.join(self.rng.choices(string.ascii_lowercase, k=8)),
+                                        self.rng.choice(['html', 'js', 'css', 'png', 'json']))
+                     for i in range(uris)]
+        self.status_cum = []
+        total = 0
+        for status in STATUSES:
+            total += status[2]
+            self.status_cum.append(total)
+
+    def request_id(self):
+        chars = string.ascii_letters + string.digits
+        return ''.join(self.rng.choices(chars, k=52)) + '=='
+
+    def row(self, t : datetime):
+        '''Return a random record at time `t`
+
+        @param {datetime} t record time
+        @return {list} record of 33 fields
+        '''
+        rng = self.rng
+        status, result, _ = STATUSES[bisect.bisect_left(self.status_cum,
+                                                        rng.random() * self.status_cum[-1])]
+        size = str(int(rng.lognormvariate(8, 1.5)))
+        taken = '{:.3f}'.format(rng.expovariate(20))
+        return [t.strftime('%Y-%m-%d'), t.strftime('%H:%M:%S'),
+                rng.choice(EDGE_LOCATIONS), size,
+                self.ips[self.ip_rank.sample(rng)],
+                'GET' if rng.random() < 0.95 else 'POST', self.host,
+                self.uris[self.uri_rank.sample(rng)], status, '-',
+                rng.choice(USER_AGENTS), '-', '-', result,
+                self.request_id(), 'www.example.com', 'https',
+                str(rng.randint(100, 900)), taken, '-', 'TLSv1.3',
+                'TLS_AES_128_GCM_SHA256', result, 'HTTP/2.0', '-', '-',
+                str(rng.randint(1024, 65535)), taken, result,
+                rng.choice(CONTENT_TYPES), size, '-', '-']
+
+    def rows(self, n : int, start : datetime = datetime(2019, 1, 1),
+             duration : timedelta = timedelta(days=1)):
+        '''Return `n` records spread evenly over [start, start + duration)
+
+        @param {int} n number of records, before duplication
+        @param {datetime} start time of the first record
+        @param {timedelta} duration time spanned by the records
+        @return {list} list of records
+        '''
+        step = duration / max(n, 1)
+        ret = [self.row(start + i * step) for i in range(n)]
+        for i in range(n - 1):
+            if self.rng.random() < self.out_of_order:
+                j = min(n - 1, i + self.rng.randint(1, 10))
+                ret[i], ret[j] = ret[j], ret[i]
+        for i in range(n):
+            if self.rng.random() < self.duplicates:
+                ret.insert(min(len(ret), i + self.rng.randint(1, 100)), ret[i])
+        return ret
+
+    def access_log(self, n : int, start : datetime = datetime(2019, 1, 1),
+                   duration : timedelta = timedelta(days=1)):
+        '''Return an AccessLog of `n` generated records
+
+        @sa rows
+        @return {AccessLog} unsorted access log
+        '''
+        return AccessLog('1.0', list(HEADERS), self.rows(n, start, duration))
+
+
+def dumps(log : AccessLog, compress : bool = True):
+    '''Serialize a log as CloudFront delivers it, without sorting
+
+    @param {AccessLog} log
+    @param {bool} compress gzip the content
+    @return {bytes} file content
+    '''
+    fd = io.BytesIO()
+    log.dump(fd, sort_data=False)
+    if not compress:
+        return fd.getvalue()
+    return gzip.compress(fd.getvalue(), 6)
+
+
+def delivery_files(generator : LogGenerator, n : int, hours : int = 24,
+                   files_per_hour : int = 4, distribution : str = 'E2ABCDEF123456',
+                   start : datetime = datetime(2019, 1, 1)):
+    '''Return generated logs split into CloudFront-style delivery files
+
+    @param {LogGenerator} generator
+    @param {int} n total number of records
+    @param {int} hours number of delivery hours
+    @param {int} files_per_hour files delivered per hour
+    @param {str} distribution distribution ID used in key names
+    @param {datetime} start first delivery hour
+    @return {dict} key, e.g. E2ABCDEF123456.2019-01-01-00.0a1b2c3d.gz,
+            to gzipped file content map
+    '''
+    ret = {}
+    per_file = max(1, n // (hours * files_per_hour))
+    for h in range(hours):
+        t = start + timedelta(hours=h)
+        for f in range(files_per_hour):
+            log = generator.access_log(per_file, t, timedelta(hours=1))
+            key = '{}.{}.{:08x}.gz'.format(distribution, t.strftime('%Y-%m-%d-%H'),
+                                          generator.rng.getrandbits(32))
+            ret[key] = dumps(log)
+    return ret
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+#
+# Throughput benchmarks of parsing, sorting, querying and storing logs
+#
+# Usage
+#  python3 -m benchmarks.run --scales 10000 100000 --json out.json
+#  python3 -m benchmarks.run --compare out.json
+#
+
+import io, os, sys, gzip, json, time, argparse, platform, resource, tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from awslogparse import cf_archiver as archiver
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastore import DataStoreBase
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_rawlog import RawLog
+from awslogparse import cf_parallel as PL
+from . import generator as G
+
+
+DEFAULT_SCALES = [10000, 100000]
+
+
+class MemoryStore(DataStoreBase):
+    '''Read-only store of gzipped log files held in memory
+
+    '''
+
+    def __init__(self, files : dict):
+        self.files = files
+
+    def access_log(self, key : str):
+        data = self.files.get(key)
+        return None if data is None else AccessLog.loads(data)
+
+    def item_key(self, row : list, distribution : str = None):
+        return row[0]
+
+    def overwrite(self, key : str, log : AccessLog):
+        raise NotImplementedError('Read-only store')
+
+    def delete(self, key : str):
+        return False
+
+
+def _gunzip_size(files):
+    return sum(len(gzip.decompress(data)) for data in files.values())
+
+
+# Each case takes (scale, seed) and returns (run, rows, bytes), where
+# run() is the timed operation, and rows/bytes the processed volume
+
+def case_load(n, seed):
+    data = G.dumps(G.LogGenerator(seed).access_log(n))
+    size = len(gzip.decompress(data))
+    return (lambda: AccessLog.loads(data)), n, size
+
+
+def case_sort(n, seed):
+    log = G.LogGenerator(seed, out_of_order=0.05).access_log(n)
+    size = len(G.dumps(log, compress=False))
+    return log.sort, n, size
+
+
+def case_dedup(n, seed):
+    log = G.LogGenerator(seed, duplicates=0.01).access_log(n).sort()
+    size = len(G.dumps(log, compress=False))
+    return log.remove_duplicates, log.record_count(), size
+
+
+def case_select(n, seed):
+    log = G.LogGenerator(seed).access_log(n).sort()
+    size = len(G.dumps(log, compress=False))
+    run = lambda: log.select(['date', 'time', 'c-ip', 'cs-uri-stem'],
+                             {'sc-status': '^5', 'cs-method': 'GET'})
+    return run, n, size
+
+
+def case_select_raw(n, seed):
+    # Parse and select from the gzipped file, as `select_key` does
+    data = G.dumps(G.LogGenerator(seed).access_log(n).sort())
+    size = len(gzip.decompress(data))
+    run = lambda: RawLog.loads(data).select(['date', 'time', 'c-ip', 'cs-uri-stem'],
+                                            {'sc-status': '^5', 'cs-method': 'GET'})
+    return run, n, size
+
+
+def case_select_parallel(n, seed):
+    # Same as select_raw, with chunks filtered on every core
+    data = G.dumps(G.LogGenerator(seed).access_log(n).sort())
+    size = len(gzip.decompress(data))
+    workers = os.cpu_count() or 1
+    chunk_bytes = max(size // (4 * workers), 64 * 1024)
+    run = lambda: PL.selects(data, ['date', 'time', 'c-ip', 'cs-uri-stem'],
+                             {'sc-status': '^5', 'cs-method': 'GET'},
+                             workers, chunk_bytes)
+    return run, n, size
+
+
+def case_dump(n, seed):
+    log = G.LogGenerator(seed).access_log(n).sort()
+    size = len(G.dumps(log, compress=False))
+    def run():
+        fd = gzip.GzipFile(fileobj=io.BytesIO(), mode='wb')
+        log.dump(fd, sort_data=False)
+        fd.close()
+    return run, n, size
+
+
+def case_archive(n, seed):
+    files = G.delivery_files(G.LogGenerator(seed), n)
+    keys = sorted(files)
+    in_store = MemoryStore(files)
+    def run():
+        with tempfile.TemporaryDirectory() as db_dir, \
+             open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                archiver.archive(keys, in_store, DataStoreLocal(db_dir))
+            finally:
+                sys.stdout = stdout
+    return run, n, _gunzip_size(files)
+
+
+def case_store(n, seed):
+    gen = G.LogGenerator(seed)
+    log = gen.access_log(n, duration=timedelta(days=7))
+    size = len(G.dumps(log, compress=False))
+    def run():
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir)
+            # Second half merges with the days written by the first
+            rows = sorted(log.rows, key=lambda r: (r[0], r[1]))
+            store.store(AccessLog(log.version, log.headers, rows[:n // 2]))
+            store.store(AccessLog(log.version, log.headers, rows[n // 2:]))
+    return run, n, size
+
+
+CASES = {
+    'load': case_load,
+    'sort': case_sort,
+    'dedup': case_dedup,
+    'select': case_select,
+    'select_raw': case_select_raw,
+    'select_parallel': case_select_parallel,
+    'dump': case_dump,
+    'archive': case_archive,
+    'store': case_store,
+}
+
+
+def run_case(name : str, scale : int, seed : int, repeat : int):
+    '''Run a benchmark case in the current process
+
+    `main` runs every case in a fresh process, so that the reported
+    peak RSS is the case's own
+
+    @param {str} name key of `CASES`
+    @param {int} scale number of records
+    @param {int} seed generator seed
+    @param {int} repeat number of timed runs; the fastest is reported
+    @return {dict} result
+    '''
+    best = None
+    for i in range(repeat):
+        # Setup is repeated since some operations modify their input
+        run, rows, size = CASES[name](scale, seed)
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'case': name,
+        'scale': scale,
+        'rows': rows,
+        'bytes': size,
+        'seconds': best,
+        'rows_per_s': rows / best,
+        'mb_per_s': size / best / 1e6,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def metadata():
+    return {
+        'time': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def display(results, baseline : dict = None):
+    '''Print results as a table, with the speedup over a baseline
+
+    @param {list} results results of `run_case`
+    @param {dict} baseline (case, scale) to result map, if any
+    @return None
+    '''
+    print('{:<15} {:>9} {:>10} {:>12} {:>9} {:>9} {:>8}'.format(
+        'case', 'scale', 'seconds', 'rows/s', 'MB/s', 'RSS MB', 'vs base'))
+    for r in results:
+        ratio = ''
+        base = (baseline or {}).get((r['case'], r['scale']))
+        if base is not None:
+            ratio = '{:.2f}x'.format(r['rows_per_s'] / base['rows_per_s'])
+        print('{:<15} {:>9} {:>10.4f} {:>12.0f} {:>9.2f} {:>9.1f} {:>8}'.format(
+            r['case'], r['scale'], r['seconds'], r['rows_per_s'], r['mb_per_s'],
+            r['peak_rss_mb'], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run throughput benchmarks')
+    parser.add_argument('--cases', nargs='+', default=list(CASES),
+                        choices=list(CASES), help='Cases to run')
+    parser.add_argument('--scales', nargs='+', type=int, default=DEFAULT_SCALES,
+                        help='Numbers of records')
+    parser.add_argument('--seed', type=int, default=0, help='Generator seed')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timed runs per case; the fastest is reported')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write results to this file as JSON')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON results of a baseline run')
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for scale in args.scales:
+        for name in args.cases:
+            # Not a multiprocessing.Pool, whose daemonic workers cannot
+            # start the processes of parallel cases
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                results.append(pool.submit(run_case, name, scale, args.seed,
+                                           args.repeat).result())
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            baseline = {(r['case'], r['scale']): r for r in json.load(fd)['results']}
+    display(results, baseline)
+
+    if args.json is not None:
+        with open(args.json, 'w') as fd:
+            json.dump({'meta': metadata(), 'results': results}, fd, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+# End-to-end benchmarks of archiving and querying against a simulated
+# S3, with per-request latency, bandwidth and throttling
+#
+# Usage
+#  python3 -m benchmarks.s3 --scale 20000 --latency 0.03 --throttle 0.01
+#  python3 -m benchmarks.s3 --cases store --workers 1 8
+#
+
+import os, json, time, argparse, tempfile, contextlib
+from datetime import timedelta
+from unittest import mock
+from awslogparse import cf_archiver as archiver
+from awslogparse import s3_to_local as S2L
+from awslogparse.cf_datastores3 import DataStoreS3
+from . import generator as G
+from .fake_s3 import FakeS3, FakeSession
+from .run import metadata
+
+
+SOURCE = 'cf-logs'
+ARCHIVE = 'cf-archive'
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def _unthrottled(s3 : FakeS3):
+    # Setup runs at full speed, and is left out of the statistics
+    latency, bandwidth, throttle = s3.latency, s3.bandwidth, s3.throttle_rate
+    s3.latency, s3.bandwidth, s3.throttle_rate = 0, float('inf'), 0
+    try:
+        yield
+    finally:
+        s3.latency, s3.bandwidth, s3.throttle_rate = latency, bandwidth, throttle
+
+
+def _fill_source(s3 : FakeS3, n : int, seed : int):
+    files = G.delivery_files(G.LogGenerator(seed), n)
+    with _unthrottled(s3):
+        for key, data in files.items():
+            s3.put_object(Bucket=SOURCE, Key=key, Body=data)
+    return sorted(files)
+
+
+# Each case takes (s3, scale, seed, workers) and returns run(), the
+# timed operation. Setup requests are made without latency
+
+def case_archive(s3, n, seed, workers):
+    keys = _fill_source(s3, n, seed)
+    session = FakeSession(s3)
+    def run():
+        with _quiet():
+            archiver.archive(keys, DataStoreS3(SOURCE, session),
+                             DataStoreS3(ARCHIVE, session))
+    return run
+
+
+def case_s3_to_local(s3, n, seed, workers):
+    _fill_source(s3, n, seed)
+    def run():
+        with tempfile.TemporaryDirectory() as db_dir, _quiet(), \
+             mock.patch.object(S2L.boto3, 'Session', return_value=FakeSession(s3)):
+            S2L.s3_to_local(SOURCE, db_dir)
+    return run
+
+
+def case_query(s3, n, seed, workers):
+    keys = _fill_source(s3, n, seed)
+    session = FakeSession(s3)
+    store = DataStoreS3(ARCHIVE, session)
+    with _unthrottled(s3), _quiet():
+        archiver.archive(keys, DataStoreS3(SOURCE, session), store)
+    def run():
+        store.select(['date', 'time', 'c-ip', 'cs-uri-stem']) \
+             .where({'sc-status': '^5'}) \
+             .daterange(['2019-01-01', '2019-01-07']) \
+             .execute()
+    return run
+
+
+def case_store(s3, n, seed, workers):
+    log = G.LogGenerator(seed).access_log(n, duration=timedelta(days=7))
+    store = DataStoreS3(ARCHIVE, FakeSession(s3))
+    return lambda: store.store(log, workers=workers)
+
+
+CASES = {
+    'archive': case_archive,
+    's3_to_local': case_s3_to_local,
+    'query': case_query,
+    'store': case_store,
+}
+
+
+def run_case(name : str, scale : int, seed : int = 0, workers : int = 1,
+             fake_s3 : dict = None):
+    '''Run a benchmark case against a fresh FakeS3
+
+    @param {str} name key of `CASES`
+    @param {int} scale number of records
+    @param {int} seed generator seed
+    @param {int} workers concurrent writes of the `store` case
+    @param {dict} fake_s3 FakeS3 arguments, e.g. latency
+    @return {dict} result, with the request statistics of the run
+    '''
+    s3 = FakeS3(**(fake_s3 or {}))
+    run = CASES[name](s3, scale, seed, workers)
+    for k in s3.stats:
+        s3.stats[k] = 0
+    t0 = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - t0
+    ret = {'case': name, 'scale': scale, 'workers': workers,
+           'seconds': elapsed, 'rows_per_s': scale / elapsed}
+    ret.update(s3.stats)
+    return ret
+
+
+def display(results):
+    '''Print results as a table
+
+    @param {list} results results of `run_case`
+    @return None
+    '''
+    print('{:<12} {:>8} {:>7} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+        'case', 'scale', 'workers', 'seconds', 'rows/s', 'requests',
+        'throttled', 'MB in', 'MB out'))
+    for r in results:
+        print('{:<12} {:>8} {:>7} {:>9.3f} {:>10.0f} {:>9} {:>9} {:>9.2f} {:>9.2f}'.format(
+            r['case'], r['scale'], r['workers'], r['seconds'], r['rows_per_s'],
+            r['requests'], r['throttled'], r['bytes_in'] / 1e6, r['bytes_out'] / 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run benchmarks against a simulated S3')
+    parser.add_argument('--cases', nargs='+', default=list(CASES),
+                        choices=list(CASES), help='Cases to run')
+    parser.add_argument('--scale', type=int, default=20000, help='Number of records')
+    parser.add_argument('--seed', type=int, default=0, help='Generator seed')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 8],
+                        help='Concurrent writes of the store case')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds added to every request')
+    parser.add_argument('--bandwidth', type=float, default=100,
+                        help='Transfer rate in MB/s')
+    parser.add_argument('--throttle', type=float, default=0,
+                        help='Fraction of requests throttled with SlowDown')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='Maximum keys per listing page')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write results to this file as JSON')
+    args = parser.parse_args(argv)
+
+    fake_s3 = {'latency': args.latency, 'bandwidth': args.bandwidth * 1e6,
+               'throttle_rate': args.throttle, 'page_size': args.page_size,
+               'seed': args.seed}
+    results = []
+    for name in args.cases:
+        for workers in (args.workers if name == 'store' else [1]):
+            results.append(run_case(name, args.scale, args.seed, workers, fake_s3))
+    display(results)
+
+    if args.json is not None:
+        meta = metadata()
+        meta.update(fake_s3)
+        with open(args.json, 'w') as fd:
+            json.dump({'meta': meta, 'results': results}, fd, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
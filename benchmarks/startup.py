@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+#
+# Cold-start import time of the package, for short-lived local queries
+#
+# Usage
+#  python3 -m benchmarks.startup
+#  python3 -m benchmarks.startup --budget-ms 150
+#
+
+import sys, json, argparse, statistics, subprocess
+
+
+# Modules a local-only query script imports
+LOCAL_MODULES = ['awslogparse.cf_accesslog', 'awslogparse.cf_datastorelocal',
+                 'awslogparse.cf_datastorecolumnar', 'awslogparse.cf_datastoresqlite',
+                 'awslogparse.cf_archiver', 'awslogparse.cf_compactor']
+# Modules that must not be loaded by them
+S3_MODULES = ('boto3', 'botocore', 's3transfer')
+
+_SCRIPT = '''
+import sys, time, json
+t0 = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - t0
+loaded = sorted(m for m in sys.modules if m.split('.')[0] in {s3!r})
+print(json.dumps({{'seconds': elapsed, 's3_modules': loaded}}))
+'''
+
+
+def measure(modules : list = LOCAL_MODULES):
+    '''Import `modules` in a fresh interpreter
+
+    @param {list} modules module names
+    @return {dict} {'seconds': import time, 's3_modules': list of
+            S3 client modules loaded as a side effect}
+    '''
+    script = _SCRIPT.format(modules=list(modules), s3=S3_MODULES)
+    out = subprocess.run([sys.executable, '-c', script], check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def run(modules : list = LOCAL_MODULES, repeat : int = 7):
+    '''Return the median import time over `repeat` fresh interpreters
+
+    @param {list} modules module names
+    @param {int} repeat number of interpreters
+    @return {dict} {'seconds': median, 'min': fastest, 's3_modules': ...}
+    '''
+    results = [measure(modules) for i in range(repeat)]
+    times = [r['seconds'] for r in results]
+    return {'seconds': statistics.median(times), 'min': min(times),
+            's3_modules': results[0]['s3_modules']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure package import time')
+    parser.add_argument('--modules', nargs='+', default=LOCAL_MODULES,
+                        help='Modules to import')
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='Fresh interpreters; the median is reported')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Fail if the median exceeds this many milliseconds')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write the result to this file as JSON')
+    args = parser.parse_args(argv)
+
+    result = run(args.modules, args.repeat)
+    print('import time: {:.1f} ms median, {:.1f} ms min'.format(
+        result['seconds'] * 1000, result['min'] * 1000))
+    if result['s3_modules']:
+        print('{} S3 modules loaded, e.g. {}'.format(len(result['s3_modules']),
+                                                     result['s3_modules'][0]))
+    if args.json is not None:
+        with open(args.json, 'w') as fd:
+            json.dump(result, fd, indent=2)
+
+    over = args.budget_ms is not None and result['seconds'] * 1000 > args.budget_ms
+    if over or result['s3_modules']:
+        sys.exit(1)
+    return result
+
+
+if __name__ == '__main__':
+    main()
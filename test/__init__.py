@@ -0,0 +1,23 @@
+from benchmarks.generator import HEADERS as _LOG_HEADERS
+
+
+# Fields of CloudFront standard logs up to the request ID
+HEADERS = _LOG_HEADERS[:15]
+
+
+def make_row(date : str, time : str, reqid : str, fields : dict = None):
+    '''Return a row of HEADERS, with fields other than those given empty
+
+    The request ID is the last field, which keeps rows whole when
+    stored logs are loaded, since lines are right-stripped
+
+    @param {str} date date in YYYY-mm-dd format
+    @param {str} time time in HH:MM:SS format
+    @param {str} reqid request ID
+    @param {dict} fields values by column name
+    @return {list} row
+    '''
+    row = [date, time] + [''] * (len(HEADERS) - 3) + [reqid]
+    for column, value in (fields or {}).items():
+        row[HEADERS.index(column)] = str(value)
+    return row
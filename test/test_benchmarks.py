@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+import os, sys
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog
+from benchmarks import generator as G
+from benchmarks import run as B
+from benchmarks import s3 as BS3
+from benchmarks import startup as BST
+from benchmarks.fake_s3 import FakeS3
+from awslogparse import cf_datastores3 as DS3
+from botocore.exceptions import ClientError
+
+
+class TestGenerator(unittest.TestCase):
+    def test_deterministic(self):
+        a = G.LogGenerator(seed=3).access_log(200)
+        b = G.LogGenerator(seed=3).access_log(200)
+        self.assertEqual(a.rows, b.rows)
+        self.assertNotEqual(a.rows, G.LogGenerator(seed=4).access_log(200).rows)
+
+    def test_schema(self):
+        log = AccessLog.loads(G.dumps(G.LogGenerator().access_log(100)))
+        self.assertEqual(len(log.headers), 33)
+        self.assertTrue(all(len(row) == 33 for row in log.rows))
+
+    def test_duplicates(self):
+        log = G.LogGenerator(duplicates=0.1, out_of_order=0).access_log(1000)
+        n = log.record_count()
+        self.assertGreater(n, 1000)
+        self.assertEqual(log.sort().remove_duplicates().record_count(), 1000)
+
+    def test_delivery_files(self):
+        files = G.delivery_files(G.LogGenerator(), 96, hours=2, files_per_hour=2)
+        self.assertEqual(len(files), 4)
+        self.assertTrue(all(k.startswith('E2ABCDEF123456.2019-01-01-0')
+                            for k in files))
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run_case(self):
+        for name in B.CASES:
+            with self.subTest(name):
+                result = B.run_case(name, 200, 0, 1)
+                self.assertGreater(result['rows_per_s'], 0)
+
+    def test_startup(self):
+        # Local-only use must not import the S3 client libraries
+        result = BST.measure()
+        self.assertEqual(result['s3_modules'], [])
+        self.assertGreater(result['seconds'], 0)
+
+
+class TestFakeS3(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3(latency=0, page_size=3)
+
+    def test_pagination(self):
+        for i in range(10):
+            self.s3.put_object(Bucket='b', Key='k{}'.format(i), Body=b'x')
+        self.s3.put_object(Bucket='b', Key='other', Body=b'x')
+        keys = [o['Key'] for o in DS3.list_objects(self.s3, 'b', 'k')]
+        self.assertEqual(keys, ['k{}'.format(i) for i in range(10)])
+        keys = [o['Key'] for o in DS3.list_objects(self.s3, 'b', 'k', 'k6')]
+        self.assertEqual(keys, ['k7', 'k8', 'k9'])
+        # 1 + 4 pages + 1 page
+        self.assertEqual(self.s3.stats['requests'], 11 + 4 + 1)
+
+    def test_range(self):
+        self.s3.put_object(Bucket='b', Key='k', Body=b'0123456789')
+        get = lambda r: self.s3.get_object(Bucket='b', Key='k', Range=r)['Body'].read()
+        self.assertEqual(get('bytes=2-4'), b'234')
+        self.assertEqual(get('bytes=7-'), b'789')
+        self.assertEqual(get('bytes=-2'), b'89')
+
+    def test_conditional(self):
+        etag = self.s3.put_object(Bucket='b', Key='k', Body=b'a', IfNoneMatch='*')['ETag']
+        with self.assertRaises(ClientError) as ctx:
+            self.s3.put_object(Bucket='b', Key='k', Body=b'b', IfNoneMatch='*')
+        self.assertTrue(DS3.is_precondition_failed(ctx.exception))
+        with self.assertRaises(ClientError) as ctx:
+            self.s3.get_object(Bucket='b', Key='k', IfNoneMatch=etag)
+        self.assertTrue(DS3.is_not_modified(ctx.exception))
+        self.s3.put_object(Bucket='b', Key='k', Body=b'b', IfMatch=etag)
+        with self.assertRaises(ClientError) as ctx:
+            self.s3.put_object(Bucket='b', Key='k', Body=b'c', IfMatch=etag)
+        self.assertTrue(DS3.is_precondition_failed(ctx.exception))
+        with self.assertRaises(ClientError) as ctx:
+            self.s3.get_object(Bucket='b', Key='missing')
+        self.assertTrue(DS3.is_not_found(ctx.exception))
+
+    def test_multipart(self):
+        upload = self.s3.create_multipart_upload(Bucket='b', Key='k')['UploadId']
+        parts = [{'PartNumber': i + 1,
+                  'ETag': self.s3.upload_part(Bucket='b', Key='k', UploadId=upload,
+                                              PartNumber=i + 1, Body=body)['ETag']}
+                 for i, body in enumerate([b'ab', b'cd'])]
+        self.s3.complete_multipart_upload(Bucket='b', Key='k', UploadId=upload,
+                                          MultipartUpload={'Parts': parts})
+        self.assertEqual(self.s3.get_object(Bucket='b', Key='k')['Body'].read(), b'abcd')
+
+    def test_throttling(self):
+        s3 = FakeS3(latency=0, throttle_rate=1, max_attempts=2)
+        with self.assertRaises(ClientError):
+            s3.put_object(Bucket='b', Key='k', Body=b'a')
+        self.assertEqual(s3.stats['throttled'], 2)
+        self.assertNotIn('k', s3.buckets.get('b', {}))
+
+    def test_run_case(self):
+        for name in BS3.CASES:
+            with self.subTest(name):
+                result = BS3.run_case(name, 200, fake_s3={'latency': 0})
+                self.assertGreater(result['requests'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
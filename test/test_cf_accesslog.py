@@ -51,6 +51,17 @@ class TestAccessLogClass(unittest.TestCase):
         self.assertEqual(cls.headers, ['date', 'time'] + ['']*12 + ['reqid'])
         self.assertEqual(cls.rows, expected)
 
+    def test_load_streams(self):
+        import gzip
+        from botocore.response import StreamingBody
+        data = b'Version: 1.0\n#Fields: date time\n2019-01-02\t15:12:10\n2019-01-01\t15:12:10\n'
+        gzipped = gzip.compress(data)
+        expected = [['2019-01-01', '15:12:10'], ['2019-01-02', '15:12:10']]
+        body = StreamingBody(io.BytesIO(gzipped), len(gzipped))
+        self.assertEqual(AL.AccessLog.load(body).rows, expected)
+        self.assertEqual(AL.AccessLog.load(io.BytesIO(data)).rows, expected)
+        self.assertEqual(AL.AccessLog.load(io.StringIO(data.decode())).rows, expected)
+
     def test_recordcount(self):
         log = AL.AccessLog('1.0', ['date', 'time'], [['2019-01-05\t15:12:10'],
                                                      ['2019-01-02\t15:12:10'],
@@ -250,6 +261,18 @@ class TestAccessLogClass(unittest.TestCase):
         for i, sub in enumerate(AL.group_by_date_generator(log)):
             self.assertEqual(sub.rows, expected_rows[i])
 
+    def test_group_by_hour_generator(self):
+        data = [
+            ['2019-01-01', '15:12:10'],
+            ['2019-01-01', '15:58:10'],
+            ['2019-01-01', '18:12:10'],
+            ['2019-01-02', '18:12:10']
+        ]
+        log = AL.AccessLog('1.0', ['date', 'time'], data)
+        expected_rows = [data[:2], data[2:3], data[3:]]
+        groups = list(AL.group_by_hour_generator(log))
+        self.assertEqual([sub.rows for sub in groups], expected_rows)
+
     def test_select(self):
         data = [['2019-01-01', '15:12:10'],
                 ['2019-01-01', '15:13:10'],
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+from unittest.mock import patch
+
+from awslogparse import cf_accesslog as AL
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_datastorecolumnar import DataStoreColumnar
+from awslogparse.cf_datastoresqlite import DataStoreSQLite
+from test import HEADERS, make_row
+
+
+def make_rows(dates, per_date):
+    return [make_row(date, '{:02}:{:02}:{:02}'.format(i // 3600 % 24, i // 60 % 60, i % 60),
+                     '{}-{}'.format(date, i),
+                     {'sc-bytes': 100, 'sc-status': '500' if i % 4 == 0 else '200'})
+            for date in dates for i in range(per_date)]
+
+
+class TestAccessLogSelector(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name)
+        dates = ['2019-01-01', '2019-01-02', '2019-01-03']
+        self.store.store(AccessLog('1.0', HEADERS, make_rows(dates, 2000)))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_order_by_limit(self):
+        loaded = []
+        def tracking(read):
+            def tracking_read(key):
+                loaded.append(key)
+                return read(key)
+            return tracking_read
+        self.store.access_log = tracking(self.store.access_log)
+        self.store.read_log = tracking(self.store.read_log)
+
+        res = self.store.select(['date', 'time']) \
+                        .where({'sc-status': '^5'}) \
+                        .order_by('time', desc=True) \
+                        .limit(3) \
+                        .execute()
+        self.assertEqual(res.rows, [['2019-01-03', '00:33:16'],
+                                    ['2019-01-03', '00:33:12'],
+                                    ['2019-01-03', '00:33:08']])
+        # Only the newest day was read
+        self.assertEqual(loaded, [self.store.item_key(['2019-01-03'])])
+
+    def test_limit_spans_keys(self):
+        res = self.store.select(['date']).limit(2001).execute()
+        self.assertEqual(len(res.rows), 2001)
+        self.assertEqual(res.rows[-1], ['2019-01-02'])
+
+    def test_order_by_column(self):
+        with self.assertRaises(ValueError):
+            self.store.select('*').order_by('c-ip')
+
+    def test_sample_fraction(self):
+        res = self.store.select(['date', 'sc-bytes']) \
+                        .where({'sc-status': '^5'}) \
+                        .sample(fraction=0.2, seed=1) \
+                        .execute()
+        count = res.count()
+        # 1500 matching rows in total
+        self.assertLess(count.low, 1500)
+        self.assertGreater(count.high, 1500)
+        self.assertAlmostEqual(count.value, 1500, delta=150)
+        total = res.sum('sc-bytes')
+        self.assertAlmostEqual(total.value, 150000, delta=15000)
+        self.assertEqual(len(res.strata), 3)
+        self.assertEqual(sum(s[1] for s in res.strata), 1200)
+
+    def test_sample_rows(self):
+        res = self.store.select('*').sample(rows=300, seed=1).execute()
+        self.assertEqual(len(res.rows), 300)
+        count = res.count()
+        self.assertEqual(count.value, 6000)
+        self.assertEqual(count.stderr, 0)
+
+    def test_sample_without_parsing(self):
+        def sample(store):
+            return store.select(['time', 'x-edge-request-id']) \
+                        .where({'sc-status': '^5'}) \
+                        .sample(fraction=0.1, seed=2) \
+                        .execute()
+
+        # Parsed logs of the cache are sampled by index
+        expected = sample(self.store.enable_cache())
+        self.store.cache = None
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        stores = [self.store,
+                  DataStoreLocal(os.path.join(tmp.name, 'bin')).enable_binary_cache(),
+                  DataStoreColumnar(os.path.join(tmp.name, 'col'), chunk_rows=500),
+                  DataStoreSQLite(':memory:')]
+        for store in stores[1:]:
+            store.store(AccessLog('1.0', HEADERS, make_rows(['2019-01-01', '2019-01-02',
+                                                             '2019-01-03'], 2000)))
+        for store in stores:
+            with self.subTest(store=type(store).__name__), \
+                 patch.object(AL.AccessLog, 'loads', side_effect=AssertionError), \
+                 patch.object(DataStoreColumnar, 'decode_log', side_effect=AssertionError):
+                res = sample(store)
+                self.assertEqual(res.rows, expected.rows)
+                self.assertEqual(res.strata, expected.strata)
+        stores[-1].close()
+
+    def test_sample_args(self):
+        sel = self.store.select('*')
+        with self.assertRaises(ValueError):
+            sel.sample()
+        with self.assertRaises(ValueError):
+            sel.sample(fraction=0.1, rows=10)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+import os, sys, asyncio, tempfile, threading
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_datastorecolumnar import DataStoreColumnar
+from awslogparse.cf_datastores3 import DataStoreS3
+from awslogparse import cf_archiver as archiver
+from benchmarks.fake_s3 import FakeS3, FakeSession
+
+
+HEADERS = ['date', 'time', 'sc-status'] + ['h{}'.format(i) for i in range(11)] \
+    + ['x-edge-request-id']
+
+
+def make_log(dates, per_date):
+    rows = []
+    for date in dates:
+        for i in range(per_date):
+            rows.append([date, '00:{:02}:{:02}'.format(i // 60, i % 60),
+                         '500' if i % 4 == 0 else '200'] + [''] * 11
+                        + ['{}-{}'.format(date, i)])
+    return AccessLog('1.0', HEADERS, rows)
+
+
+DATES = ['2019-01-01', '2019-01-02', '2019-01-03']
+
+
+class TestAsyncStores(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def roundtrip(self, store):
+        key = store.item_key(['2019-01-01'])
+
+        async def run():
+            self.assertIsNone(await store.access_log_async(key))
+            await store.overwrite_async(key, make_log(DATES[:1], 100))
+            return await store.access_log_async(key)
+
+        log = asyncio.run(run())
+        self.assertEqual(log.rows, make_log(DATES[:1], 100).rows)
+        self.assertEqual(store.access_log(key).rows, log.rows)
+
+    def test_local(self):
+        self.roundtrip(DataStoreLocal(self.tmp.name))
+
+    def test_columnar(self):
+        self.roundtrip(DataStoreColumnar(self.tmp.name, chunk_rows=16))
+
+    def test_s3(self):
+        self.roundtrip(DataStoreS3('logs', FakeSession(FakeS3(latency=0))))
+
+    def test_io_concurrency(self):
+        s3 = FakeS3(latency=0.01)
+        store = DataStoreS3('logs', FakeSession(s3)).enable_async(io_concurrency=2)
+        store.store(make_log(DATES, 10))
+
+        active = [0, 0]
+        lock = threading.Lock()
+        get_object = s3.get_object
+        def tracking_get(**kwargs):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            try:
+                return get_object(**kwargs)
+            finally:
+                with lock:
+                    active[0] -= 1
+        s3.get_object = tracking_get
+
+        async def run():
+            return await asyncio.gather(*[store.access_log_async(store.item_key([d]))
+                                          for d in DATES * 2])
+
+        logs = asyncio.run(run())
+        self.assertEqual([l.record_count() for l in logs], [10] * 6)
+        self.assertEqual(active[1], 2)
+
+
+class TestAsyncSelector(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name).enable_async(io_concurrency=2)
+        self.store.store(make_log(DATES, 200))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def selector(self):
+        return self.store.select(['date', 'x-edge-request-id']).where({'sc-status': '^5'})
+
+    def test_execute_async(self):
+        expected = self.selector().execute()
+        res = asyncio.run(self.selector().execute_async())
+        self.assertEqual(res.rows, expected.rows)
+        self.assertEqual(res.headers, expected.headers)
+
+        # Limits span keys selected ahead
+        expected = self.selector().order_by('time', desc=True).limit(70).execute()
+        res = asyncio.run(self.selector().order_by('time', desc=True).limit(70)
+                          .execute_async())
+        self.assertEqual(len(res.rows), 70)
+        self.assertEqual(res.rows, expected.rows)
+
+    def test_stream_async(self):
+        async def run():
+            return [q.rows async for q in self.selector().limit(60).stream_async()]
+
+        results = asyncio.run(run())
+        self.assertEqual([len(rows) for rows in results], [50, 10])
+        self.assertEqual(results[1][0][0], '2019-01-02')
+
+    def test_empty(self):
+        res = asyncio.run(self.selector().daterange(['2020-01-01', '2020-01-02'])
+                          .execute_async())
+        self.assertIsNone(res)
+
+
+class TestArchiveAsync(unittest.TestCase):
+    def test_archive_async(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_store = DataStoreLocal(os.path.join(tmp, 'in'))
+            keys = []
+            for i, date in enumerate(DATES):
+                # Deliveries overlap days, and repeat records
+                key = os.path.join(tmp, 'in', 'EDIST.{}-23.0000000{}.gz'.format(date, i))
+                in_store.overwrite(key, make_log(DATES[i:i + 2], 50))
+                keys.append(key)
+
+            expected = DataStoreLocal(os.path.join(tmp, 'sync'))
+            async_store = DataStoreLocal(os.path.join(tmp, 'async'))
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                archiver.archive(keys, in_store, expected)
+                processed = asyncio.run(archiver.archive_async(keys, in_store, async_store,
+                                                               window=2))
+                # Reruns write nothing
+                mtimes = [os.stat(k).st_mtime_ns for k in async_store.list_keys()]
+                asyncio.run(archiver.archive_async(keys, in_store, async_store))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+            self.assertEqual(processed, keys)
+            self.assertEqual([os.stat(k).st_mtime_ns for k in async_store.list_keys()],
+                             mtimes)
+            self.assertEqual(len(async_store.list_keys()), 3)
+            for date in DATES:
+                log = async_store.access_log(async_store.item_key([date]))
+                self.assertEqual(log.rows, expected.access_log(expected.item_key([date])).rows)
+                self.assertEqual(log.record_count(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
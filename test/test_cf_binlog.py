@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+from unittest.mock import patch
+
+from awslogparse import cf_binlog as BL
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_binlog import BinaryLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+
+
+def make_log(n):
+    rows = [['2019-01-01', '{:02}:{:02}:{:02}'.format(i // 3600, i // 60 % 60, i % 60),
+             'café' if i % 2 else '', str(i)] for i in range(n)]
+    return AccessLog('1.0', ['date', 'time', 'ua', 'id'], rows)
+
+
+class TestBinaryLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'log.bin')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, log, fingerprint=(1, 2)):
+        with open(self.path, 'wb') as fd:
+            fd.write(BL.dumps(log, fingerprint))
+
+    def test_roundtrip(self):
+        log = make_log(10)
+        self.write(log)
+        with BinaryLog.open(self.path, (1, 2)) as binlog:
+            loaded = binlog.access_log()
+        self.assertEqual(loaded.headers, log.headers)
+        self.assertEqual(loaded.rows, log.rows)
+
+    def test_stale(self):
+        self.write(make_log(3))
+        self.assertIsNone(BinaryLog.open(self.path, (1, 3)))
+        self.assertIsNone(BinaryLog.open(self.path + '.missing', (1, 2)))
+        # Source removed
+        self.assertIsNone(BinaryLog.open(self.path, None))
+
+    @patch.object(BL, 'BLOCK_ROWS', 4)
+    def test_select(self):
+        log = make_log(10)
+        self.write(log)
+        with BinaryLog.open(self.path, (1, 2)) as binlog:
+            res = binlog.select(['id'], {'ua': 'caf'})
+            self.assertEqual(res.rows, [[str(i)] for i in range(1, 10, 2)])
+            res = binlog.select(['id', 'ua'], {'ua': 'caf'}, limit=3, reverse=True)
+            self.assertEqual(res.rows, [['9', 'café'], ['7', 'café'],
+                                        ['5', 'café']])
+
+
+class TestDataStoreLocalBinary(unittest.TestCase):
+    def test_sidecar(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_binary_cache()
+            key = store.item_key(['2019-01-01'])
+            store.overwrite(key, make_log(5))
+            self.assertTrue(os.path.exists(key + BL.SIDECAR_SUFFIX))
+            self.assertEqual(store.access_log(key).rows, make_log(5).rows)
+            res = store.select(['id']).where({'id': '^[34]$'}).execute()
+            self.assertEqual(res.rows, [['3'], ['4']])
+
+            # Sidecar goes stale once the gz file changes behind its back
+            other = DataStoreLocal(db_dir)
+            other.overwrite(key, make_log(2))
+            self.assertEqual(store.access_log(key).record_count(), 2)
+
+            # Sidecar left behind by a removed day file
+            os.remove(key)
+            self.assertIsNone(store.select_key(key, ['id'], {}))
+            self.assertIsNone(store.sample_key(key, ['id'], {}, lambda n: [0]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+import os, io, sys, gzip, tempfile
+import boto3, botocore
+import unittest
+from unittest.mock import MagicMock
+
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_cache import AccessLogCache, log_size
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_datastores3 import DataStoreS3
+
+
+def make_log(date, n=3):
+    return AccessLog('1.0', ['date', 'time'],
+                     [[date, '15:12:{:02}'.format(i)] for i in range(n)])
+
+
+class TestAccessLogCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        size = log_size(make_log('2019-01-01'))
+        cache = AccessLogCache(2 * size)
+        cache.put('a', 1, make_log('2019-01-01'))
+        cache.put('b', 1, make_log('2019-01-02'))
+        # Touch `a` so that `b` is the least recently used
+        self.assertIsNotNone(cache.get('a', 1))
+        cache.put('c', 1, make_log('2019-01-03'))
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIsNotNone(cache.get('a', 1))
+        self.assertIsNotNone(cache.get('c', 1))
+        self.assertEqual(cache.size, 2 * size)
+
+    def test_stale_fingerprint(self):
+        cache = AccessLogCache(1 << 20)
+        cache.put('a', 1, make_log('2019-01-01'))
+        self.assertIsNone(cache.get('a', 2))
+
+    def test_returns_copy(self):
+        cache = AccessLogCache(1 << 20)
+        cache.put('a', 1, make_log('2019-01-01'))
+        log = cache.get('a', 1)
+        log.concatenate(make_log('2019-01-02'))
+        self.assertEqual(cache.get('a', 1).record_count(), 3)
+
+
+class TestDataStoreLocalCache(unittest.TestCase):
+    def test_cached_access_log(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_cache()
+            key = store.item_key(['2019-01-01'])
+            store.overwrite(key, make_log('2019-01-01'))
+            self.assertEqual(store.access_log(key).record_count(), 3)
+            self.assertEqual(store.access_log(key).record_count(), 3)
+            self.assertEqual(store.cache.hits, 1)
+
+            # overwrite invalidates
+            store.overwrite(key, make_log('2019-01-01', 5))
+            self.assertEqual(store.access_log(key).record_count(), 5)
+            store.delete(key)
+            self.assertIsNone(store.access_log(key))
+            self.assertEqual(len(store.cache.entries), 0)
+
+
+class TestDataStoreS3Cache(unittest.TestCase):
+    def test_conditional_get(self):
+        store = DataStoreS3(bucket='foo', session=boto3.Session()).enable_cache()
+        content = io.BytesIO()
+        with gzip.open(content, 'wb') as fd:
+            make_log('2019-01-01').dump(fd)
+        store.s3.get_object = MagicMock(return_value={
+            'Body': botocore.response.StreamingBody(
+                io.BytesIO(content.getvalue()), len(content.getvalue())),
+            'ETag': '"abc"'
+        })
+        self.assertEqual(store.access_log('k').record_count(), 3)
+
+        not_modified = botocore.exceptions.ClientError(
+            {'Error': {'Code': '304'},
+             'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        store.s3.get_object = MagicMock(side_effect=not_modified)
+        self.assertEqual(store.access_log('k').record_count(), 3)
+        store.s3.get_object.assert_called_with(Bucket='foo', Key='k',
+                                               IfNoneMatch='"abc"')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
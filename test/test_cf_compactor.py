@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+from unittest.mock import patch
+
+from awslogparse import cf_compactor as CP
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_datastores3 import DataStoreS3
+from benchmarks.fake_s3 import FakeS3, FakeSession
+
+
+def make_log(date, n):
+    rows = [[date, '00:00:{:02}'.format(i), str(i)] for i in range(n)]
+    return AccessLog('1.0', ['date', 'time', 'id'], rows)
+
+
+class TestCompactor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name)
+        self.dates = ['2019-01-01', '2019-01-02', '2019-01-31', '2019-02-01']
+        for i, date in enumerate(self.dates):
+            self.store.overwrite(self.store.item_key([date]), make_log(date, i + 1))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        logs = {date: make_log(date, 3) for date in self.dates[:2]}
+        for codec in CP.CODECS:
+            with self.subTest(codec):
+                data = CP.dumps(logs, codec)
+                index = CP.read_index(lambda start, length: data[start:])
+                self.assertEqual(index['codec'], codec)
+                offset, length = index['days']['2019-01-02']
+                log = CP.decode_member(codec, data[offset:offset + length])
+                self.assertEqual(log.rows, logs['2019-01-02'].rows)
+
+    def test_compact(self):
+        keys = self.store.list_keys()
+        archives = CP.compact(self.store, before='2019-02')
+        self.assertEqual(archives, [os.path.join(self.tmp.name, '2019', '01',
+                                                 '2019-01' + CP.ARCHIVE_EXTENSION)])
+        # Day files are replaced, keys resolve from the archive
+        self.assertEqual(self.store.list_day_keys(), keys[3:])
+        self.assertEqual(self.store.list_keys(), keys)
+        for i, key in enumerate(keys):
+            self.assertEqual(self.store.access_log(key).rows,
+                             make_log(self.dates[i], i + 1).rows)
+        res = self.store.select(['id']).where({'id': '^2$'}) \
+                        .daterange(['2019-01-01', '2019-01-31']).execute()
+        self.assertEqual(res.rows, [['2']])
+
+    def test_recompact(self):
+        CP.compact(self.store, before='2019-02')
+        key = self.store.item_key(['2019-01-15'])
+        self.store.overwrite(key, make_log('2019-01-15', 4))
+        CP.compact(self.store, before='2019-02')
+        self.assertEqual(len(self.store.archived_keys(self.store.archive_key(key))), 4)
+        self.assertEqual(self.store.access_log(key).record_count(), 4)
+
+    def test_delete(self):
+        CP.compact(self.store, before='2019-02')
+        keys = self.store.list_keys()
+        self.assertTrue(self.store.delete(keys[0]))
+        self.assertIsNone(self.store.access_log(keys[0]))
+        self.assertEqual(self.store.list_keys(), keys[1:])
+        self.assertEqual(self.store.access_log(keys[1]).record_count(), 2)
+
+    def check_delete_list(self, store):
+        for i, date in enumerate(self.dates):
+            store.overwrite(store.item_key([date]), make_log(date, i + 1))
+        CP.compact(store, before='2019-02')
+        keys = store.list_keys()
+        with patch.object(type(store), 'write_archive',
+                          autospec=True, side_effect=type(store).write_archive) as write:
+            self.assertTrue(store.delete_list(keys=keys[:2] + keys[3:]))
+        # The archive is rewritten once, without both days
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(store.list_keys(), keys[2:3])
+        self.assertIsNone(store.access_log(keys[0]))
+        self.assertEqual(store.access_log(keys[2]).record_count(), 3)
+
+        store.delete_list(keys=keys[2:3])
+        self.assertEqual(store.list_keys(), [])
+
+    def test_delete_list(self):
+        self.check_delete_list(DataStoreLocal(os.path.join(self.tmp.name, 'list')))
+
+    def test_delete_list_s3(self):
+        self.check_delete_list(DataStoreS3('logs', FakeSession(FakeS3(latency=0))))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
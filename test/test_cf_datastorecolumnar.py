@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+
+from awslogparse import cf_datastorecolumnar as DC
+from awslogparse import cf_accesslog as AL
+from awslogparse.cf_accesslog import AccessLog, Equals, Between
+from awslogparse.cf_datastorecolumnar import DataStoreColumnar
+
+
+HEADERS = ['date', 'time', 'sc-bytes', 'cs-uri-stem', 'sc-status', 'time-taken']
+
+
+def make_log(n):
+    rows = []
+    for i in range(n):
+        rows.append(['2019-01-01',
+                     '{:02}:{:02}:{:02}'.format(i // 3600, i // 60 % 60, i % 60),
+                     str(1000 + i),
+                     '/page/{}'.format(i),
+                     '404' if i % 10 == 0 else '200',
+                     '0.{:03}'.format(i % 1000)])
+    return AccessLog('1.0', HEADERS, rows)
+
+
+class TestEncoding(unittest.TestCase):
+    def test_bitpack(self):
+        values = [0, 1, 5, 7, 3, 2, 6, 4, 1, 0, 7]
+        self.assertEqual(DC.bitunpack(DC.bitpack(values, 3), 3, len(values)), values)
+        self.assertEqual(DC.bitunpack(DC.bitpack([0, 0], 0), 0, 2), [0, 0])
+
+    def test_encodings(self):
+        cases = [
+            (['10:00:00', '10:00:05', '11:00:00'], 'delta'),
+            (['200', '404', '200'], 'int'),
+            (['a', 'b', 'a', 'a'], 'dict'),
+            (['a', 'b', 'c'], 'plain'),
+            # leading zeros do not round-trip through integers
+            (['007', '1'], 'plain'),
+        ]
+        for values, enc in cases:
+            with self.subTest(enc):
+                meta, blob = DC.encode_column(values)
+                self.assertEqual(meta['enc'], enc)
+                self.assertEqual(DC.decode_column(meta, blob, len(values)), values)
+
+    def test_regex_literal(self):
+        self.assertEqual(AL.regex_literal('^200$'), ('200', True))
+        self.assertEqual(AL.regex_literal('^/img/a\\.png'), ('/img/a.png', False))
+        self.assertIsNone(AL.regex_literal('^2..$'))
+        self.assertIsNone(AL.regex_literal('200'))
+
+    def test_may_match(self):
+        meta, blob = DC.encode_column(['1000', '2000'])
+        self.assertTrue(DC.may_match(meta, '^1500$'))
+        self.assertFalse(DC.may_match(meta, '^3000$'))
+        self.assertFalse(DC.may_match(meta, Between(2001, None)))
+        self.assertTrue(DC.may_match(meta, '5'))
+
+
+class TestDataStoreColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreColumnar(self.tmp.name, chunk_rows=100)
+        self.key = self.store.item_key(['2019-01-01'])
+        self.store.overwrite(self.key, make_log(1000))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        self.assertTrue(self.key.endswith('2019-01-01.cfc'))
+        self.assertEqual(self.store.list_keys(), [self.key])
+        self.assertEqual(self.store.access_log(self.key).rows, make_log(1000).rows)
+
+    def test_select_pruning(self):
+        reads = []
+        read_column = DataStoreColumnar.read_column
+        def counting_read_column(fd, chunk, index):
+            reads.append(index)
+            return read_column(fd, chunk, index)
+        self.store.read_column = counting_read_column
+
+        res = self.store.select(['cs-uri-stem']) \
+                        .where({'sc-bytes': Equals(1250)}) \
+                        .daterange(['2019-01-01', '2019-01-01']) \
+                        .execute()
+        self.assertEqual(res.rows, [['/page/250']])
+        # one chunk, condition column plus selected column
+        self.assertEqual(reads, [2, 3])
+
+    def test_select_order_limit(self):
+        res = self.store.select(['time']) \
+                        .where({'sc-status': '^404$', 'time': Between('00:05:00', None)}) \
+                        .order_by('time', desc=True) \
+                        .limit(2) \
+                        .execute()
+        self.assertEqual(res.rows, [['00:16:30'], ['00:16:20']])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,9 +1,19 @@
 #!/usr/bin/python3
 
-import os, sys
+import os, sys, tempfile
 import unittest
 
-from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal, DIGEST_SUFFIX
+from awslogparse.cf_metrics import Metrics
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(rows):
+    return AccessLog('1.0', HEADERS, [[d, t] + [''] * 12 + [reqid]
+                                      for d, t, reqid in rows])
 
 
 
@@ -13,6 +23,68 @@ class TestDataStoreLocalClass(unittest.TestCase):
         p = store.item_key(['2019-03-01', '12:01:10'])
         self.assertEqual(p, '/tmp/2019/03/2019-03-01.gz')
 
+    def test_store_workers(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir)
+            store.store(make_log([('2019-01-01', '10:00:00', 'a')]))
+
+            writers = {}
+            overwrite = store.overwrite
+            def counting_overwrite(key, log):
+                writers[key] = writers.get(key, 0) + 1
+                overwrite(key, log)
+            store.overwrite = counting_overwrite
+
+            # Unsorted input yields several groups of the same day
+            rows = [('2019-01-{:02}'.format(d), '11:00:00', str(d))
+                    for d in range(1, 11)] * 2
+            rows += [('2019-01-01', '12:00:00', 'b')]
+            store.store(make_log(rows), workers=4)
+
+            self.assertEqual(set(writers.values()), {1})
+            self.assertEqual(len(store.list_keys()), 10)
+            log = store.access_log(store.item_key(['2019-01-01']))
+            self.assertEqual(log.column('id'), ['a', '1', 'b'])
+
+    def test_store_rerun(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            m = Metrics()
+            store = DataStoreLocal(db_dir).enable_metrics(m)
+            rows = [('2019-01-01', '10:00:00', 'a'), ('2019-01-01', '10:00:01', 'b')]
+            store.store(make_log(rows))
+            key = store.item_key(['2019-01-01'])
+            mtime = os.stat(key).st_mtime_ns
+
+            # No new request IDs: neither merged nor written
+            store.store(make_log(rows[1:]))
+            self.assertEqual(m.counter('writes_skipped'), 1)
+            self.assertEqual(os.stat(key).st_mtime_ns, mtime)
+
+            store.store(make_log([('2019-01-01', '10:00:02', 'c')]))
+            self.assertEqual(store.access_log(key).column('id'), ['a', 'b', 'c'])
+            self.assertEqual(m.counter('writes_skipped'), 1)
+
+    def test_write_skipping(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            m = Metrics()
+            store = DataStoreLocal(db_dir).enable_metrics(m).enable_write_skipping()
+            key = store.item_key(['2019-01-01'])
+            log = make_log([('2019-01-01', '10:00:00', 'a')])
+            store.overwrite(key, log)
+            self.assertIsNotNone(store.stored_digest(key))
+            store.overwrite(key, make_log([('2019-01-01', '10:00:00', 'a')]))
+            self.assertEqual(m.counter('writes_skipped'), 1)
+            self.assertEqual(m.counter('bytes_uploaded'), os.path.getsize(key))
+
+            # Digests of files changed by other writers are ignored
+            DataStoreLocal(db_dir).overwrite(key, make_log([('2019-01-01', '10:00:00', 'b')]))
+            self.assertIsNone(store.stored_digest(key))
+            store.overwrite(key, log)
+            self.assertEqual(store.access_log(key).column('id'), ['a'])
+
+            store.delete(key)
+            self.assertFalse(os.path.exists(key + DIGEST_SUFFIX))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
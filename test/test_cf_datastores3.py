@@ -148,6 +148,21 @@ class TestDataStoreS3Class(unittest.TestCase):
                                                Body = expected_data.getvalue(),
                                                Key=key)
 
+    def test_overwrite_unchanged(self):
+        store = DataStoreS3(bucket='foo-bar', session=self.session).enable_write_skipping()
+        log = AccessLog('1.0', ['date', 'time'], [['2019-01-01', '15:12:10']])
+        key = store.item_key(['2019-01-01'])
+        store.s3.put_object = MagicMock(return_value={'ETag': '"1"'})
+        store.s3.head_object = MagicMock(return_value={'Metadata': {}})
+        store.overwrite(key, log)
+        metadata = store.s3.put_object.call_args.kwargs['Metadata']
+        self.assertIn(DS3.DIGEST_METADATA, metadata)
+
+        store.s3.put_object.reset_mock()
+        store.s3.head_object = MagicMock(return_value={'Metadata': metadata})
+        store.overwrite(key, log)
+        store.s3.put_object.assert_not_called()
+
     # Test s3.list_objects_v2 is called with right arguments
     def test_list_keys(self):
         bucket_name = 'foo-bar'
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+import os, sys, gzip, tempfile
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_datastoresource import DataStoreSource, DataStoreUnion
+from awslogparse.cf_metrics import Metrics
+from benchmarks.fake_s3 import FakeS3, FakeSession
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(rows):
+    return AccessLog('1.0', HEADERS, [[d, t] + [''] * 12 + [i] for d, t, i in rows])
+
+
+def dumps(rows):
+    lines = ['#Version: 1.0', '#Fields: ' + ' '.join(HEADERS)]
+    lines += ['\t'.join(r) for r in make_log(rows).rows]
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+# Raw logs by key; the 2019-01-03-00 file holds a late record of the 2nd
+OBJECTS = {
+    'logs/EDIST1.2019-01-01-23.aaaaaaaa.gz': [('2019-01-01', '23:10:00', 'a')],
+    'logs/EDIST1.2019-01-02-10.bbbbbbbb.gz': [('2019-01-02', '10:30:00', 'c'),
+                                              ('2019-01-02', '10:00:00', 'b')],
+    'logs/EDIST1.2019-01-02-11.cccccccc.gz': [('2019-01-02', '11:00:00', 'd'),
+                                              ('2019-01-02', '10:00:00', 'b')],
+    'logs/EDIST1.2019-01-03-00.dddddddd.gz': [('2019-01-02', '23:59:00', 'e'),
+                                              ('2019-01-03', '00:01:00', 'f')],
+    'logs/EDIST2.2019-01-02-12.eeeeeeee.gz': [('2019-01-02', '12:00:00', 'g')],
+    'logs/EDIST1.2019-01-05-00.ffffffff.gz': [('2019-01-05', '00:00:00', 'h')],
+}
+
+
+class TestDataStoreSource(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3(latency=0)
+        for key, rows in OBJECTS.items():
+            self.s3.put_object(Bucket='logs', Key=key, Body=dumps(rows))
+        self.session = FakeSession(self.s3)
+
+    def store(self, **kwargs):
+        return DataStoreSource('logs', self.session, prefix='logs/', **kwargs)
+
+    def test_list_keys(self):
+        store = self.store()
+        self.assertEqual(store.list_keys(date_range=['2019-01-02', '2019-01-02']),
+                         ['2019-01-02'])
+        self.assertEqual(sorted(store.day_objects['2019-01-02']),
+                         sorted(k for k in OBJECTS if '2019-01-02' in k or '01-03-00' in k))
+        self.assertEqual(store.list_keys(),
+                         ['2019-01-01', '2019-01-02', '2019-01-03', '2019-01-04', '2019-01-05'])
+
+    def test_access_log(self):
+        m = Metrics()
+        store = self.store().enable_metrics(m)
+        log = store.access_log('2019-01-02')
+        self.assertEqual(log.column('id'), ['b', 'c', 'd', 'g', 'e'])
+        self.assertEqual(m.counter('duplicates_dropped'), 1)
+        self.assertIsNone(store.access_log('2019-01-04'))
+
+    def test_distributions(self):
+        store = self.store(distributions=['EDIST1'])
+        requests = self.s3.stats['requests']
+        res = store.select(['id']).daterange(['2019-01-02', '2019-01-02']).execute()
+        self.assertEqual(res.rows, [['b'], ['c'], ['d'], ['e']])
+        # One listing, and the three objects of the day
+        self.assertEqual(self.s3.stats['requests'] - requests, 4)
+
+    def test_read_only(self):
+        with self.assertRaises(NotImplementedError):
+            self.store().overwrite('2019-01-02', make_log([]))
+
+
+class TestDataStoreUnion(unittest.TestCase):
+    def test_tail(self):
+        s3 = FakeS3(latency=0)
+        for key, rows in OBJECTS.items():
+            s3.put_object(Bucket='logs', Key=key, Body=dumps(rows))
+        source = DataStoreSource('logs', FakeSession(s3), prefix='logs/')
+        with tempfile.TemporaryDirectory() as db_dir:
+            archive = DataStoreLocal(db_dir)
+            # Archived up to the middle of the 2nd
+            archive.store(make_log([('2019-01-01', '23:10:00', 'a'),
+                                    ('2019-01-02', '10:00:00', 'b')]))
+            union = DataStoreUnion(archive, source)
+            self.assertEqual(union.list_keys(date_range=['2019-01-01', '2019-01-03']),
+                             ['2019-01-01', '2019-01-02', '2019-01-03'])
+            self.assertEqual(union.source_days, {'2019-01-02', '2019-01-03'})
+
+            res = union.select(['date', 'id']).daterange(['2019-01-01', '2019-01-03']) \
+                       .execute()
+            self.assertEqual([r[1] for r in res.rows], ['a', 'b', 'c', 'd', 'g', 'e', 'f'])
+
+            res = union.select(['id']).order_by('time', desc=True).limit(2).execute()
+            self.assertEqual(res.rows, [['h'], ['f']])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
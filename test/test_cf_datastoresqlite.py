@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog, Equals, Between
+from awslogparse.cf_datastoresqlite import DataStoreSQLite, condition_sql
+
+
+HEADERS = ['date', 'time', 'c-ip', 'sc-bytes', 'cs-uri-stem', 'sc-status']
+
+
+def make_log(date, n):
+    rows = [[date, '10:{:02}:00'.format(i), '10.0.0.{}'.format(i % 3),
+             str(100 * i), '/p/{}'.format(i), '500' if i % 4 == 0 else '200']
+            for i in range(n)]
+    return AccessLog('1.0', HEADERS, rows[::-1])
+
+
+class TestConditionSql(unittest.TestCase):
+    def test_translation(self):
+        self.assertEqual(condition_sql('sc-status', '^200$'),
+                         ('"sc-status" = ?', ['200']))
+        self.assertEqual(condition_sql('cs-uri-stem', '^/img/'),
+                         ('"cs-uri-stem" >= ? AND "cs-uri-stem" < ?', ['/img/', '/img0']))
+        self.assertEqual(condition_sql('cs-uri-stem', '^'), ('"cs-uri-stem" >= ?', ['']))
+        self.assertEqual(condition_sql('c-ip', '10\\.0\\..*'),
+                         ('"c-ip" REGEXP ?', ['10\\.0\\..*']))
+        self.assertEqual(condition_sql('time', Between('10:00:00', None)),
+                         ('"time" >= ?', ['10:00:00']))
+
+
+class TestDataStoreSQLite(unittest.TestCase):
+    def check_store(self, partition):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DataStoreSQLite(os.path.join(tmp, 'db.sqlite'), partition)
+            for date in ['2019-01-01', '2019-01-02', '2019-02-01']:
+                store.overwrite(store.item_key([date]), make_log(date, 10))
+            self.assertEqual(store.list_keys(date_range=['2019-01-02', '2019-03-01']),
+                             ['2019-01-02', '2019-02-01'])
+
+            log = store.access_log('2019-01-02')
+            self.assertEqual(log.headers, HEADERS)
+            self.assertEqual(log.rows, make_log('2019-01-02', 10).sort().rows)
+
+            res = store.select(['date', 'time']) \
+                       .where({'sc-status': '^500$',
+                               'c-ip': '0\\.[01]$',
+                               'sc-bytes': Between(100, 500)}) \
+                       .daterange(['2019-01-01', '2019-01-02']) \
+                       .execute()
+            self.assertEqual(res.rows, [['2019-01-01', '10:04:00'],
+                                        ['2019-01-02', '10:04:00']])
+
+            res = store.select(['time']).where({'cs-uri-stem': Equals('/p/3')}) \
+                       .order_by('time', desc=True).limit(2).execute()
+            self.assertEqual(res.rows, [['10:03:00'], ['10:03:00']])
+
+            res = store.select(['cs-uri-stem']).where({'cs-uri-stem': '^/p/1'}) \
+                       .daterange(['2019-01-01', '2019-01-01']).execute()
+            self.assertEqual(res.rows, [['/p/1']])
+            plan = ' '.join(r[-1] for r in store.conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM {} WHERE "date" = ? AND '
+                '{}'.format(store.table('2019-01-01'),
+                            condition_sql('cs-uri-stem', '^/p/1')[0]),
+                ['2019-01-01', '/p/1', '/p/2']))
+            self.assertIn('cs_uri_stem', plan)
+
+            store.overwrite('2019-01-01', make_log('2019-01-01', 2))
+            self.assertEqual(store.access_log('2019-01-01').record_count(), 2)
+            self.assertEqual(store.fingerprint('2019-01-01'), 4)
+            self.assertTrue(store.delete('2019-01-01'))
+            self.assertIsNone(store.access_log('2019-01-01'))
+            self.assertEqual(store.access_log('2019-01-02').record_count(), 10)
+            # Revisions never repeat once a date is deleted
+            store.overwrite('2019-01-01', make_log('2019-01-01', 2))
+            self.assertEqual(store.fingerprint('2019-01-01'), 5)
+            store.close()
+
+    def test_day_partition(self):
+        self.check_store('day')
+
+    def test_month_partition(self):
+        self.check_store('month')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
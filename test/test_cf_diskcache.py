@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+import os, io, sys, gzip, time, tempfile
+import boto3, botocore
+import unittest
+from unittest.mock import MagicMock
+
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_diskcache import DiskCache
+from awslogparse.cf_datastores3 import DataStoreS3
+
+
+class TestDiskCache(unittest.TestCase):
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root, 1024)
+            self.assertIsNone(cache.get('a/b.gz'))
+            cache.put('a/b.gz', '"etag"', b'\x00\x01data')
+            self.assertEqual(cache.get('a/b.gz'), ('"etag"', b'\x00\x01data'))
+            cache.invalidate('a/b.gz')
+            self.assertIsNone(cache.get('a/b.gz'))
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root, 250)
+            cache.put('a', 'e', b'x' * 100)
+            cache.put('b', 'e', b'x' * 100)
+            # Make `a` most recently used
+            os.utime(cache.path('b'), ns=(0, 0))
+            cache.get('a')
+            cache.put('c', 'e', b'x' * 100)
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNotNone(cache.get('c'))
+
+
+class TestDataStoreS3DiskCache(unittest.TestCase):
+    def test_read_through(self):
+        content = io.BytesIO()
+        with gzip.open(content, 'wb') as fd:
+            AccessLog('1.0', ['date', 'time'],
+                      [['2019-01-01', '15:12:10']]).dump(fd)
+        data = content.getvalue()
+
+        with tempfile.TemporaryDirectory() as root:
+            store = DataStoreS3(bucket='foo', session=boto3.Session())
+            store.enable_disk_cache(root)
+            store.s3.get_object = MagicMock(return_value={
+                'Body': io.BytesIO(data), 'ETag': '"abc"'})
+            self.assertEqual(store.access_log('k').record_count(), 1)
+            self.assertEqual(store.disk_cache.get('k'), ('"abc"', data))
+
+            # A second store sharing the directory revalidates only
+            other = DataStoreS3(bucket='foo', session=boto3.Session())
+            other.enable_disk_cache(root)
+            not_modified = botocore.exceptions.ClientError(
+                {'Error': {'Code': '304'},
+                 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+            other.s3.get_object = MagicMock(side_effect=not_modified)
+            self.assertEqual(other.access_log('k').record_count(), 1)
+            other.s3.get_object.assert_called_with(Bucket='foo', Key='k',
+                                                   IfNoneMatch='"abc"')
+
+            # Without revalidation S3 is not contacted at all
+            other.disk_cache.revalidate = False
+            other.s3.get_object.reset_mock()
+            self.assertEqual(other.access_log('k').record_count(), 1)
+            other.s3.get_object.assert_not_called()
+
+            # A 304 validates the memory entry whose ETag was sent, not
+            # an older copy on disk
+            other.disk_cache.revalidate = True
+            other.enable_cache()
+            newer = AccessLog('1.0', ['date', 'time'], [['2019-01-01', '15:12:10'],
+                                                        ['2019-01-01', '15:12:11']])
+            other.cache.put('k', '"new"', newer)
+            self.assertEqual(other.access_log('k').record_count(), 2)
+            other.s3.get_object.assert_called_with(Bucket='foo', Key='k',
+                                                   IfNoneMatch='"new"')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+import os, sys, gzip, tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from awslogparse import cf_accesslog as AL
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_follow import Follower
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(date, hour, tag):
+    return AccessLog('1.0', HEADERS, [[date, '{}:00:00'.format(hour)]
+                                      + [''] * 12 + [tag]])
+
+
+class FakeS3():
+    # list_objects_v2 over a growing set of objects
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def list_objects_v2(self, **kwargs):
+        self.calls.append(kwargs)
+        keys = sorted(k for k in self.objects
+                      if k > kwargs.get('StartAfter', ''))
+        return {'Contents': [{'Key': k, 'Size': 100} for k in keys],
+                'IsTruncated': False}
+
+
+class TestFollower(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name)
+        self.s3 = FakeS3()
+        self.in_store = MagicMock()
+        self.in_store.access_log = lambda key: self.s3.objects[key]
+        self.follower = Follower(self.s3, 'bucket', self.store,
+                                 InDataStore=self.in_store,
+                                 max_wait=3600, max_bytes=250)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def deliver(self, hour, uid, tag):
+        key = 'E1AAAAAA.2019-01-01-{:02}.{}.gz'.format(hour, uid)
+        self.s3.objects[key] = make_log('2019-01-01', '{:02}'.format(hour), tag)
+
+    def test_follow(self):
+        self.deliver(10, 'bbbbbbbb', 'a')
+        self.deliver(10, 'cccccccc', 'b')
+        self.assertEqual(self.follower.poll(), 2)
+        self.assertFalse(self.follower.batch_ready())
+        self.assertEqual(self.follower.poll(), 0)
+        self.assertEqual(self.s3.calls[-1]['StartAfter'],
+                         'E1AAAAAA.2019-01-01-09')
+
+        # Late file sorting before the last seen key of the hour
+        self.deliver(10, 'aaaaaaaa', 'c')
+        self.assertEqual(self.follower.poll(), 1)
+        self.assertTrue(self.follower.batch_ready())
+        self.assertEqual(len(self.follower.flush()), 3)
+
+        # Next batch merges with the day kept in memory
+        self.deliver(11, 'aaaaaaaa', 'd')
+        self.follower.poll()
+        with patch.object(AL.AccessLog, 'load', side_effect=AssertionError):
+            self.follower.flush()
+        log = self.store.access_log(self.store.item_key(['2019-01-01']))
+        self.assertEqual(sorted(log.column('id')), ['a', 'b', 'c', 'd'])
+
+    def test_failed_fetch_retried(self):
+        self.deliver(10, 'aaaaaaaa', 'a')
+        self.deliver(10, 'bbbbbbbb', 'b')
+        objects = self.s3.objects
+        failing = {'E1AAAAAA.2019-01-01-10.bbbbbbbb.gz'}
+        self.in_store.access_log = lambda key: None if key in failing else objects[key]
+        self.follower.poll()
+        self.assertEqual(self.follower.flush(), ['E1AAAAAA.2019-01-01-10.aaaaaaaa.gz'])
+        self.assertEqual(list(self.follower.batch), ['E1AAAAAA.2019-01-01-10.bbbbbbbb.gz'])
+
+        # Kept past the lookback window until archived
+        self.deliver(13, 'aaaaaaaa', 'c')
+        self.assertEqual(self.follower.poll(), 1)
+        failing.clear()
+        self.assertEqual(len(self.follower.flush()), 2)
+        self.assertEqual(self.follower.batch, {})
+        log = self.store.access_log(self.store.item_key(['2019-01-01']))
+        self.assertEqual(sorted(log.column('id')), ['a', 'b', 'c'])
+
+    def test_run_survives_errors(self):
+        self.deliver(10, 'aaaaaaaa', 'a')
+        list_objects = self.s3.list_objects_v2
+        calls = []
+        def flaky(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise IOError('transient')
+            return list_objects(**kwargs)
+        self.s3.list_objects_v2 = flaky
+        with patch('awslogparse.cf_follow.time.sleep') as sleep, \
+             open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                self.follower.run(poll_interval=1, iterations=3)
+            finally:
+                sys.stdout = stdout
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [2, 1])
+        log = self.store.access_log(self.store.item_key(['2019-01-01']))
+        self.assertEqual(log.column('id'), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
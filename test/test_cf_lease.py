@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile, threading
+import unittest
+from unittest.mock import MagicMock
+
+from awslogparse import cf_lease as LL
+from awslogparse import cf_archiver as archiver
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(date, hour, n, tag):
+    return AccessLog('1.0', HEADERS,
+                     [[date, '{}:{:02}:00'.format(hour, i)] + [''] * 12
+                      + ['{}{}'.format(tag, i)] for i in range(n)])
+
+
+class TestLease(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shard_of(self):
+        self.assertEqual(LL.shard_of('pre/E2ABCDEF12.2019-06-09-17.ab3a8cd4.gz'),
+                         'E2ABCDEF12.2019-06-09-17')
+        self.assertIsNone(LL.shard_of('2019/06/2019-06-09.gz'))
+
+    def test_file_lease(self):
+        self.assertTrue(self.store.acquire_lease('a', 'w1', 60))
+        self.assertFalse(self.store.acquire_lease('a', 'w2', 60))
+        # Renewal by the owner
+        self.assertTrue(self.store.acquire_lease('a', 'w1', 60))
+        self.assertFalse(self.store.release_lease('a', 'w2'))
+        self.assertTrue(self.store.release_lease('a', 'w1'))
+        self.assertTrue(self.store.acquire_lease('a', 'w2', 60))
+
+    def test_expired_lease(self):
+        self.assertTrue(self.store.acquire_lease('a', 'w1', -1))
+        self.assertTrue(self.store.acquire_lease('a', 'w2', 60))
+        self.assertFalse(self.store.acquire_lease('a', 'w1', 60))
+
+    def test_unreadable_lease(self):
+        # Partially written leases are held until BREAK_TIMEOUT after mtime
+        path = self.store.lease_path('a')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fd:
+            fd.write(b'{"own')
+        self.assertFalse(self.store.acquire_lease('a', 'w1', 60))
+        mtime = os.stat(path).st_mtime - LL.BREAK_TIMEOUT - 1
+        os.utime(path, (mtime, mtime))
+        self.assertTrue(self.store.acquire_lease('a', 'w1', 60))
+        self.assertEqual(self.store.read_lease('a')['owner'], 'w1')
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_release_done(self):
+        self.assertIsNone(self.store.read_lease('a'))
+        self.assertTrue(self.store.acquire_lease('a', 'w1', 60))
+        self.assertTrue(self.store.release_lease('a', 'w1', ['k1']))
+        self.assertEqual(self.store.read_lease('a')['done'], ['k1'])
+        self.assertTrue(self.store.acquire_lease('a', 'w2', 60))
+
+    def test_archive_shared_done(self):
+        keys = ['E1AAAAAA.2019-01-01-10.aaaaaaa{}.gz'.format(i) for i in range(2)]
+        in_store = MagicMock()
+        in_store.access_log = lambda key: make_log('2019-01-01', 10, 5, key[-4])
+        out_store = DataStoreLocal(self.tmp.name)
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            self.assertEqual(archiver.archive_shared(keys[:1], in_store, out_store), keys[:1])
+            # Done shards are skipped, late keys process the shard again
+            self.assertEqual(archiver.archive_shared(keys[:1], in_store, out_store), [])
+            self.assertEqual(archiver.archive_shared(keys, in_store, out_store), keys)
+            self.assertEqual(out_store.read_lease('shard/E1AAAAAA.2019-01-01-10')['done'],
+                             keys)
+
+            # Unread keys are neither deleted nor recorded as done
+            failed = 'E1AAAAAA.2019-01-01-11.aaaaaaa0.gz'
+            good = 'E1AAAAAA.2019-01-01-11.aaaaaaa1.gz'
+            access_log = in_store.access_log
+            in_store.access_log = lambda key: None if key == failed else access_log(key)
+            self.assertEqual(archiver.archive_shared([failed, good], in_store, out_store,
+                                                     delete_from_instore=True), [good])
+            in_store.delete_list.assert_called_with(keys=[good])
+            self.assertEqual(out_store.read_lease('shard/E1AAAAAA.2019-01-01-11')['done'],
+                             [good])
+            in_store.access_log = access_log
+            self.assertEqual(archiver.archive_shared([failed, good], in_store, out_store),
+                             [failed, good])
+
+            # Abandoned once the expired lease is taken over
+            late = 'E1AAAAAA.2019-01-01-10.aaaaaaa2.gz'
+            def steal(key):
+                out_store.acquire_lease('shard/E1AAAAAA.2019-01-01-10', 'w2', 60)
+                return make_log('2019-01-01', 10, 5, 'x')
+            in_store.access_log = steal
+            self.assertEqual(archiver.archive_shared(keys + [late], in_store, out_store,
+                                                     owner='w1', ttl=-1), [])
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertEqual(out_store.read_lease('shard/E1AAAAAA.2019-01-01-10')['owner'], 'w2')
+
+    def test_archive_shared(self):
+        # Two shards of one day, each delivered twice to both workers
+        keys = ['E1AAAAAA.2019-01-01-{:02}.aaaaaa{}.gz'.format(h, h)
+                for h in (10, 11)]
+        logs = {keys[0]: make_log('2019-01-01', 10, 50, 'a'),
+                keys[1]: make_log('2019-01-01', 11, 50, 'b')}
+        in_store = MagicMock()
+        in_store.access_log = lambda key: AccessLog('1.0', HEADERS,
+                                                    list(logs[key].rows))
+
+        processed = []
+        def worker():
+            processed.extend(archiver.archive_shared(keys, in_store,
+                                                     DataStoreLocal(self.tmp.name),
+                                                     poll=0.01))
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(set(processed), set(keys))
+        log = self.store.access_log(self.store.item_key(['2019-01-01']))
+        self.assertEqual(log.record_count(), 100)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+
+import os, sys, json, tempfile
+import unittest
+
+from awslogparse import cf_archiver as archiver
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_metrics import Metrics, NullMetrics, Histogram
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(rows):
+    return AccessLog('1.0', HEADERS, [[d, t] + ['x'] * 12 + [i] for d, t, i in rows])
+
+
+class MemoryStore(DataStoreLocal):
+    # Input store returning fixed logs
+    def __init__(self, logs):
+        self.logs = logs
+
+    def access_log(self, key):
+        return make_log(self.logs[key])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counters(self):
+        m = Metrics()
+        m.inc('rows_parsed', 3)
+        m.inc('rows_parsed', 2)
+        m.inc('objects_fetched', store='s3')
+        self.assertEqual(m.counter('rows_parsed'), 5)
+        self.assertEqual(m.counter('objects_fetched', store='s3'), 1)
+        self.assertEqual(m.counter('objects_fetched'), 0)
+
+    def test_histogram(self):
+        h = Histogram((1, 2, 4))
+        for v in [0.5, 1.5, 1.5, 3, 10]:
+            h.observe(v)
+        self.assertEqual(h.counts, [1, 2, 1, 1])
+        self.assertEqual(h.quantile(0.5), 2)
+        self.assertEqual(h.quantile(1), 10)
+
+    def test_prometheus(self):
+        m = Metrics()
+        m.inc('rows_written', 7)
+        m.observe('stage_seconds', 0.002, stage='parse')
+        text = m.prometheus()
+        self.assertIn('# TYPE awslogparse_rows_written_total counter', text)
+        self.assertIn('awslogparse_rows_written_total 7', text)
+        self.assertIn('awslogparse_stage_seconds_bucket{stage="parse",le="0.001"} 0', text)
+        self.assertIn('awslogparse_stage_seconds_bucket{stage="parse",le="0.005"} 1', text)
+        self.assertIn('awslogparse_stage_seconds_bucket{stage="parse",le="+Inf"} 1', text)
+        self.assertIn('awslogparse_stage_seconds_count{stage="parse"} 1', text)
+
+    def test_summary(self):
+        m = Metrics()
+        m.observe('stage_seconds', 3, stage='fetch')
+        m.observe('stage_seconds', 1, stage='parse')
+        summary = json.loads(m.dumps())
+        self.assertEqual(list(summary['stages']), ['fetch', 'parse'])
+        self.assertEqual(summary['stages']['fetch']['share'], 0.75)
+
+    def test_write(self):
+        m = Metrics()
+        m.inc('rows_written')
+        with tempfile.TemporaryDirectory() as tmp:
+            m.write(os.path.join(tmp, 'm.prom'))
+            m.write(os.path.join(tmp, 'm.json'))
+            with open(os.path.join(tmp, 'm.prom')) as fd:
+                self.assertIn('awslogparse_rows_written_total 1', fd.read())
+            with open(os.path.join(tmp, 'm.json')) as fd:
+                self.assertEqual(json.load(fd)['counters']['rows_written'], 1)
+
+    def test_null(self):
+        m = NullMetrics()
+        m.inc('rows_written')
+        with m.timer('parse'):
+            pass
+        self.assertEqual(m.summary(), {'counters': {}, 'stages': {}})
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_archive(self):
+        logs = {'k1': [('2019-01-01', '00:00:01', 'a'), ('2019-01-01', '00:00:02', 'b')],
+                'k2': [('2019-01-01', '00:00:02', 'b'), ('2019-01-02', '00:00:01', 'c')]}
+        m = Metrics()
+        with tempfile.TemporaryDirectory() as tmp:
+            out_store = DataStoreLocal(tmp).enable_metrics(m)
+            archiver.archive(['k1', 'k2'], MemoryStore(logs), out_store)
+            self.assertEqual(m.counter('rows_written'), 3)
+            self.assertEqual(m.counter('duplicates_dropped'), 1)
+
+            out_store.select('*').daterange(['2019-01-01', '2019-01-02']).execute()
+        self.assertEqual(m.counter('objects_fetched'), 2)
+        self.assertEqual(m.counter('rows_parsed'), 3)
+        self.assertEqual(m.counter('rows_filtered'), 3)
+        self.assertEqual(m.counter('keys_scanned'), 2)
+        self.assertGreater(m.counter('bytes_uploaded'), 0)
+        stages = m.summary()['stages']
+        for stage in ['sort', 'merge', 'compress', 'upload', 'fetch',
+                      'decompress', 'parse', 'filter']:
+            self.assertIn(stage, stages)
+
+    def test_archive_rerun(self):
+        logs = {'k1': [('2019-01-01', '00:00:01', 'a')],
+                'k2': [('2019-01-02', '00:00:01', 'b')]}
+        m = Metrics()
+        with tempfile.TemporaryDirectory() as tmp:
+            out_store = DataStoreLocal(tmp).enable_metrics(m)
+            archiver.archive(['k1', 'k2'], MemoryStore(logs), out_store)
+            uploaded = m.counter('bytes_uploaded')
+            # Reruns find no new records, and write nothing
+            archiver.archive(['k1', 'k2'], MemoryStore(logs), out_store)
+        self.assertEqual(m.counter('writes_skipped'), 2)
+        self.assertEqual(m.counter('bytes_uploaded'), uploaded)
+        self.assertEqual(m.counter('rows_written'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+import os, sys, io, gzip, tempfile
+import unittest
+
+from awslogparse import cf_parallel as PL
+from awslogparse.cf_accesslog import AccessLog, Equals
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_metrics import Metrics
+from awslogparse.cf_rawlog import RawLog
+
+
+HEADERS = ['date', 'time', 'status', 'id']
+
+
+def make_data(n):
+    # Unsorted rows, so that sorting on load is observable
+    lines = ['#Version: 1.0', '#Fields: ' + ' '.join(HEADERS)]
+    for i in range(n):
+        j = (i * 7) % n
+        lines.append('\t'.join(['2019-01-01', '{:02}:{:02}:{:02}'.format(
+            j // 3600, j // 60 % 60, j % 60), '500' if j % 3 == 0 else '200', str(j)]))
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+class TestChunks(unittest.TestCase):
+    def test_iter_chunks(self):
+        data = b'a\nbb\nccc\n' * 5 + b'tail'
+        chunks = list(PL.iter_chunks(io.BytesIO(data), 7))
+        self.assertEqual(b''.join(chunks), data)
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b'\n'))
+        self.assertEqual(chunks[-1], b'tail')
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.data = make_data(500)
+        self.log = AccessLog.loads(self.data)
+
+    def test_load(self):
+        m = Metrics()
+        log = AccessLog.loads(self.data, m, workers=2, chunk_bytes=1024)
+        self.assertEqual(log.headers, HEADERS)
+        self.assertEqual(log.rows, self.log.rows)
+        self.assertEqual(m.counter('rows_parsed'), 500)
+        self.assertEqual(m.counter('bytes_decompressed'), len(gzip.decompress(self.data)))
+
+        fd = gzip.GzipFile(fileobj=io.BytesIO(self.data))
+        self.assertEqual(AccessLog.load(fd, workers=2, chunk_bytes=1024).rows,
+                         self.log.rows)
+
+    def test_single_chunk(self):
+        log = AccessLog.loads(self.data, workers=2)
+        self.assertEqual(log.rows, self.log.rows)
+
+    def test_select(self):
+        raw = RawLog.loads(self.data)
+        queries = [(['id'], {'status': '^5'}, {}),
+                   ('*', {'status': Equals('200')}, {'limit': 30}),
+                   (['time', 'id'], {'status': '^5'}, {'limit': 40, 'reverse': True}),
+                   (['id'], {}, {'limit': 0})]
+        for columns, conditions, kwargs in queries:
+            with self.subTest(conditions=conditions, **kwargs):
+                expected = raw.select(columns, conditions, **kwargs)
+                res = PL.selects(self.data, columns, conditions, 2, 512, **kwargs)
+                self.assertEqual(res.headers, expected.headers)
+                self.assertEqual(res.rows, expected.rows)
+
+    def test_version(self):
+        data = b'#Version: 2.0\n#Fields: a\nx\n'
+        self.assertEqual(PL.loads(data, 2).rows, [])
+        self.assertEqual(PL.selects(data, '*', {}, 2).rows, [])
+
+
+class TestDataStoreParallel(unittest.TestCase):
+    def test_select(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_parallel_parsing(2, 512)
+            key = store.item_key(['2019-01-01'])
+            store.overwrite(key, AccessLog.loads(make_data(300)))
+            res = store.select(['id']).where({'status': '^5'}) \
+                       .order_by('time', desc=True).limit(3).execute()
+            self.assertEqual(res.rows, [['297'], ['294'], ['291']])
+            self.assertEqual(store.access_log(key).record_count(), 300)
+
+            # One pool serves all files of the store, until closed
+            pool = store.parse_pool()
+            store.overwrite(store.item_key(['2019-01-02']), AccessLog.loads(make_data(300)))
+            self.assertEqual(len(store.select(['id']).where({'status': '^5'}).execute().rows),
+                             200)
+            self.assertIs(store.parse_pool(), pool)
+            store.close()
+            self.assertIsNone(store.parse_executor)
+            self.assertEqual(store.access_log(key).record_count(), 300)
+            self.assertIsNot(store.parse_pool(), pool)
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
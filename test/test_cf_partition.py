@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from awslogparse import cf_partition as PT
+from awslogparse import cf_compactor as CP
+from awslogparse import cf_archiver as archiver
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_partition import PartitionScheme
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(rows):
+    return AccessLog('1.0', HEADERS,
+                     [[d, t] + [''] * 12 + [str(i)] for i, (d, t) in enumerate(rows)])
+
+
+class TestPartitionScheme(unittest.TestCase):
+    def test_distribution_id(self):
+        self.assertEqual(PT.distribution_id('pre/E2ABCDEF12.2019-06-09-17.ab3a8cd4.gz'),
+                         'E2ABCDEF12')
+        self.assertIsNone(PT.distribution_id('2019/06/2019-06-09.gz'))
+
+    def test_path(self):
+        row = ['2019-01-02', '13:10:10']
+        self.assertEqual(PartitionScheme().path(row, extension='.gz'),
+                         ['2019', '01', '2019-01-02.gz'])
+        self.assertEqual(PartitionScheme(hourly=True).path(row, 'E1', '.gz'),
+                         ['2019', '01', '2019-01-02-13.gz'])
+        self.assertEqual(PartitionScheme(True, True).path(row, 'E1', '.gz'),
+                         ['E1', '2019', '01', '2019-01-02-13.gz'])
+        with self.assertRaises(ValueError):
+            PartitionScheme(by_distribution=True).path(row)
+
+    def test_sort_keys(self):
+        keys = ['E2/2019/01/2019-01-01-05.gz', 'E1/2019/01/2019-01-02-00.gz',
+                'E1/2019/01/2019-01-01-06.gz']
+        self.assertEqual(PT.sort_keys(keys, '.gz'),
+                         [keys[0], keys[2], keys[1]])
+
+
+class TestPartitionedStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DataStoreLocal(self.tmp.name, PartitionScheme(hourly=True))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_store_hourly(self):
+        self.store.store(make_log([('2019-01-01', '10:00:00'),
+                                   ('2019-01-01', '10:30:00'),
+                                   ('2019-01-01', '11:00:00'),
+                                   ('2019-01-02', '00:00:00')]))
+        keys = self.store.list_keys()
+        self.assertEqual([os.path.basename(k) for k in keys],
+                         ['2019-01-01-10.gz', '2019-01-01-11.gz',
+                          '2019-01-02-00.gz'])
+        self.assertEqual(self.store.access_log(keys[0]).record_count(), 2)
+        self.assertEqual(self.store.list_keys(date_range=['2019-01-01', '2019-01-01']),
+                         keys[:2])
+
+        # Late data rewrites only its own hour
+        self.store.store(make_log([('2019-01-01', '11:59:00')]))
+        self.assertEqual(self.store.access_log(keys[1]).record_count(), 2)
+
+        CP.compact(self.store, before='2019-02')
+        self.assertEqual(self.store.list_day_keys(), [])
+        self.assertEqual(self.store.list_keys(), keys)
+        self.assertEqual(self.store.access_log(keys[0]).record_count(), 2)
+
+    def test_archive_by_distribution(self):
+        store = DataStoreLocal(self.tmp.name, PartitionScheme(by_distribution=True))
+        keys = ['E1AAAAAA.2019-01-01-10.aaaaaaaa.gz',
+                'E2BBBBBB.2019-01-01-10.bbbbbbbb.gz']
+        logs = {keys[0]: make_log([('2019-01-01', '10:00:00')]),
+                keys[1]: make_log([('2019-01-01', '10:05:00'),
+                                   ('2019-01-01', '10:06:00')])}
+        in_store = MagicMock()
+        in_store.access_log = lambda key: logs[key]
+        self.assertEqual(archiver.archive(keys, in_store, store), keys)
+        self.assertEqual(store.list_keys(),
+                         [os.path.join(self.tmp.name, 'E1AAAAAA', '2019', '01', '2019-01-01.gz'),
+                          os.path.join(self.tmp.name, 'E2BBBBBB', '2019', '01', '2019-01-01.gz')])
+        self.assertEqual(store.select(['id']).execute().rows, [['0'], ['0'], ['1']])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
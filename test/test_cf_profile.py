@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import os, sys, time, glob, tempfile
+import unittest
+
+from awslogparse import cf_profile as PF
+from awslogparse.cf_profile import Profiler
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastore import DataStoreBase
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse import cf_metrics as MT
+
+
+HEADERS = ['date', 'time'] + ['h{}'.format(i) for i in range(12)] + ['id']
+
+
+def make_log(n):
+    return AccessLog('1.0', HEADERS, [['2019-01-01', '00:00:{:02d}'.format(i % 60)]
+                                      + ['x'] * 12 + [str(i)] for i in range(n)])
+
+
+def busy(seconds):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sample(self):
+        with Profiler(self.tmp.name, interval=0.001) as p:
+            with p.timer('parse'):
+                busy(0.1)
+        path = glob.glob(os.path.join(self.tmp.name, 'profile-*.collapsed'))[0]
+        with open(path) as fd:
+            lines = fd.read().splitlines()
+        self.assertTrue(any(l.startswith('parse;') and 'test_cf_profile:busy' in l
+                            for l in lines))
+        self.assertTrue(all(int(l.rsplit(' ', 1)[1]) > 0 for l in lines))
+        self.assertEqual(len(glob.glob(os.path.join(self.tmp.name, 'metrics-*.json'))), 1)
+
+    def test_cprofile(self):
+        with Profiler(self.tmp.name, mode='cprofile') as p:
+            with p.timer('sort'):
+                make_log(100).sort()
+        with open(glob.glob(os.path.join(self.tmp.name, 'profile-*.txt'))[0]) as fd:
+            self.assertIn('sort', fd.read())
+        self.assertEqual(len(glob.glob(os.path.join(self.tmp.name, 'profile-*.pstats'))), 1)
+
+    def test_allocations(self):
+        with Profiler(self.tmp.name, allocations=5) as p:
+            for i in range(5):
+                with p.timer('parse'):
+                    log = make_log(1000)
+        self.assertEqual(p.snapshot_counts['parse'], 3)
+        with open(glob.glob(os.path.join(self.tmp.name, 'allocations-*.txt'))[0]) as fd:
+            text = fd.read()
+        self.assertIn('parse (first 3 calls)', text)
+        self.assertIn('test_cf_profile.py', text)
+
+    def test_install(self):
+        with Profiler(self.tmp.name).install() as p:
+            store = DataStoreLocal(self.tmp.name)
+            self.assertIs(store.metrics, p)
+            store.store(make_log(100))
+            store.access_log(store.list_keys()[0])
+        self.assertIs(DataStoreBase.metrics, MT.NULL)
+        self.assertEqual(p.counter('rows_written'), 100)
+        self.assertIn('parse', p.summary()['stages'])
+
+    def test_environment(self):
+        self.assertIsNone(PF.from_environment({}))
+        p = PF.from_environment({PF.ENV_DIR: self.tmp.name, PF.ENV_MODE: 'cprofile',
+                                 PF.ENV_ALLOCATIONS: '4'})
+        self.assertEqual((p.out_dir, p.mode, p.allocations), (self.tmp.name, 'cprofile', 4))
+        with self.assertRaises(ValueError):
+            PF.from_environment({PF.ENV_DIR: self.tmp.name, PF.ENV_MODE: 'perf'})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+import os, sys, gzip, tempfile
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog, Equals, Between
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_metrics import Metrics
+from awslogparse.cf_rawlog import RawLog
+
+
+HEADERS = ['date', 'time', 'ua', 'status', 'id']
+
+
+def make_log(n):
+    rows = [['2019-01-01', '{:02}:{:02}:{:02}'.format(i // 3600, i // 60 % 60, i % 60),
+             'caf%C3%A9' if i % 2 else 'curl', '500' if i % 3 == 0 else '200', str(i)]
+            for i in range(n)]
+    return AccessLog('1.0', HEADERS, rows)
+
+
+def dumps(log):
+    lines = ['#Version: 1.0', '#Fields: ' + ' '.join(log.headers)]
+    lines += ['\t'.join(r) for r in log.rows]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class TestRawLog(unittest.TestCase):
+    def setUp(self):
+        self.log = make_log(20)
+        self.raw = RawLog.loads(gzip.compress(dumps(self.log)))
+
+    def test_access_log(self):
+        self.assertEqual(self.raw.version, '1.0')
+        self.assertEqual(self.raw.headers, HEADERS)
+        self.assertEqual(self.raw.record_count(), 20)
+        self.assertEqual(self.raw.access_log().rows, self.log.rows)
+
+    def test_record(self):
+        record = self.raw.record(3)
+        self.assertEqual(len(record), len(HEADERS))
+        self.assertEqual(bytes(record.field(3)), b'500')
+        self.assertEqual(record[4], '3')
+        self.assertEqual(record.to_list(), self.log.rows[3])
+        with self.assertRaises(IndexError):
+            record.field(len(HEADERS))
+
+    def test_select(self):
+        queries = [(['id'], {'status': '^5'}, {}),
+                   (['id', 'ua'], {'ua': 'caf', 'status': '^200$'}, {}),
+                   ('*', {'ua': Equals('curl')}, {'limit': 3}),
+                   (['time'], {'id': Between(4, 9)}, {'reverse': True}),
+                   (['id'], {'ua': '%C3.9$'}, {'limit': 2, 'reverse': True}),
+                   (['id'], {}, {'limit': 0})]
+        for columns, conditions, kwargs in queries:
+            with self.subTest(conditions=conditions, **kwargs):
+                expected = self.log.select(columns, conditions, **kwargs)
+                res = self.raw.select(columns, conditions, **kwargs)
+                self.assertEqual(res.headers, expected.headers)
+                self.assertEqual(res.rows, expected.rows)
+
+    def test_whitespace(self):
+        data = b'#Version: 1.0\r\n#Fields: a b\r\nx\ty \r\n\nz\t\r\n'
+        raw = RawLog(data)
+        self.assertEqual(raw.headers, ['a', 'b'])
+        self.assertEqual(raw.access_log().rows, [['x', 'y'], [''], ['z']])
+        self.assertEqual(raw.select(['a', 'b'], {'b': '^$'}).rows,
+                         [['', ''], ['z', '']])
+
+    def test_version(self):
+        raw = RawLog(b'#Version: 2.0\n#Fields: a\nx\n')
+        self.assertEqual(raw.version, '2.0')
+        self.assertEqual(raw.record_count(), 0)
+
+
+class TestDataStoreRaw(unittest.TestCase):
+    def test_select_key(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            m = Metrics()
+            store = DataStoreLocal(db_dir).enable_metrics(m)
+            store.overwrite(store.item_key(['2019-01-01']), make_log(10))
+            store.access_log = None
+            res = store.select(['id']).where({'status': '^5'}).execute()
+            self.assertEqual(res.rows, [['0'], ['3'], ['6'], ['9']])
+            self.assertEqual(m.counter('rows_parsed'), 10)
+            self.assertNotIn('sort', m.summary()['stages'])
+
+    def test_cache(self):
+        # Cached stores select over parsed logs, to populate the cache
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_cache()
+            key = store.item_key(['2019-01-01'])
+            store.overwrite(key, make_log(10))
+            res = store.select(['id']).where({'id': '^1'}).execute()
+            self.assertEqual(res.rows, [['1']])
+            self.assertIn(key, store.cache.entries)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+
+from awslogparse.cf_accesslog import AccessLog, AccessLogQuery
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from awslogparse.cf_resultcache import QueryResultCache, plan_key
+
+
+def make_log(date, n):
+    return AccessLog('1.0', ['date', 'time', 'sc-status'],
+                     [[date, '10:00:{:02}'.format(i), '200' if i % 2 else '404']
+                      for i in range(n)])
+
+
+class TestQueryResultCache(unittest.TestCase):
+    def test_plan_key(self):
+        self.assertEqual(plan_key('*', {'a': '1', 'b': '2'}),
+                         plan_key('[*]', {'b': '2', 'a': '1'}))
+        self.assertNotEqual(plan_key('*', {}, limit=1), plan_key('*', {}))
+
+    def test_fingerprint_mismatch(self):
+        cache = QueryResultCache()
+        cache.put('plan', 'k', 1, AccessLogQuery([['a']], ['col']))
+        self.assertEqual(cache.get('plan', 'k', 1).rows, [['a']])
+        self.assertIsNone(cache.get('plan', 'k', 2))
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as root:
+            QueryResultCache(root_dir=root).put('plan', 'k', 1,
+                                                AccessLogQuery([['a']], ['col']))
+            res = QueryResultCache(root_dir=root).get('plan', 'k', 1)
+            self.assertEqual(res.rows, [['a']])
+            self.assertEqual(res.headers, ['col'])
+
+    def test_selector_recomputes_changed_keys(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir)
+            k1 = store.item_key(['2019-01-01'])
+            k2 = store.item_key(['2019-01-02'])
+            store.overwrite(k1, make_log('2019-01-01', 4))
+            store.overwrite(k2, make_log('2019-01-02', 4))
+
+            cache = QueryResultCache()
+            query = lambda: store.select(['date', 'time']) \
+                                 .where({'sc-status': '404'}) \
+                                 .cache(cache) \
+                                 .execute()
+            self.assertEqual(len(query().rows), 4)
+            self.assertEqual(len(query().rows), 4)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+            store.overwrite(k2, make_log('2019-01-02', 8))
+            self.assertEqual(len(query().rows), 6)
+            self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
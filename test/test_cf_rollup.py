@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from awslogparse import cf_rollup as RU
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from test import HEADERS, make_row
+
+
+ROWS = [
+    make_row('2019-01-01', time, reqid,
+             {'x-edge-location': edge, 'sc-bytes': nbytes, 'sc-status': status,
+              'x-edge-result-type': result})
+    for time, edge, nbytes, status, result, reqid in [
+        ('10:05:00', 'IAD', 100, '200', 'Hit', 'a'),
+        ('10:35:00', 'IAD', 200, '200', 'Miss', 'b'),
+        ('10:40:00', 'LHR', 300, '503', 'Error', 'c'),
+        ('11:10:00', 'IAD', 400, '404', 'Miss', 'd'),
+        ('11:50:00', 'IAD', 500, '200', 'RefreshHit', 'e'),
+    ]
+]
+
+
+class TestRollupTable(unittest.TestCase):
+    def test_from_log(self):
+        table = RU.RollupTable.from_log(AccessLog('1.0', HEADERS, ROWS))
+        self.assertEqual(table.entries[('2019-01-01', '10', '2xx', 'IAD')],
+                         [2, 300, 0, 1])
+        self.assertEqual(table.entries[('2019-01-01', '10', '5xx', 'LHR')],
+                         [1, 300, 1, 0])
+
+    def test_group(self):
+        table = RU.RollupTable.from_log(AccessLog('1.0', HEADERS, ROWS))
+        rows = table.group(['hour'])
+        self.assertEqual(rows[0][:5], ['10', 3, 600, 1, 1])
+        self.assertEqual(rows[1][:5], ['11', 2, 900, 0, 1])
+        self.assertEqual(rows[1][6], 0.5)
+
+    def test_roundtrip(self):
+        table = RU.RollupTable.from_log(AccessLog('1.0', HEADERS, ROWS))
+        loaded = RU.RollupTable.loads(table.dumps())
+        self.assertEqual(loaded.entries, table.entries)
+
+
+class TestSelectorRollup(unittest.TestCase):
+    def test_rollup_partial_hours(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_rollups()
+            store.store(AccessLog('1.0', HEADERS, list(ROWS)))
+            key = store.item_key(['2019-01-01'])
+            self.assertTrue(os.path.exists(key + RU.SIDECAR_SUFFIX))
+
+            # Whole-day ranges come from the sidecar only
+            store.access_log = MagicMock()
+            res = store.select('*').daterange(['2019-01-01', '2019-01-01']) \
+                                   .rollup(['date'])
+            self.assertEqual(res.rows[0][:5], ['2019-01-01', 5, 1500, 1, 2])
+            store.access_log.assert_not_called()
+
+            # Partial hour 10:30-11:00 is rescanned from raw data
+            del store.access_log
+            res = store.select('*') \
+                       .timerange(['2019-01-01 10:30:00', '2019-01-01 12:00:00']) \
+                       .rollup(['hour'])
+            self.assertEqual([r[:2] for r in res.rows], [['10', 2], ['11', 2]])
+
+    def test_stale_sidecar(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_rollups()
+            store.store(AccessLog('1.0', HEADERS, list(ROWS)))
+            key = store.item_key(['2019-01-01'])
+
+            # Overwritten by a store without rollups
+            DataStoreLocal(db_dir).overwrite(key, AccessLog('1.0', HEADERS, ROWS[:2]))
+            res = store.select('*').daterange(['2019-01-01', '2019-01-01']) \
+                                   .rollup(['date'])
+            self.assertEqual(res.rows[0][:2], ['2019-01-01', 2])
+
+    def test_partial_hour_of_deleted_key(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_rollups()
+            store.store(AccessLog('1.0', HEADERS, list(ROWS)))
+            store.access_log = MagicMock(return_value=None)
+            res = store.select('*') \
+                       .timerange(['2019-01-01 10:30:00', '2019-01-01 12:00:00']) \
+                       .rollup(['hour'])
+            self.assertEqual([r[:2] for r in res.rows], [['11', 2]])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import os, sys, tempfile
+import unittest
+
+from awslogparse import cf_sketch as SK
+from awslogparse.cf_accesslog import AccessLog
+from awslogparse.cf_datastorelocal import DataStoreLocal
+from test import HEADERS, make_row
+
+
+class TestSketches(unittest.TestCase):
+    def test_hll_count(self):
+        hll = SK.HyperLogLog()
+        for i in range(5000):
+            hll.add('10.0.{}.{}'.format(i // 256, i % 256))
+        self.assertAlmostEqual(hll.count(), 5000, delta=5000 * 0.03)
+
+    def test_hll_merge(self):
+        a = SK.HyperLogLog()
+        b = SK.HyperLogLog()
+        for i in range(1000):
+            a.add(str(i))
+            b.add(str(i + 500))
+        a.merge(b)
+        self.assertAlmostEqual(a.count(), 1500, delta=1500 * 0.03)
+
+    def test_cms_top_k(self):
+        cms = SK.CountMinSketch(capacity=8)
+        for i in range(200):
+            cms.add('/rare/{}'.format(i))
+        for i in range(100):
+            cms.add('/hot')
+        for i in range(50):
+            cms.add('/warm')
+        top = cms.top_k(2)
+        self.assertEqual([v for v, n in top], ['/hot', '/warm'])
+        self.assertGreaterEqual(top[0][1], 100)
+
+    def test_roundtrip(self):
+        sketch = SK.ColumnSketch()
+        for v in ['a', 'b', 'b', 'c']:
+            sketch.add(v)
+        loaded = SK.loads(SK.dumps({'col': sketch}))['col']
+        self.assertEqual(loaded.hll.count(), 3)
+        self.assertEqual(loaded.cms.top_k(1), [('b', 2)])
+
+
+class TestSelectorSketches(unittest.TestCase):
+    def test_approx_queries(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_sketches(['c-ip', 'cs-uri-stem'])
+            rows = []
+            for i in range(30):
+                date = '2019-01-0{}'.format(1 + i % 3)
+                uri = '/index.html' if i % 2 else '/img/{}.png'.format(i)
+                rows.append(make_row(date, '10:00:{:02}'.format(i), 'r{}'.format(i),
+                                     {'c-ip': '10.0.0.{}'.format(i % 7),
+                                      'cs-uri-stem': uri}))
+            store.store(AccessLog('1.0', HEADERS, rows).sort())
+
+            key = store.item_key(['2019-01-01'])
+            self.assertTrue(os.path.exists(key + SK.SIDECAR_SUFFIX))
+
+            sel = store.select('*').daterange(['2019-01-01', '2019-01-03'])
+            self.assertEqual(sel.approx_distinct('c-ip'), 7)
+            self.assertEqual(sel.top_k('cs-uri-stem', 1), [('/index.html', 15)])
+
+            # Conditions fall back to scanning the matching rows
+            sel.where({'c-ip': '^10.0.0.1$'})
+            self.assertEqual(sel.approx_distinct('c-ip'), 1)
+
+            store.delete(key)
+            self.assertFalse(os.path.exists(key + SK.SIDECAR_SUFFIX))
+
+    def test_stale_sidecar(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            store = DataStoreLocal(db_dir).enable_sketches(['c-ip'])
+            rows = [make_row('2019-01-01', '10:00:0{}'.format(i), 'r{}'.format(i),
+                             {'c-ip': '10.0.0.{}'.format(i)}) for i in range(3)]
+            key = store.item_key(['2019-01-01'])
+            store.overwrite(key, AccessLog('1.0', HEADERS, rows))
+            sel = store.select('*').daterange(['2019-01-01', '2019-01-01'])
+            self.assertEqual(sel.approx_distinct('c-ip'), 3)
+
+            # Overwritten by a store without sketches, e.g. the CLI
+            rows.append(make_row('2019-01-01', '11:00:00', 'r9', {'c-ip': '10.0.0.9'}))
+            DataStoreLocal(db_dir).overwrite(key, AccessLog('1.0', HEADERS, rows))
+            self.assertTrue(os.path.exists(key + SK.SIDECAR_SUFFIX))
+            self.assertIsNone(store.read_checked_sidecar(key, SK.SIDECAR_SUFFIX))
+            self.assertEqual(sel.approx_distinct('c-ip'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)